@@ -0,0 +1,165 @@
+import os
+import json
+import uuid
+import logging
+from pathlib import Path
+
+from lazy import lazy_import
+from checkpoint import write_frame, read_frame
+from readers import file_family, file_timestamp_text
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Column of a delta file telling whether its row was inserted, updated or deleted
+CDC_OP_COLUMN = 'cdc_op'
+
+
+def row_hashes(frame, columns=None):
+    """Return a uint64 hash per row of frame, over the given columns or all of them."""
+    return pd.util.hash_pandas_object(frame[columns] if columns is not None else frame, index=False).to_numpy()
+
+
+def diff_snapshots(previous, current, keys):
+    """Return the rows inserted, updated and deleted between two snapshots of a family, matched on keys.
+
+    A row is updated if a row with its keys was in the previous snapshot
+    with other values. Deleted rows are the previous versions. If keys are
+    not unique in a snapshot, the last row of every key counts.
+    """
+    previous = previous.iloc[~pd.Series(row_hashes(previous, keys)).duplicated(keep='last').to_numpy()]
+    current_keys = row_hashes(current, keys)
+    unique = ~pd.Series(current_keys).duplicated(keep='last').to_numpy()
+    if not unique.all():
+        logging.warning(f"{int((~unique).sum())} rows have the same {keys} as a later row; only the last one is compared")
+    current, current_keys = current.iloc[unique], current_keys[unique]
+
+    previous_rows = pd.Series(row_hashes(previous), index=row_hashes(previous, keys))
+    matched = pd.Index(previous_rows.index).get_indexer(current_keys)
+    inserted = matched == -1
+    updated = ~inserted
+    updated[updated] = previous_rows.to_numpy()[matched[updated]] != row_hashes(current)[updated]
+    deleted = ~np.isin(previous_rows.index.to_numpy(), current_keys)
+
+    return pd.concat([
+        current[inserted].assign(**{CDC_OP_COLUMN: 'insert'}),
+        current[updated].assign(**{CDC_OP_COLUMN: 'update'}),
+        previous[deleted].assign(**{CDC_OP_COLUMN: 'delete'}),
+    ], ignore_index=True)
+
+
+class LateDeliveryError(Exception):
+    """A delivery is older than the last captured delivery of its family, so it has no delta to give."""
+
+
+class ChangeCapture:
+    """The clean records of the last deliveries of every family, for emitting each new delivery as a delta.
+
+    Values are compared as the text written to the clean output, so a column
+    that parses to another type from one day to the next does not show up as
+    changed. A family's state names its last delivery and the one before,
+    each with a snapshot of its clean records. A new delivery is compared
+    with the last one; capturing the last delivery again, as when its file is
+    reprocessed, compares it with the one before, so it gives the same delta.
+    Deliveries older than the last one raise LateDeliveryError, and a
+    delivery with other keys starts the family over.
+
+    The delta and the new snapshot are written before the state is replaced,
+    and snapshots are only removed once no state names them, so a crash at
+    any point leaves the last delivery to be captured again in full.
+    """
+
+    def __init__(self, state_dir):
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+
+    def state_file(self, family):
+        return self.state_dir / f"{family}.json"
+
+    def snapshot_dir(self, family):
+        return self.state_dir / f"{family}.snapshots"
+
+    def load_state(self, family):
+        try:
+            with open(self.state_file(family), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, family, state):
+        """Atomically replace the family's state, which commits its new delivery."""
+        tmp_file = self.state_file(family).with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file(family))
+
+    def capture(self, present_file, clean_path, keys, delta_path):
+        """Write the delta of present_file against the family's previous delivery and keep its clean records.
+
+        Returns the insert, update and delete counts, or None if the family
+        has no earlier delivery with the same keys to compare against.
+        Raises LateDeliveryError if present_file is older than the family's
+        last delivery.
+        """
+        family = file_family(present_file)
+        state = self.load_state(family)
+        base = None  # {'file', 'snapshot'} of the delivery to compare against
+        if state is not None and state['keys'] == keys:
+            if present_file == state['file']:
+                base = state['previous']
+            elif file_timestamp_text(present_file) < file_timestamp_text(state['file']):
+                raise LateDeliveryError(f"{present_file} is older than {state['file']}, the last captured delivery "
+                                        f"of family {family}; remove {self.state_file(family)} to start the "
+                                        f"family over")
+            else:
+                base = {'file': state['file'], 'snapshot': state['snapshot']}
+
+        if clean_path is not None and Path(clean_path).exists():
+            current = pd.read_csv(clean_path, dtype=str, keep_default_na=False, encoding='utf-8')
+        else:
+            current = pd.DataFrame(columns=keys, dtype=str)
+        missing = [key for key in keys if key not in current.columns]
+        if missing:
+            logging.warning(f"Not capturing changes of {present_file}: key attributes {missing} not in its clean records")
+            return None
+
+        counts = None
+        if base is not None:
+            previous = read_frame(self.state_dir / base['snapshot'])
+            previous = previous.astype(str) if len(previous.columns) else pd.DataFrame(columns=keys, dtype=str)
+            delta = diff_snapshots(previous, current, keys)
+            tmp_path = Path(delta_path).with_name(Path(delta_path).name + '.tmp')
+            delta.to_csv(tmp_path, index=False, encoding='utf-8')
+            os.replace(tmp_path, delta_path)
+            counts = {op: int((delta[CDC_OP_COLUMN] == op).sum()) for op in ('insert', 'update', 'delete')}
+
+        snapshot = self.snapshot_dir(family) / f"{file_timestamp_text(present_file)}-{uuid.uuid4().hex[:12]}.arrow"
+        snapshot.parent.mkdir(exist_ok=True)
+        write_frame(snapshot, current)
+        self.save_state(family, {
+            'file': present_file,
+            'snapshot': snapshot.relative_to(self.state_dir).as_posix(),
+            'keys': keys,
+            'rows': len(current),
+            'previous': base,
+        })
+        self.remove_unused_snapshots(family)
+
+        if counts is None:
+            logging.info(f"No earlier delivery of family {family} with keys {keys}, keeping the full clean records")
+            return None
+        logging.info(f"Changes of {present_file} since {base['file']}: {counts['insert']} inserted, "
+                     f"{counts['update']} updated, {counts['delete']} deleted")
+        return counts
+
+    def remove_unused_snapshots(self, family):
+        """Remove the snapshots of a family that its state no longer names."""
+        state = self.load_state(family)
+        used = {Path(state['snapshot']).stem}
+        if state['previous'] is not None:
+            used.add(Path(state['previous']['snapshot']).stem)
+        for path in self.snapshot_dir(family).iterdir():
+            if path.stem not in used:
+                path.unlink()
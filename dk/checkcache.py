@@ -0,0 +1,150 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+
+from lazy import lazy_import
+from parsecache import content_hash
+from checkpoint import write_keys
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Bump when a check's implementation changes what it reports, so cached results are not reused.
+CHECKS_VERSION = 1
+
+
+def step_hashes(root, definitions):
+    """Return one hash per check step, chaining the file's content hash and every earlier step's definition.
+
+    A step's result depends on the rows the earlier steps left, so a changed
+    definition also changes the hashes of all the steps after it.
+    """
+    hashes = []
+    previous = f"{CHECKS_VERSION}|{root}"
+    for definition in definitions:
+        previous = hashlib.sha1(f"{previous}|{json.dumps(definition)}".encode('utf-8')).hexdigest()
+        hashes.append(previous)
+    return hashes
+
+
+class CheckCache:
+    """Per-check results of a file, stored with a hash of everything that decided them.
+
+    For each check step the cache keeps the rows it moved to the bad records,
+    the rows it removed from the clean records, the metadata it reported and
+    the columns it added, changed or dropped. When the file is processed again, every
+    step whose hash is unchanged is replayed from these results and only the
+    steps from the first changed definition on are run.
+    """
+
+    def __init__(self, cache_dir, file, source_path):
+        self.cache_dir = Path(cache_dir) / file
+        self.state_file = self.cache_dir / 'state.json'
+        self.source_path = Path(source_path)
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {'source': None, 'root': None, 'steps': [], 'complete': False}
+        except Exception as e:
+            logging.error(f"Error reading check cache {self.state_file}: {e}")
+            self.state = {'source': None, 'root': None, 'steps': [], 'complete': False}
+
+    def root(self):
+        """The sha1 of the source file, hashed again only if its size or mtime changed."""
+        stat = self.source_path.stat()
+        source = [stat.st_size, stat.st_mtime_ns]
+        if self.state['source'] != source or self.state['root'] is None:
+            self.state['source'] = source
+            self.state['root'] = content_hash(self.source_path)
+        return self.state['root']
+
+    def is_current(self, hashes):
+        """Check if every step of the file was completed with the given hashes."""
+        return self.state['complete'] and [step['hash'] for step in self.state['steps']] == hashes
+
+    def cached_steps(self, hashes):
+        """Number of leading steps whose cached results can be replayed."""
+        count = 0
+        for step, expected in zip(self.state['steps'], hashes):
+            if step['hash'] != expected or not step['cacheable']:
+                break
+            count += 1
+        return count
+
+    def step_dir(self, index):
+        return self.cache_dir / f"step-{index:02d}"
+
+    def load_result(self, index):
+        """Load the stored result of a step, see save_result."""
+        step = self.state['steps'][index]
+        directory = self.step_dir(index)
+        values = {}
+        for position, name in enumerate(step['values']):
+            array = np.load(directory / f"values-{position}.npy")
+            values[name] = array.astype(object) if array.dtype.kind == 'U' else array
+        return {
+            'bad': np.load(directory / 'bad.npy'),
+            'removed': np.load(directory / 'removed.npy'),
+            'metadata': step['metadata'],
+            'columns': step['columns'],
+            'values': values,
+        }
+
+    def begin(self, steps_to_keep):
+        """Drop the results of the steps that are about to be run again."""
+        for index in range(steps_to_keep, len(self.state['steps'])):
+            shutil.rmtree(self.step_dir(index), ignore_errors=True)
+        del self.state['steps'][steps_to_keep:]
+        self.state['complete'] = False
+
+    def save_result(self, index, step_hash, result):
+        """Store the result of a step that was just run.
+
+        result holds the labels of the rows the step appended to the bad
+        records and removed from the clean records, the metadata it reported
+        and, if it changed columns, the final column order with the values of
+        the new or changed columns. A step that both changes columns and
+        removes rows, or whose values cannot be stored exactly, is recorded as
+        not cacheable and always runs again.
+        """
+        directory = self.step_dir(index)
+        directory.mkdir(parents=True, exist_ok=True)
+        columns, names = result['columns'], list(result['values'])
+        cacheable = columns is None or not len(result['removed'])
+        try:
+            write_keys(directory / 'bad.npy', np.asarray(result['bad'], dtype=np.int64))
+            write_keys(directory / 'removed.npy', np.asarray(result['removed'], dtype=np.int64))
+            for position, name in enumerate(names if cacheable else []):
+                array = np.asarray(result['values'][name])
+                if array.dtype == object:
+                    if pd.api.types.infer_dtype(array, skipna=False) != 'string':
+                        raise ValueError(f"column {name} holds values other than strings")
+                    array = array.astype(str)
+                write_keys(directory / f"values-{position}.npy", array)
+        except Exception as e:
+            logging.debug(f"check step {index} of {self.source_path.name} is not cacheable because {e}")
+            cacheable = False
+        self.state['steps'].append({
+            'hash': step_hash,
+            'cacheable': cacheable,
+            'metadata': result['metadata'],
+            'columns': columns if cacheable else None,
+            'values': names if cacheable else [],
+        })
+
+    def finish(self):
+        """Mark the file as completely processed with the stored steps and save the state."""
+        self.state['complete'] = True
+        self.save()
+
+    def save(self):
+        """Atomically write the state file."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
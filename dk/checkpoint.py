@@ -0,0 +1,258 @@
+import os
+import json
+import shutil
+import logging
+from pathlib import Path
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+PARTITION_BITS = 8  # spilled keys are split into 2**PARTITION_BITS partitions by their top bits
+MAX_RUNS = 8  # runs a spilled partition may collect before they are merged
+# Parts holding arrays: key hashes of kept rows, first occurrences of kept keys and keys seen again
+ARRAY_PARTS = ('keys', 'firsts', 'hits', 'rows')
+
+
+class CheckpointStore:
+    """Chunk-level checkpoint state for one input file.
+
+    The state file records the byte offset of the next chunk, the number of
+    rows committed so far and the ids of the output parts already written.
+    Parts are written to a temporary name and renamed before the state is
+    updated, so a chunk is either fully committed or re-run on resume.
+    """
+
+    def __init__(self, checkpoint_dir, file, source_path):
+        self.checkpoint_dir = Path(checkpoint_dir) / file
+        self.state_file = self.checkpoint_dir / 'state.json'
+        self.file = file
+        self.source_path = Path(source_path)
+        self.state = None
+
+    def _fingerprint(self):
+        stat = self.source_path.stat()
+        return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+    def load(self, header_offset):
+        """Load the saved state, or start fresh if there is none or the source file changed."""
+        fingerprint = self._fingerprint()
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('source') == fingerprint:
+                logging.info(f"Resuming {self.file} from byte {state['byte_offset']} "
+                             f"({state['rows_committed']} rows committed)")
+                self.state = state
+                return self.state
+            logging.warning(f"Source file {self.file} changed since last checkpoint, starting over")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Error reading checkpoint {self.state_file}: {e}")
+
+        self.clear()
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.state = {
+            'source': fingerprint,
+            'byte_offset': header_offset,
+            'rows_committed': 0,
+            'parts': [],
+            'counts': {'clean_rows': 0, 'bad_rows': 0, 'issues': {}},
+        }
+        return self.state
+
+    def part_path(self, part_id, kind):
+        """Path of the output part of the given kind: 'out', 'kept', 'bad', 'metadata' or one of ARRAY_PARTS."""
+        suffix = 'npy' if kind in ARRAY_PARTS else 'csv'
+        return self.checkpoint_dir / f"part-{part_id:06d}.{kind}.{suffix}"
+
+    def parts(self, kind):
+        """Committed part paths of the given kind that exist on disk, in order."""
+        paths = [self.part_path(part_id, kind) for part_id in self.state['parts']]
+        return [path for path in paths if path.exists()]
+
+    def commit(self, part_id, byte_offset, rows, counts):
+        """Record a chunk as committed once all of its parts are in place.
+
+        counts holds the chunk's clean, bad and per-issue row counts, which are
+        added to the file's totals.
+        """
+        self.state['byte_offset'] = byte_offset
+        self.state['rows_committed'] += rows
+        self.state['parts'].append(part_id)
+        totals = self.state['counts']
+        totals['clean_rows'] += counts['clean_rows']
+        totals['bad_rows'] += counts['bad_rows']
+        for issue, count in counts['issues'].items():
+            totals['issues'][issue] = totals['issues'].get(issue, 0) + count
+        tmp_file = self.state_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+
+    def clear(self):
+        """Remove all checkpoint state and parts for the file."""
+        if self.checkpoint_dir.exists():
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+
+class KeySet:
+    """Duplicate-check key hashes of the committed chunks of a file, held in memory.
+
+    Each chunk's keys are also written as a 'keys' part, so they are loaded
+    back when the file is resumed. Without a checkpoint the set only holds
+    the keys it was given.
+    """
+
+    def __init__(self, checkpoint=None, keys=None):
+        self.checkpoint = checkpoint
+        keys = [np.load(path) for path in checkpoint.parts('keys')] if checkpoint is not None else [keys]
+        keys = [k for k in keys if k is not None]
+        self.keys = np.unique(np.concatenate(keys)) if keys else np.array([], dtype=np.uint64)
+
+    def contains(self, hashes):
+        """Return a boolean mask of the hashes already seen."""
+        return np.isin(hashes, self.keys)
+
+    def add(self, part_id, hashes):
+        """Save the hashes of a chunk that is about to be committed."""
+        write_keys(self.checkpoint.part_path(part_id, 'keys'), hashes)
+        self.keys = np.union1d(self.keys, hashes)
+
+    def compact(self):
+        pass
+
+
+class SpilledKeySet:
+    """Duplicate-check key hashes of the committed chunks of a file, kept on disk.
+
+    Hashes are split into partitions by their top bits and every chunk adds
+    one sorted run to each partition it has keys for. Lookups binary-search
+    the memory-mapped runs, so only the pages they touch are resident, and a
+    partition with more than MAX_RUNS runs is merged into one, which never
+    loads more than that partition's share of the keys. Runs are named after
+    the chunk that wrote them, so runs of a chunk that was never committed
+    are dropped on resume.
+    """
+
+    def __init__(self, checkpoint):
+        self.directory = checkpoint.checkpoint_dir / 'spilled-keys'
+        self.runs = {}  # partition -> run paths
+        self.mapped = {}  # run path -> memory-mapped array
+        committed = max(checkpoint.state['parts'], default=0)
+        for path in sorted(self.directory.glob('*/run-*.npy')):
+            if int(path.stem.split('-')[1]) > committed:
+                path.unlink()
+            else:
+                self.runs.setdefault(int(path.parent.name, 16), []).append(path)
+
+    def run(self, path):
+        if path not in self.mapped:
+            self.mapped[path] = np.load(path, mmap_mode='r')
+        return self.mapped[path]
+
+    def split(self, hashes):
+        """Yield (partition, positions) for every partition that some of the hashes fall in."""
+        partitions = (hashes >> np.uint64(64 - PARTITION_BITS)).astype(np.int64)
+        order = np.argsort(partitions, kind='stable')
+        bounds = np.searchsorted(partitions[order], np.arange((1 << PARTITION_BITS) + 1))
+        for partition in range(1 << PARTITION_BITS):
+            if bounds[partition] < bounds[partition + 1]:
+                yield partition, order[bounds[partition]:bounds[partition + 1]]
+
+    def contains(self, hashes):
+        """Return a boolean mask of the hashes already seen."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        for partition, positions in self.split(hashes):
+            values = hashes[positions]
+            for path in self.runs.get(partition, []):
+                run = self.run(path)
+                index = np.minimum(np.searchsorted(run, values), len(run) - 1)
+                found[positions] |= run[index] == values
+        return found
+
+    def add(self, part_id, hashes):
+        """Save the hashes of a chunk that is about to be committed as new runs."""
+        hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+        for partition, positions in self.split(hashes):
+            path = self.directory / f"{partition:02x}" / f"run-{part_id:06d}.npy"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_keys(path, hashes[positions])
+            self.runs.setdefault(partition, []).append(path)
+
+    def compact(self):
+        """Merge the runs of every partition that has collected too many."""
+        for partition, runs in self.runs.items():
+            if len(runs) <= MAX_RUNS:
+                continue
+            merged = np.unique(np.concatenate([np.load(path) for path in runs]))
+            for path in runs:
+                self.mapped.pop(path, None)
+            # The merged run takes the newest run's name, so it counts as committed on resume.
+            write_keys(runs[-1], merged)
+            for path in runs[:-1]:
+                path.unlink()
+            self.runs[partition] = runs[-1:]
+
+
+def write_part(path, write):
+    """Write a part with the given callback to a temporary name and move it into place."""
+    tmp_path = path.with_name(path.name + '.tmp')
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_keys(path, keys):
+    """Write an array of key hashes as a part."""
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            np.save(f, keys)
+    write_part(path, write)
+
+
+def concat_parts(parts, destination):
+    """Concatenate CSV parts into destination, keeping only the first header."""
+    tmp_destination = Path(str(destination) + '.tmp')
+    with open(tmp_destination, 'wb') as out:
+        for i, part in enumerate(parts):
+            with open(part, 'rb') as f:
+                if i > 0:
+                    f.readline()
+                shutil.copyfileobj(f, out)
+    os.replace(tmp_destination, destination)
+
+
+def write_frame(path, df):
+    """Write a DataFrame, index included, as an Arrow IPC file for another process to read.
+
+    Frames pyarrow cannot convert, or any frame when pyarrow is not
+    installed, are written as a pickle next to it instead.
+    """
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=True)
+    except (ImportError, TypeError, ValueError) as e:
+        logging.debug(f"writing {path} as a pickle because {e}")
+        write_part(path.with_suffix('.pkl'), lambda tmp_path: df.to_pickle(tmp_path, compression=None))
+        return
+
+    def write(tmp_path):
+        with pa.OSFile(str(tmp_path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    write_part(path, write)
+
+
+def read_frame(path):
+    """Read a DataFrame written by write_frame, or an empty one if none was written."""
+    if path.exists():
+        import pyarrow as pa
+        with pa.memory_map(str(path), 'r') as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    if path.with_suffix('.pkl').exists():
+        return pd.read_pickle(path.with_suffix('.pkl'), compression=None)
+    return pd.DataFrame()
@@ -0,0 +1,157 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+from pathlib import Path
+from datetime import datetime
+
+from leases import lock_file
+from checkpoint import concat_parts
+from readers import file_family, file_timestamp_text
+
+UNKNOWN_DATE = 'unknown'
+
+
+def file_partition(file):
+    """Return the (family, date) partition of an input file named <family>YYYYMMDDHHMMSS.<suffix>.
+
+    The family is the prefix that SchemaManager keys the config by, without
+    its trailing separator, and the date comes from the timestamp suffix.
+    Files without a valid date in their suffix go to the 'unknown' date.
+    """
+    family = file_family(file).rstrip('_-.') or file_family(file)
+    try:
+        date = datetime.strptime(file_timestamp_text(file)[:8], '%Y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        date = UNKNOWN_DATE
+    return family, date
+
+
+class PartitionedDataset:
+    """Clean records of all input files, stored as a dataset partitioned by family and date.
+
+    Each processed file adds one part to family=<family>/date=<date>/ under
+    the root. A compaction pass merges the small parts of a partition into
+    files of about target_bytes. _manifest.json lists every data file of the
+    dataset with its rows, size and the input files it holds; readers should
+    go by the manifest, since files that are not in it are leftovers of an
+    interrupted write or compaction and are removed by the next compaction.
+    Writers on several workers are serialized with a lock file, which is
+    heartbeated while held, see leases.lock_file.
+    """
+
+    def __init__(self, root, target_bytes=128 * 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.root / '_manifest.json'
+        self.lock = self.root / '_manifest.lock'
+        self.target_bytes = target_bytes
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'files': {}}
+
+    def save_manifest(self, manifest):
+        """Atomically write the manifest."""
+        tmp_file = self.manifest_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.manifest_file)
+
+    def partition_dir(self, family, date):
+        return self.root / f"family={family}" / f"date={date}"
+
+    def add(self, present_file, clean_path, rows):
+        """Move the clean records output of present_file into its partition. Returns the new path.
+
+        Processing a file again replaces its part, unless the part has
+        already been compacted with others, in which case the new output is
+        dropped with a warning so its rows are not stored twice.
+        """
+        family, date = file_partition(present_file)
+        directory = self.partition_dir(family, date)
+        directory.mkdir(parents=True, exist_ok=True)
+        destination = directory / f"part-{Path(present_file).stem}.csv"
+        name = destination.relative_to(self.root).as_posix()
+        with lock_file(self.lock):
+            manifest = self.load_manifest()
+            for existing, entry in manifest['files'].items():
+                if present_file in entry['sources'] and existing != name:
+                    logging.warning(f"{present_file} is already compacted into {existing}, "
+                                    f"not adding its clean records to the dataset again")
+                    os.remove(clean_path)
+                    return self.root / existing
+            shutil.move(str(clean_path), str(destination))
+            manifest['files'][name] = {
+                'family': family,
+                'date': date,
+                'rows': rows,
+                'bytes': destination.stat().st_size,
+                'sources': [present_file],
+            }
+            self.save_manifest(manifest)
+        logging.info(f"Added clean records of {present_file} to {destination}")
+        return destination
+
+    def compact(self):
+        """Merge the small files of every partition into files of about target_bytes and update the manifest."""
+        with lock_file(self.lock):
+            manifest = self.load_manifest()
+            self.remove_unlisted(manifest)
+            partitions = {}
+            for name, entry in sorted(manifest['files'].items()):
+                if entry['bytes'] < self.target_bytes / 2:
+                    partitions.setdefault((entry['family'], entry['date']), []).append(name)
+
+            for (family, date), names in partitions.items():
+                for group in self.plan_groups(names, manifest):
+                    if len(group) < 2:
+                        continue
+                    directory = self.partition_dir(family, date)
+                    merged = directory / f"compacted-{uuid.uuid4().hex[:12]}.csv"
+                    concat_parts([self.root / name for name in group], merged)
+                    manifest['files'][merged.relative_to(self.root).as_posix()] = {
+                        'family': family,
+                        'date': date,
+                        'rows': sum(manifest['files'][name]['rows'] for name in group),
+                        'bytes': merged.stat().st_size,
+                        'sources': sorted(s for name in group for s in manifest['files'][name]['sources']),
+                    }
+                    for name in group:
+                        del manifest['files'][name]
+                    # The merged file is listed before its inputs are removed, so no rows are ever missing.
+                    self.save_manifest(manifest)
+                    for name in group:
+                        (self.root / name).unlink()
+                    logging.info(f"Compacted {len(group)} files of family {family} on {date} into {merged.name}")
+
+    def plan_groups(self, names, manifest):
+        """Split a partition's small files into groups of the same header that add up to about target_bytes."""
+        by_header = {}
+        for name in names:
+            with open(self.root / name, 'rb') as f:
+                by_header.setdefault(f.readline(), []).append(name)
+        groups = []
+        for names in by_header.values():
+            group, size = [], 0
+            for name in names:
+                if group and size + manifest['files'][name]['bytes'] > self.target_bytes:
+                    groups.append(group)
+                    group, size = [], 0
+                group.append(name)
+                size += manifest['files'][name]['bytes']
+            groups.append(group)
+        return groups
+
+    def remove_unlisted(self, manifest):
+        """Remove data files that are not in the manifest, left behind by an interrupted add or compaction."""
+        for path in self.root.glob('family=*/date=*/*'):
+            if path.relative_to(self.root).as_posix() not in manifest['files']:
+                logging.warning(f"Removing {path}, which is not in the dataset manifest")
+                path.unlink()
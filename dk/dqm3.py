@@ -1,12 +1,62 @@
 import re
+import io
 import os
 import csv
-import pandas as pd
+import json
+import hashlib
+import argparse
 from pathlib import Path
 import sys
 import logging
 import time
+import shutil
+import itertools
+from lazy import lazy_import
+from records import read_header, iter_record_chunks, record_ranges, read_range, sample_record_blocks
+from checkpoint import CheckpointStore, KeySet, SpilledKeySet, write_part, write_keys, concat_parts, write_frame, read_frame
+from engines import ENGINES, PandasEngine, get_engine
+from scheduler import POLICIES, Scheduler
+from readers import sniff, is_input_file, file_family, file_timestamp_text, output_name
 
+# pandas and numpy take most of the startup time; they are only loaded once a file is actually processed.
+# The modules of optional features (leases, tail, fuzzy, governor, dataset, parsecache, checkcache, cdc,
+# lookup, phones) are likewise imported where they are used, so an empty poll never loads them.
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+# Patterns for string formats that can be named in the schema DataType column
+TYPE_PATTERNS = {
+    'email': re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+'),
+    'url': re.compile(r'(https?://)?([\w-]+\.)+[\w-]+(/\S*)?', re.IGNORECASE),
+    'phone': re.compile(r'\+?[\d\s().-]{7,}'),
+}
+INT_TYPES = {'int', 'integer', 'bigint', 'smallint', 'tinyint', 'long'}
+FLOAT_TYPES = {'float', 'double', 'decimal', 'numeric', 'number', 'real'}
+DATE_TYPES = {'date', 'datetime', 'timestamp'}
+BOOL_TYPES = {'bool', 'boolean'}
+BOOL_VALUES = {'true', 'false', 't', 'f', 'yes', 'no', 'y', 'n', '1', '0', '1.0', '0.0'}
+STRING_TYPES = {'string', 'str', 'text', 'varchar', 'char', 'object'}
+DATA_TYPE_RE = re.compile(r'\s*(\w+)\s*(?:\((.*)\))?\s*$')
+
+# Column added while several small files are checked together, holding each row's position in the batch
+SOURCE_FILE_COLUMN = '__source_file'
+
+# The checks run on every file, in order: (config test, FileProcessor method, name in error messages)
+CHECKS = [
+    ('phonenumber_check', 'clean_phonenumber', 'phonenumber'),
+    ('phonenumber_e164_check', 'normalize_phonenumber', 'phone number normalization'),
+    ('type_check', 'type_check', 'type'),
+    ('lookup_check', 'lookup_check', 'lookup'),
+    ('duplicate_check', 'duplicate_check', 'duplicate'),
+    ('fuzzy_duplicate_check', 'fuzzy_duplicate_check', 'fuzzy duplicate'),
+    # ('null_check', 'null_check', 'null'),
+]
+# Checks that compare every row with every other of the file. Chunked and parallel runs skip them within the
+# chunks and run them on the committed clean parts, see flag_near_duplicates.
+FILE_LEVEL_CHECKS = {'fuzzy_duplicate_check'}
+# A directory changed this recently may change again within the same clock tick without its mtime changing.
+RACY_MTIME_NS = 100 * 1000 * 1000
 
 # Configure logging
 logging.basicConfig(
@@ -18,31 +68,133 @@ logging.basicConfig(
     ]
 )
 
+def file_signature(path):
+    """Return (mtime_ns, size) of a path, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+    except OSError:
+        return None
+
+
+def file_hash(path):
+    """Return the sha1 of a file's contents."""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def cache_path(cache_dir, kind, *keys):
+    """Path of a cache file for the given kind, keyed by the absolute paths in keys."""
+    key = hashlib.sha1('|'.join(str(Path(k).resolve()) for k in keys).encode('utf-8')).hexdigest()[:16]
+    return Path(cache_dir) / f"{kind}-{key}.json"
+
+
+def read_cache(path):
+    """Read a JSON cache file, returning None if it is missing or unreadable."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable cache {path}: {e}")
+        return None
+
+
+def write_cache(path, data):
+    """Atomically write a JSON cache file."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Could not write cache {path}: {e}")
+
+
 class FileManager:
-    def __init__(self, source_file_location, scanned_files, output_file_location):
+    def __init__(self, source_file_location, scanned_files, output_file_location, cache_dir=None):
         self.source_file_location = source_file_location
         self.scanned_files = scanned_files
         self.output_file_location = output_file_location
+        self.cache_dir = cache_dir  # Where the directory signature of an empty poll and the entry cache are kept
+        self.families = None  # Optional set of families; files of other families are skipped without being opened
+        self.input_suffixes = {}  # family -> suffixes such as '.txt' its files may have besides those in SUFFIX_FORMATS
+        self.scanned_files_signature = None
+        self.scanned_file_names = set()
+
+    def scanned_names(self):
+        """Return the set of files in the registry, reading it again only when it changes."""
+        signature = file_signature(self.scanned_files)
+        if signature != self.scanned_files_signature:
+            with open(self.scanned_files, 'r', encoding='utf-8') as f:
+                self.scanned_file_names = {row['files_scanned'] for row in csv.DictReader(f)}
+            self.scanned_files_signature = signature
+        return self.scanned_file_names
 
     def check_if_file_already_scanned(self, file):
         """Check if the file has already been scanned."""
-        logging.info(f"Checking if file has been scanned: {file}")
+        logging.debug(f"Checking if file has been scanned: {file}")
         try:
-            df = pd.read_csv(self.scanned_files, encoding='utf-8')
-            return file in df['files_scanned'].values
+            return file in self.scanned_names()
         except Exception as e:
             logging.error(f"Error reading scanned files: {e}")
         return False
 
+    def directory_signature(self, empty_files):
+        """Signature of everything that decides whether there are new files to process.
+
+        Adding, removing or renaming a file changes the directory's mtime. Files
+        that were skipped for having no records are stat'ed individually, since
+        writing into them does not. A change of the wanted families or of
+        their input suffixes can also bring in files that were skipped before.
+        """
+        return {
+            'source': file_signature(self.source_file_location),
+            'scanned_files': file_signature(self.scanned_files),
+            'families': sorted(self.families) if self.families is not None else None,
+            'input_suffixes': {family: sorted(suffixes) for family, suffixes in self.input_suffixes.items()},
+            'empty_files': {file: file_signature(Path(self.source_file_location) / file) for file in empty_files},
+        }
+
+    def nothing_new(self):
+        """Check if the source directory is unchanged since a poll that found nothing to process."""
+        if self.cache_dir is None:
+            return False
+        cached = read_cache(cache_path(self.cache_dir, 'discovery', self.source_file_location, self.scanned_files))
+        if cached is None:
+            return False
+        return cached == self.directory_signature(cached.get('empty_files', {}))
+
     def is_csv_file(self, file):
         """Check if the file is a CSV file."""
         return Path(file).suffix.lower() == ".csv"
 
+    def is_input_file(self, file):
+        """Check if the file is in one of the supported input formats (CSV, TSV, pipe, JSON Lines, fixed-width).
+
+        Besides the suffixes of those formats, a family may have the suffixes
+        it opted in to, whose format is sniffed from the contents.
+        """
+        return is_input_file(file, self.input_suffixes.get(file_family(file), ()))
+
+    def is_candidate(self, entry):
+        """Check if a directory entry is an input file of a wanted family, by its name and without a stat on Linux."""
+        if not self.is_input_file(entry.name):
+            return False
+        if self.families is not None and file_family(entry.name) not in self.families:
+            return False
+        try:
+            return entry.is_file()
+        except OSError:
+            return False
+
     def has_records(self, file):
         """Check if the file has any records."""
         file_location = Path(self.source_file_location) / file
         try:
-            with open(file_location, mode='r', encoding='utf-8') as f:
+            with open(file_location, mode='r', encoding='utf-8', errors='replace') as f:
                 reader = csv.reader(f)
                 for _ in reader:
                     return True
@@ -53,34 +205,117 @@ class FileManager:
     def get_files_to_process(self):
         """Get the list of files that need to be processed."""
         logging.info(f"Source file location: {self.source_file_location}")
+        if self.nothing_new():
+            logging.info("Source directory unchanged since the last poll found nothing to process")
+            return []
+        # Taken before listing, so changes made while we look are picked up next time.
+        listed_at = time.time_ns()
+        signature = self.directory_signature({})
+        empty_files = {}
         try:
-            files = os.listdir(self.source_file_location)
-            logging.info(f"files processes are {files}")
+            with os.scandir(self.source_file_location) as it:
+                entries = {entry.name: entry for entry in it if self.is_candidate(entry)}
         except Exception as e:
             logging.error(f"Error listing files in {self.source_file_location}: {e}")
             return []
+        try:
+            new_files = entries.keys() - self.scanned_names()
+        except Exception as e:
+            logging.error(f"Error reading scanned files: {e}")
+            new_files = entries.keys()
+        logging.info(f"Found {len(entries)} input files, {len(new_files)} not scanned yet")
 
+        # Whether a file has records is remembered with its size and mtime, so unchanged files are not opened again.
+        entry_cache = cache_path(self.cache_dir, 'entries', self.source_file_location) if self.cache_dir else None
+        known = (read_cache(entry_cache) if entry_cache else None) or {}
+        seen = {}
         list_of_files_to_be_tested = []
-        for file in files:
-            logging.info(f"Processing file: {file}")
-            if self.check_if_file_already_scanned(file):
-                logging.info(f"File already scanned: {file}")
+        for file, entry in entries.items():
+            if file not in new_files:
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entry_signature = [stat.st_mtime_ns, stat.st_size]
+            cached = known.get(file)
+            if cached is not None and cached[:2] == entry_signature:
+                has_records = cached[2]
             else:
-                logging.info(f"File is new: {file}. Proceeding with further processing.")
-                if self.is_csv_file(file):
-                    logging.info(f"{file} is a CSV file.")
-                    if self.has_records(file):
-                        logging.info(f"File {file} has non-zero records")
-                        list_of_files_to_be_tested.append(file)
+                has_records = stat.st_size > 0 and self.has_records(file)
+            seen[file] = entry_signature + [has_records]
+            if has_records:
+                logging.debug(f"File {file} is new and has records")
+                list_of_files_to_be_tested.append(file)
+            else:
+                empty_files[file] = entry_signature
+        if entry_cache is not None and seen != known:
+            write_cache(entry_cache, seen)
 
+        if self.cache_dir is not None:
+            path = cache_path(self.cache_dir, 'discovery', self.source_file_location, self.scanned_files)
+            if list_of_files_to_be_tested:
+                if path.exists():
+                    path.unlink()
+            elif signature['source'] is not None and listed_at - signature['source'][0] > RACY_MTIME_NS:
+                # A file added in the tick the directory was last changed in would not change the signature.
+                signature['empty_files'] = empty_files
+                write_cache(path, signature)
         return list_of_files_to_be_tested
 
 class SchemaManager:
-    def __init__(self, config_file, schema_file):
+    def __init__(self, config_file, schema_file, cache_dir=None):
         self.config_file = config_file
         self.schema_file = schema_file
-        self.schema = self.load_schema()
-        self.config = self.load_config()
+        self.cache_dir = cache_dir  # Where the parsed config and schema are cached
+        cached = self.load_cached()
+        if cached is not None:
+            self.schema, self.config = cached
+        else:
+            self.schema = self.load_schema()
+            self.config = self.load_config()
+            self.save_cached()
+
+    def load_cached(self):
+        """Return the cached (schema, config) if the config and schema files have not changed."""
+        if self.cache_dir is None:
+            return None
+        path = cache_path(self.cache_dir, 'schema', self.config_file, self.schema_file)
+        cached = read_cache(path)
+        if cached is None:
+            return None
+        signatures = [file_signature(self.config_file), file_signature(self.schema_file)]
+        if cached['signatures'] != signatures:
+            # Touched but possibly unchanged files are recognised by their contents.
+            try:
+                hashes = [file_hash(self.config_file), file_hash(self.schema_file)]
+            except OSError:
+                return None
+            if cached['hashes'] != hashes:
+                return None
+            cached['signatures'] = signatures
+            write_cache(path, cached)
+        logging.debug("Using cached config and schema")
+        return cached['schema'], cached['config']
+
+    def save_cached(self):
+        """Cache the parsed schema and config keyed by the files' mtime, size and hash."""
+        if self.cache_dir is None:
+            return
+        try:
+            write_cache(cache_path(self.cache_dir, 'schema', self.config_file, self.schema_file), {
+                'signatures': [file_signature(self.config_file), file_signature(self.schema_file)],
+                'hashes': [file_hash(self.config_file), file_hash(self.schema_file)],
+                'schema': self.schema,
+                'config': self.config,
+            })
+        except OSError as e:
+            logging.warning(f"Could not cache config and schema: {e}")
+
+    def input_suffixes(self):
+        """Return family -> the file suffixes its 'input_suffix' config rows opt in to, such as '.txt'."""
+        return {family: {'.' + suffix.lower().lstrip('.') for suffix in tests['input_suffix']}
+                for family, tests in self.config.items() if tests.get('input_suffix')}
 
     def load_schema(self):
         """Load and parse the schema file."""
@@ -104,14 +339,14 @@ class SchemaManager:
             with open(self.config_file, 'r', encoding='utf-8') as file:
                 reader = csv.DictReader(file)
                 for row in reader:
-                    file_prefix = row['file_prefix'].strip()[0:-18]
-                    logging.info(f"File prefix: {file_prefix}")
+                    file_prefix = file_family(row['file_prefix'].strip())
+                    logging.debug(f"File prefix: {file_prefix}")
 
                     test_type = row['test'].strip()
-                    logging.info(f"Test type: {test_type}")
+                    logging.debug(f"Test type: {test_type}")
 
                     attribute = row['attribute'].strip()
-                    logging.info(f"Attribute: {attribute}")
+                    logging.debug(f"Attribute: {attribute}")
 
                     if file_prefix not in config:
                         config[file_prefix] = {}
@@ -122,51 +357,1057 @@ class SchemaManager:
             logging.error(f"Error loading config file {self.config_file}: {e}")
         return config
 
+# The FileProcessor of a worker process in the parallel path, set up by init_worker.
+worker_processor = None
+
+
+def init_worker(file_manager, schema_manager, engine_name, checkpoint_dir, parse_cache_args=None):
+    global worker_processor
+    parse_cache = None
+    if parse_cache_args is not None:
+        from parsecache import ParseCache
+        parse_cache = ParseCache(*parse_cache_args)
+    worker_processor = FileProcessor(file_manager, schema_manager, checkpoint_dir=checkpoint_dir,
+                                     engine=get_engine(engine_name), parse_cache=parse_cache)
+
+
+def check_range(*args):
+    return worker_processor.check_range(*args)
+
+
+def finish_range(*args):
+    return worker_processor.finish_range(*args)
+
+
 class FileProcessor:
-    def __init__(self, file_manager, schema_manager):
+    def __init__(self, file_manager, schema_manager, chunk_size=None, checkpoint_dir=None, leases=None, engine=None,
+                 governor=None, workers=1, dataset=None, batch_bytes=0, batch_max_bytes=64 * 1024 * 1024,
+                 cross_file_duplicates=False, scheduler=None, parse_cache=None, check_cache_dir=None,
+                 change_capture=None, phone_region='IN'):
         self.file_manager = file_manager
         self.schema_manager = schema_manager
-        self.clean_records = pd.DataFrame()  # Initialize clean_records as an empty DataFrame
-        self.bad_records = pd.DataFrame()    # Initialize bad_records as an empty DataFrame
+        self.engine = engine or PandasEngine()  # DataFrame engine used for reading, duplicate detection and writing
+        self.tail_dir = Path(file_manager.output_file_location) / '.tail'
+        self.tail_states = {}  # file -> TailState, kept between cycles in tail mode
+        self.lookup_dir = Path(file_manager.output_file_location) / '.lookup'
+        self.reference_indexes = {}  # (reference path, column) -> ReferenceIndex of the lookup checks
+        self.leases = leases  # Optional LeaseManager when several workers share the source directory
+        self.governor = governor  # Optional MemoryGovernor that picks each file's strategy from a memory budget
+        self.workers = workers  # Processes that check the chunks of one large file in parallel
+        self.dataset = dataset  # Optional PartitionedDataset that receives the clean records instead of .out.csv files
+        self.batch_bytes = batch_bytes  # Files up to this many bytes are checked together with others of their family
+        self.batch_max_bytes = batch_max_bytes  # Largest total size of one batch of small files
+        self.cross_file_duplicates = cross_file_duplicates  # Duplicate checks in a batch also compare across its files
+        self.batch_scope = None  # Set to SOURCE_FILE_COLUMN while a batch is checked with per-file duplicate checks
+        self.scheduler = scheduler  # Optional Scheduler that orders the pending files and records their latency
+        self.input_formats = {}  # file -> (file signature, InputFormat) of the files read so far
+        self.parse_cache = parse_cache  # Optional ParseCache of parsed whole files and chunks
+        self.check_cache_dir = check_cache_dir  # Optional directory of per-check results, see CheckCache
+        self.change_capture = change_capture  # Optional ChangeCapture that writes deltas instead of full clean records
+        self.phone_region = phone_region  # Region of phone numbers written without a country code, see phones.REGIONS
+        self.chunk_size = chunk_size  # Files larger than this many bytes are processed in checkpointed chunks
+        self.checkpoint_dir = checkpoint_dir or Path(file_manager.output_file_location) / '.checkpoints'
+        self.clean_records = None  # Set to a DataFrame by reset() when a file is processed
+        self.bad_records = None    # Set to a DataFrame by reset() when a file is processed
         self.metadata = []  # List to store metadata about the bad records
+        self.result = None  # Summary of the last processed file, see record_result
+
+    def reset(self):
+        """Clear the per-file state before processing a new file or chunk."""
+        self.clean_records = pd.DataFrame()
+        self.bad_records = pd.DataFrame()
+        self.metadata = []
 
     def process_files(self):
         """Process the list of files that passed the initial checks."""
         file_check_module_passed_files = self.file_manager.get_files_to_process()
         logging.info("Processing files")
+        if self.scheduler is not None:
+            file_check_module_passed_files = self.scheduler.order(file_check_module_passed_files)
+        if self.change_capture is not None:
+            file_check_module_passed_files = self.deliveries_in_order(file_check_module_passed_files)
         try:
             if file_check_module_passed_files:
-                for present_file in file_check_module_passed_files:
-                    logging.info(f"New test on file: {present_file}")
-                    file_location = Path(self.file_manager.source_file_location) / present_file
-                    self.clean_records = pd.read_csv(file_location, encoding='utf-8')
-
-                    try:
-                        phonenumber_check_attributes = self.schema_manager.config.get(present_file[0:-18], {}).get('phonenumber_check', [])
-                        self.clean_phonenumber(present_file,phonenumber_check_attributes)
-                    except Exception as e:
-                        logging.error(f"phonenumber check failed because {e}")
-
+                for batch in self.plan_batches(file_check_module_passed_files):
+                    if self.leases is None:
+                        self.process_scheduled(batch)
+                        continue
+                    claimed = []
+                    for present_file in batch:
+                        if self.leases.claim(present_file):
+                            claimed.append(present_file)
+                        else:
+                            logging.info(f"File {present_file} is claimed or done by another worker")
                     try:
-                        duplicate_check_attributes = self.schema_manager.config.get(present_file[0:-18], {}).get('duplicate_check', [])
-                        self.duplicate_check(present_file, duplicate_check_attributes)
-                    except Exception as e:
-                        logging.error(f"duplicate check failed because {e}")
-                    #
-                    # try:
-                    #     null_check_attributes = self.schema_manager.config.get(present_file[0:-18], {}).get('null_check', [])
-                    #     self.null_check(present_file, null_check_attributes)
-                    # except Exception as e:
-                    #     logging.error(f"null check failed because {e}")
-
-                    self.save_good_records(present_file, self.clean_records)
-
-                    # Save metadata after processing the file
-                    self.save_metadata(present_file)
+                        self.process_scheduled(claimed)
+                        for present_file in claimed:
+                            self.leases.complete(present_file)
+                    finally:
+                        for present_file in claimed:
+                            self.leases.release(present_file)
             else:
                 logging.info(f"no files present in source directory")
         except Exception as e:
             logging.exception(f"processing files failed. error {e}")
+        if self.scheduler is not None:
+            self.scheduler.summary()
+
+    def deliveries_in_order(self, files):
+        """Reorder files so that the files of every family come oldest first, in the places its files had.
+
+        Changes are captured against a family's last delivery, so its files
+        have to be processed in the order of their timestamps.
+        """
+        by_family = {}
+        for present_file in files:
+            by_family.setdefault(file_family(present_file), []).append(present_file)
+        in_order = {family: iter(sorted(family_files, key=file_timestamp_text))
+                    for family, family_files in by_family.items()}
+        return [next(in_order[file_family(present_file)]) for present_file in files]
+
+    def process_scheduled(self, batch):
+        """Process a batch of files, or a single file, and record its latency with the scheduler."""
+        if not batch:
+            return
+        started = time.time()
+        if len(batch) > 1:
+            self.process_batch(batch)
+        else:
+            self.process_one(batch[0])
+        if self.scheduler is not None:
+            self.scheduler.record(batch, started, time.time())
+
+    def plan_batches(self, files):
+        """Group the files into batches: small files of the same family together, every other file alone."""
+        if not self.batch_bytes:
+            return [[present_file] for present_file in files]
+        batches = []
+        open_batches = {}  # family -> (files, total bytes)
+        for present_file in files:
+            size = (Path(self.file_manager.source_file_location) / present_file).stat().st_size
+            family = file_family(present_file)
+            if size > self.batch_bytes:
+                # The family's earlier small files go first, so its files keep their order.
+                if family in open_batches:
+                    batches.append(open_batches.pop(family)[0])
+                batches.append([present_file])
+                continue
+            batch, total = open_batches.get(family, ([], 0))
+            if batch and total + size > self.batch_max_bytes:
+                batches.append(batch)
+                batch, total = [], 0
+            open_batches[family] = (batch + [present_file], total + size)
+        batches.extend(batch for batch, _ in open_batches.values())
+        return batches
+
+    def process_one(self, present_file):
+        """Process a single file, choosing the in-memory or chunked path by its size or the memory budget."""
+        logging.info(f"New test on file: {present_file}")
+        self.result = None
+        self.run_strategy(present_file)
+        if self.result is None:
+            return
+        self.capture_changes(present_file)
+        self.add_to_dataset(present_file)
+
+    def lost_lease(self, present_file):
+        """Check if this worker lost its lease on present_file, so that it must not publish outputs for it."""
+        if self.leases is not None and not self.leases.holds(present_file):
+            logging.error(f"Lease on {present_file} was lost, leaving the file to its new holder")
+            return True
+        return False
+
+    def input_format(self, present_file):
+        """Return the sniffed format of an input file, sniffing it again only if the file changed.
+
+        The attributes of the family's type, lookup and E.164 phone checks
+        are read as text, so values are checked and codes matched against the
+        reference as they are written, and phone numbers or compact dates
+        with a blank are not parsed as floats.
+        """
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        signature = file_signature(file_location)
+        cached = self.input_formats.get(present_file)
+        if cached is None or cached[0] != signature:
+            input_format = sniff(file_location)
+            file_config = self.schema_manager.config.get(file_family(present_file), {})
+            text_columns = set(file_config.get('type_check', []) + file_config.get('phonenumber_e164_check', []))
+            if file_config.get('lookup_check'):
+                from lookup import parse_lookup_spec
+                text_columns.update(parse_lookup_spec(spec)[0] for spec in file_config['lookup_check'])
+            input_format.text_columns = sorted(text_columns)
+            cached = (signature, input_format)
+            self.input_formats[present_file] = cached
+            logging.debug(f"Format of {present_file}: {cached[1]}")
+        return cached[1]
+
+    def read_input(self, present_file, source, byte_range=None):
+        """Parse a whole input file or a byte buffer of its records with the reader for its format.
+
+        The parse cache is used for whole files and for buffers that name the
+        (start, end) byte_range of the file they hold. Appends read in tail
+        mode and blocks sampled by estimate are always parsed.
+        """
+        if self.parse_cache is not None and (isinstance(source, Path) or byte_range is not None):
+            file_location = Path(self.file_manager.source_file_location) / present_file
+            return self.parse_cache.read(file_location, self.input_format(present_file), self.engine, byte_range,
+                                         None if isinstance(source, Path) else source)
+        return self.input_format(present_file).read(self.engine, source)
+
+    def capture_changes(self, present_file):
+        """Replace the file's clean records output by its delta against the family's last delivery.
+
+        Only families with 'cdc_key' attributes in the config are captured.
+        The first delivery of a family keeps its full clean records, and so
+        does a delivery older than the last captured one, which is an error.
+        """
+        keys = self.schema_manager.config.get(file_family(present_file), {}).get('cdc_key', [])
+        if self.change_capture is None or not keys:
+            return
+        from cdc import LateDeliveryError
+        delta_path = Path(self.file_manager.output_file_location) / output_name(present_file, '.delta.csv')
+        try:
+            counts = self.change_capture.capture(present_file, self.result['outputs'].get('out'), keys, delta_path)
+        except LateDeliveryError as e:
+            logging.error(f"Not capturing changes: {e}")
+            return
+        except Exception as e:
+            logging.error(f"Capturing changes of {present_file} failed because {e}")
+            return
+        if counts is None:
+            return
+        if 'out' in self.result['outputs']:
+            os.remove(self.result['outputs'].pop('out'))
+        self.result['outputs']['delta'] = str(delta_path)
+        self.result['changes'] = counts
+
+    def add_to_dataset(self, present_file):
+        """Move the file's clean records into the dataset, if one is configured."""
+        if self.dataset is not None and 'out' in self.result['outputs']:
+            path = self.dataset.add(present_file, self.result['outputs']['out'], self.result['clean_rows'])
+            self.result['outputs']['out'] = str(path)
+
+    def process_batch(self, files):
+        """Check several small files of one family in a single pass and write each file's own outputs.
+
+        Files whose columns and types match are concatenated, with
+        SOURCE_FILE_COLUMN telling their rows apart, so that the checks run
+        once per batch instead of once per file. The outputs and row numbers
+        are the same as when every file is processed alone; duplicate checks
+        only compare rows of the same file unless cross_file_duplicates is set.
+        """
+        frames = {}
+        for present_file in files:
+            logging.info(f"New test on file: {present_file}")
+            frames[present_file] = self.read_input(present_file, Path(self.file_manager.source_file_location) / present_file)
+        # Files with other column types are checked apart, so concatenating never changes a type.
+        groups = {}
+        for present_file, frame in frames.items():
+            groups.setdefault(tuple(frame.dtypes.astype(str).items()), []).append(present_file)
+        for group in groups.values():
+            self.check_batch(group, [frames[present_file] for present_file in group])
+
+    def check_batch(self, files, frames):
+        """Run the checks once over the concatenated frames of files, then save the outputs of each file."""
+        logging.info(f"Checking {len(files)} files of family {file_family(files[0])} together")
+        offsets = np.cumsum([0] + [len(frame) for frame in frames])
+        for position, frame in enumerate(frames):
+            frame.index = pd.RangeIndex(offsets[position], offsets[position + 1])
+            frame[SOURCE_FILE_COLUMN] = position
+        self.reset()
+        self.clean_records = pd.concat(frames)
+        self.batch_scope = None if self.cross_file_duplicates else SOURCE_FILE_COLUMN
+        try:
+            self.run_checks(files[0])
+        finally:
+            self.batch_scope = None
+
+        clean_records, bad_records, metadata = self.clean_records, self.bad_records, self.metadata
+        for position, present_file in enumerate(files):
+            first, last = int(offsets[position]), int(offsets[position + 1])
+            self.clean_records = clean_records[clean_records[SOURCE_FILE_COLUMN] == position]
+            self.clean_records = self.clean_records.drop(columns=[SOURCE_FILE_COLUMN])
+            if bad_records.empty:
+                self.bad_records = pd.DataFrame()
+            else:
+                self.bad_records = bad_records[bad_records[SOURCE_FILE_COLUMN] == position]
+                self.bad_records = self.bad_records.drop(columns=[SOURCE_FILE_COLUMN])
+            self.metadata = []
+            for issue in metadata:
+                rows = [row - first for row in issue['Row_num_list'] if first <= row < last]
+                if rows:
+                    self.metadata.append({'Type_of_issue': issue['Type_of_issue'], 'Row_num_list': rows})
+
+            if self.lost_lease(present_file):
+                continue
+            self.save_bad_records(present_file, self.bad_records)
+            self.save_good_records(present_file, self.clean_records)
+            self.save_metadata(present_file)
+            self.record_result(present_file, last - first, self.chunk_counts())
+            self.capture_changes(present_file)
+            self.add_to_dataset(present_file)
+
+    def run_strategy(self, present_file):
+        """Process a file in memory, in chunks or in parallel chunks."""
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        input_format = self.input_format(present_file)
+        process_chunked = self.process_file_parallel if self.workers > 1 else self.process_file_chunked
+        if self.governor is None:
+            if self.chunk_size and file_location.stat().st_size > self.chunk_size and input_format.splittable:
+                process_chunked(present_file)
+            else:
+                self.process_file(present_file)
+            return
+
+        plan = self.governor.plan(file_location, self.engine, self.workers, input_format)
+        with self.governor.reserve(plan['reserve'], present_file):
+            if plan['strategy'] == 'memory':
+                self.process_file(present_file)
+            else:
+                process_chunked(present_file, plan['chunk_size'], spill_keys=plan['strategy'] == 'spilled')
+
+    def process_file(self, present_file):
+        """Process a whole file in memory."""
+        self.reset()
+        self.result = None
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        self.clean_records = self.read_input(present_file, file_location)
+
+        rows = len(self.clean_records)
+
+        check_cache = None
+        if self.check_cache_dir is not None:
+            from checkcache import CheckCache
+            check_cache = CheckCache(self.check_cache_dir, present_file, file_location)
+            self.run_checks_cached(present_file, check_cache)
+        else:
+            self.run_checks(present_file)
+        if self.lost_lease(present_file):
+            return
+
+        self.save_bad_records(present_file, self.bad_records)
+        self.save_good_records(present_file, self.clean_records)
+
+        # Save metadata after processing the file
+        self.save_metadata(present_file)
+        self.record_result(present_file, rows, self.chunk_counts())
+        if check_cache is not None:
+            check_cache.finish()
+
+    def chunk_counts(self):
+        """Clean, bad and per-issue row counts for the records currently held."""
+        issues = {}
+        for issue in self.metadata:
+            issues[issue['Type_of_issue']] = issues.get(issue['Type_of_issue'], 0) + len(issue['Row_num_list'])
+        return {'clean_rows': len(self.clean_records), 'bad_rows': len(self.bad_records), 'issues': issues}
+
+    def record_result(self, present_file, rows, counts):
+        """Keep a summary of the processed file: row counts, issue counts and output paths."""
+        outputs = {}
+        for kind, suffix in (('out', '.out.csv'), ('bad', '.bad.csv'), ('metadata', '.metadata.csv')):
+            path = Path(self.file_manager.output_file_location) / output_name(present_file, suffix)
+            if path.exists():
+                outputs[kind] = str(path)
+        self.result = dict(file=present_file, rows=rows, outputs=outputs, **counts)
+
+    def run_checks(self, present_file, skip=()):
+        """Run the configured checks on clean_records, moving failing rows to bad_records, except the tests in skip."""
+        for test, method, label in CHECKS:
+            if test not in skip:
+                self.run_check(present_file, test, method, label)
+
+    def run_check(self, present_file, test, method, label):
+        """Run one check with the attributes configured for the file's family, logging its failure."""
+        file_config = self.schema_manager.config.get(file_family(present_file), {})
+        try:
+            getattr(self, method)(present_file, file_config.get(test, []))
+        except Exception as e:
+            logging.error(f"{label} check failed because {e}")
+
+    def check_definition(self, test, attributes):
+        """Everything besides its input rows that decides what a check reports.
+
+        That is its attributes, and for type and lookup checks the schema
+        types and reference file contents they name.
+        """
+        definition = [test, list(attributes)]
+        if test == 'type_check':
+            definition.append([self.schema_manager.schema.get(attribute) for attribute in attributes])
+        elif test == 'phonenumber_e164_check':
+            definition.append(self.phone_region)
+        elif test == 'lookup_check':
+            from lookup import parse_lookup_spec
+            digests = []
+            for spec in attributes:
+                try:
+                    _, reference_path, column = parse_lookup_spec(spec, Path(self.schema_manager.config_file).parent)
+                    index = self.reference_index(reference_path, column)
+                    index.current()
+                    digests.append(index.digest)
+                except Exception:
+                    digests.append(None)
+            definition.append(digests)
+        return definition
+
+    def check_hashes(self, present_file, check_cache):
+        """Hashes of the file's check steps under the current config, schema and references, see step_hashes."""
+        from checkcache import step_hashes
+        file_config = self.schema_manager.config.get(file_family(present_file), {})
+        return step_hashes(check_cache.root(),
+                           [self.check_definition(test, file_config.get(test, [])) for test, _, _ in CHECKS])
+
+    def run_checks_cached(self, present_file, check_cache):
+        """Run the checks, replaying the leading ones whose definitions are unchanged from the check cache.
+
+        Every check that is run is stored in the cache, so a later config
+        change only runs the checks from the first changed one on.
+        """
+        hashes = self.check_hashes(present_file, check_cache)
+        cached = check_cache.cached_steps(hashes)
+        check_cache.begin(cached)
+        for index, (test, method, label) in enumerate(CHECKS):
+            if index < cached:
+                try:
+                    self.replay_check(check_cache.load_result(index))
+                    continue
+                except Exception as e:
+                    logging.warning(f"Running {label} check of {present_file} again, its cached result is unreadable: {e}")
+                    cached = index
+                    check_cache.begin(index)
+            before = (self.clean_records, list(self.clean_records.columns), len(self.bad_records), len(self.metadata))
+            self.run_check(present_file, test, method, label)
+            check_cache.save_result(index, hashes[index], self.check_result(*before))
+        if cached:
+            logging.info(f"Reused {cached} of {len(CHECKS)} cached check results of {present_file}")
+
+    def check_result(self, clean_records, columns, bad_rows, metadata_count):
+        """What a check changed, given the clean records, their columns, the bad row count and the metadata count
+        from before it ran."""
+        result = {
+            'bad': self.bad_records.index[bad_rows:],
+            'removed': clean_records.index[~clean_records.index.isin(self.clean_records.index)],
+            'metadata': self.metadata[metadata_count:],
+            'columns': None,
+            'values': {},
+        }
+        columns_changed = list(self.clean_records.columns) != columns
+        if (self.clean_records is not clean_records or columns_changed) and not len(result['removed']):
+            changed = [column for column in self.clean_records.columns
+                       if column not in columns or not self.clean_records[column].equals(clean_records[column])]
+            if changed or columns_changed:
+                result['columns'] = list(self.clean_records.columns)
+                result['values'] = {column: self.clean_records[column].to_numpy() for column in changed}
+        elif columns_changed:
+            result['columns'] = list(self.clean_records.columns)
+        return result
+
+    def replay_check(self, result):
+        """Apply a cached check result to clean_records, bad_records and metadata, see check_result."""
+        if result['columns'] is not None:
+            for column, values in result['values'].items():
+                self.clean_records[column] = values
+            self.clean_records = self.clean_records[result['columns']]
+        if len(result['bad']):
+            self.bad_records = pd.concat([self.bad_records, self.clean_records.loc[result['bad']]])
+        if len(result['removed']):
+            self.clean_records = self.clean_records.drop(index=result['removed'])
+        self.metadata.extend(result['metadata'])
+
+    def reprocess_files(self):
+        """Reprocess the files with cached check results after the config or schema changed.
+
+        Files whose checks are all unchanged are skipped, so only files of the
+        families whose checks changed are read again. Their outputs are
+        rebuilt from the cached results of the unchanged checks and fresh
+        results of the changed ones.
+        """
+        from checkcache import CheckCache
+        source = Path(self.file_manager.source_file_location)
+        for present_file in sorted(os.listdir(self.check_cache_dir)):
+            file_location = source / present_file
+            if not file_location.is_file():
+                continue
+            check_cache = CheckCache(self.check_cache_dir, present_file, file_location)
+            if check_cache.is_current(self.check_hashes(present_file, check_cache)):
+                logging.debug(f"Checks of {present_file} are unchanged")
+                continue
+            logging.info(f"Reprocessing {present_file} after a check change")
+            self.process_file(present_file)
+            if self.result is None:
+                continue
+            self.capture_changes(present_file)
+            self.add_to_dataset(present_file)
+
+    def process_file_chunked(self, present_file, chunk_size=None, spill_keys=False):
+        """Process a large file in record-aligned chunks, checkpointing after every chunk.
+
+        If a previous run died part way through the file, processing resumes
+        after the last committed chunk and the outputs are assembled from the
+        committed parts only, so every record is written exactly once. With
+        spill_keys the duplicate-check keys of earlier chunks are kept on disk
+        instead of in memory. Duplicates are reported as in memory, whatever
+        the chunk size, see flag_first_occurrences.
+        """
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        header, header_offset = read_header(file_location)
+        checkpoint = CheckpointStore(self.checkpoint_dir, present_file, file_location)
+        state = checkpoint.load(header_offset)
+        # A resumed file keeps the key store it started with.
+        if not state['parts']:
+            state['spill_keys'] = spill_keys
+        seen_keys = SpilledKeySet(checkpoint) if state.get('spill_keys') else KeySet(checkpoint)
+
+        duplicate_check_attributes = self.schema_manager.config.get(file_family(present_file), {}).get('duplicate_check', [])
+        part_id = max(state['parts'], default=0)
+
+        for start, end, data in iter_record_chunks(file_location, state['byte_offset'], chunk_size or self.chunk_size):
+            part_id += 1
+            logging.info(f"Processing {present_file} bytes {start}-{end} as part {part_id}")
+            self.reset()
+            self.clean_records = self.read_input(present_file, io.BytesIO(header + data), (start, end))
+            rows = len(self.clean_records)
+            # Number rows across the whole file so the metadata row numbers stay global.
+            first_row = state['rows_committed']
+            self.clean_records.index = pd.RangeIndex(first_row, first_row + rows)
+
+            self.run_checks(present_file, skip=FILE_LEVEL_CHECKS)
+            if self.lost_lease(present_file):
+                return
+            keys, hits = self.drop_seen_duplicates(present_file, duplicate_check_attributes, seen_keys)
+
+            self.save_part(checkpoint, part_id, 'out', self.clean_records)
+            self.save_row_numbers(checkpoint, part_id, present_file)
+            self.save_part(checkpoint, part_id, 'bad', self.bad_records)
+            self.save_part(checkpoint, part_id, 'metadata', pd.DataFrame(self.metadata))
+            if keys is not None:
+                self.save_first_occurrences(checkpoint, part_id, keys, hits)
+                seen_keys.add(part_id, keys)
+            checkpoint.commit(part_id, end, rows, self.chunk_counts())
+            seen_keys.compact()
+
+        self.assemble_parts(present_file, checkpoint)
+
+    def process_file_parallel(self, present_file, chunk_size=None, spill_keys=False):
+        """Process a large file by checking its record-aligned chunks in parallel worker processes.
+
+        Chunks are handled in batches of one per worker. In the first phase
+        each worker parses and checks a chunk and hands the checked frames
+        back as Arrow IPC files, with the duplicate-check key hashes of the
+        clean rows in a keys file. The merge step then finds, from the hashes
+        alone, which keys each chunk shares with earlier chunks, and in the
+        second phase the workers move those rows to the bad records and write
+        the chunk's parts. Parts are committed in order through the same
+        checkpoint as process_file_chunked, so the outputs are identical to it
+        and an interrupted run resumes after the last committed chunk.
+        """
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        header, header_offset = read_header(file_location)
+        checkpoint = CheckpointStore(self.checkpoint_dir, present_file, file_location)
+        state = checkpoint.load(header_offset)
+        if not state['parts']:
+            state['spill_keys'] = spill_keys
+        seen_keys = SpilledKeySet(checkpoint) if state.get('spill_keys') else KeySet(checkpoint)
+
+        handoff_dir = checkpoint.checkpoint_dir / 'handoff'
+        # Handoffs of a batch that never committed are redone.
+        shutil.rmtree(handoff_dir, ignore_errors=True)
+        part_id = max(state['parts'], default=0)
+        ranges = record_ranges(file_location, state['byte_offset'], chunk_size or self.chunk_size)
+        parse_cache_args = None
+        if self.parse_cache is not None:
+            # Hashed here first, so the workers find the file's sha1 saved instead of each hashing it again.
+            self.parse_cache.fingerprint(file_location)
+            parse_cache_args = (self.parse_cache.cache_dir, self.parse_cache.max_bytes)
+        # Importing concurrent.futures.process loads multiprocessing, which only parallel runs need.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                 initargs=(self.file_manager, self.schema_manager, self.engine.name,
+                                           self.checkpoint_dir, parse_cache_args)) as pool:
+            while True:
+                batch = list(itertools.islice(ranges, self.workers))
+                if not batch:
+                    break
+                part_ids = range(part_id + 1, part_id + 1 + len(batch))
+                logging.info(f"Processing {present_file} bytes {batch[0][0]}-{batch[-1][1]} as parts "
+                             f"{part_ids[0]}-{part_ids[-1]} on {self.workers} workers")
+                checked = [pool.submit(check_range, present_file, start, end, handoff_dir / str(i))
+                           for i, (start, end) in zip(part_ids, batch)]
+                row_counts = [future.result() for future in checked]
+
+                # Merge step: a key is a duplicate if an earlier chunk, committed or in this batch, kept it.
+                first_row = state['rows_committed']
+                batch_keys = np.array([], dtype=np.uint64)
+                finishing = []
+                for i, rows in zip(part_ids, row_counts):
+                    kept = seen_before = None
+                    keys_path = handoff_dir / str(i) / 'keys.npy'
+                    if keys_path.exists():
+                        hashes = np.load(keys_path)
+                        seen = seen_keys.contains(hashes) | np.isin(hashes, batch_keys)
+                        seen_before, kept = np.unique(hashes[seen]), hashes[~seen]
+                        batch_keys = np.union1d(batch_keys, kept)
+                    finishing.append((kept, pool.submit(finish_range, present_file, i, first_row,
+                                                        handoff_dir / str(i), seen_before)))
+                    first_row += rows
+
+                for i, (start, end), rows, (kept, future) in zip(part_ids, batch, row_counts, finishing):
+                    counts = future.result()
+                    if self.lost_lease(present_file):
+                        return
+                    if kept is not None:
+                        seen_keys.add(i, kept)
+                    checkpoint.commit(i, end, rows, counts)
+                    seen_keys.compact()
+                part_id += len(batch)
+
+        self.assemble_parts(present_file, checkpoint)
+
+    def check_range(self, present_file, start, end, handoff_dir):
+        """First parallel phase: parse one chunk of a file, run the checks and hand the result over.
+
+        Rows are numbered from zero; finish_range renumbers them once the rows
+        of the earlier chunks are known. Returns the number of rows read.
+        """
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        header, _ = read_header(file_location)
+        self.reset()
+        self.clean_records = self.read_input(present_file, io.BytesIO(header + read_range(file_location, start, end)),
+                                             (start, end))
+        rows = len(self.clean_records)
+        self.run_checks(present_file, skip=FILE_LEVEL_CHECKS)
+
+        handoff_dir.mkdir(parents=True, exist_ok=True)
+        for name, df in (('clean', self.clean_records), ('bad', self.bad_records)):
+            if not df.empty:
+                write_frame(handoff_dir / f"{name}.arrow", df)
+        with open(handoff_dir / 'metadata.json', 'w', encoding='utf-8') as f:
+            json.dump(self.metadata, f)
+        duplicate_check_attributes = self.schema_manager.config.get(file_family(present_file), {}).get('duplicate_check', [])
+        if duplicate_check_attributes and not self.clean_records.empty:
+            try:
+                write_keys(handoff_dir / 'keys.npy', self.key_hashes(duplicate_check_attributes))
+            except Exception as e:
+                logging.error(f"duplicate check across chunks failed because {e}")
+        return rows
+
+    def finish_range(self, present_file, part_id, first_row, handoff_dir, seen_before):
+        """Second parallel phase: renumber a checked chunk, drop rows seen in earlier chunks and write its parts.
+
+        seen_before holds the chunk's key hashes that earlier chunks already
+        kept. Returns the chunk's counts.
+        """
+        self.reset()
+        self.clean_records = read_frame(handoff_dir / 'clean.arrow')
+        self.bad_records = read_frame(handoff_dir / 'bad.arrow')
+        with open(handoff_dir / 'metadata.json', 'r', encoding='utf-8') as f:
+            self.metadata = json.load(f)
+        # Number rows across the whole file so the metadata row numbers stay global.
+        self.clean_records.index = self.clean_records.index + first_row
+        self.bad_records.index = self.bad_records.index + first_row
+        for issue in self.metadata:
+            issue['Row_num_list'] = [row + first_row for row in issue['Row_num_list']]
+
+        keys = hits = None
+        if seen_before is not None:
+            duplicate_check_attributes = self.schema_manager.config.get(file_family(present_file), {}).get('duplicate_check', [])
+            keys, hits = self.drop_seen_duplicates(present_file, duplicate_check_attributes, KeySet(keys=seen_before))
+
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        checkpoint = CheckpointStore(self.checkpoint_dir, present_file, file_location)
+        self.save_part(checkpoint, part_id, 'out', self.clean_records)
+        self.save_row_numbers(checkpoint, part_id, present_file)
+        self.save_part(checkpoint, part_id, 'bad', self.bad_records)
+        self.save_part(checkpoint, part_id, 'metadata', pd.DataFrame(self.metadata))
+        if keys is not None:
+            self.save_first_occurrences(checkpoint, part_id, keys, hits)
+        shutil.rmtree(handoff_dir, ignore_errors=True)
+        return self.chunk_counts()
+
+    def assemble_parts(self, present_file, checkpoint):
+        """Concatenate the committed parts of a chunked file into its outputs and clear the checkpoint."""
+        if self.lost_lease(present_file):
+            return
+        self.flag_first_occurrences(present_file, checkpoint)
+        self.flag_near_duplicates(present_file, checkpoint)
+        for kind, suffix in (('out', '.out.csv'), ('bad', '.bad.csv'), ('metadata', '.metadata.csv')):
+            parts = checkpoint.parts(kind)
+            if kind == 'out' and checkpoint.state.get('near_duplicates_part') is not None:
+                # Clean parts that lost near duplicates were written again without them.
+                parts = [checkpoint.part_path(part_id, 'kept') if checkpoint.part_path(part_id, 'kept').exists()
+                         else checkpoint.part_path(part_id, 'out') for part_id in checkpoint.state['parts']]
+                parts = [path for path in parts if path.exists()]
+            destination = Path(self.file_manager.output_file_location) / output_name(present_file, suffix)
+            if parts:
+                concat_parts(parts, destination)
+                logging.info(f"Assembled {len(parts)} {kind} parts into {destination}")
+            elif kind == 'metadata':
+                self.metadata = []
+                self.save_metadata(present_file)
+        self.record_result(present_file, checkpoint.state['rows_committed'], checkpoint.state['counts'])
+        checkpoint.clear()
+
+    def save_part(self, checkpoint, part_id, kind, df):
+        """Write one chunk's output of the given kind as a checkpoint part."""
+        if df is not None and not df.empty:
+            write_part(checkpoint.part_path(part_id, kind),
+                       lambda path: self.engine.to_csv(df, path))
+
+    def save_row_numbers(self, checkpoint, part_id, present_file):
+        """Save the row numbers of a chunk's clean records, which flag_near_duplicates reports, if it will run."""
+        if self.schema_manager.config.get(file_family(present_file), {}).get('fuzzy_duplicate_check'):
+            write_keys(checkpoint.part_path(part_id, 'rows'), self.clean_records.index.to_numpy().astype(np.uint64))
+
+    def save_first_occurrences(self, checkpoint, part_id, keys, hits):
+        """Save what flag_first_occurrences needs of a chunk: its clean records not yet reported as duplicates, and
+        the keys it found again.
+
+        keys are the key hashes of the chunk's clean records and hits the
+        hashes of its rows dropped for a key an earlier chunk kept. The
+        'firsts' part holds the hash, row number and position in the clean
+        part of every clean record that the chunk's own duplicate check did
+        not report.
+        """
+        positions = np.flatnonzero(~self.reported_duplicates())
+        firsts = np.stack([keys[positions], self.clean_records.index.to_numpy()[positions].astype(np.uint64),
+                           positions.astype(np.uint64)])
+        write_keys(checkpoint.part_path(part_id, 'firsts'), firsts)
+        if len(hits):
+            write_keys(checkpoint.part_path(part_id, 'hits'), hits)
+
+    def flag_first_occurrences(self, present_file, checkpoint):
+        """Report the first occurrence of every key that later chunks found again, as the in-memory duplicate check does.
+
+        A chunk is checked against the keys kept by earlier chunks, so the
+        clean record that first had a repeated key was already committed when
+        the repeat was found. These records are read back from their clean
+        parts and committed as one more part of bad records and metadata, so
+        the outputs hold the same rows whatever the chunk size.
+        """
+        if checkpoint.state.get('first_occurrences_part') is not None:
+            return
+        hits = [np.load(path) for path in checkpoint.parts('hits')]
+        if not hits:
+            return
+        hits = np.unique(np.concatenate(hits))
+        frames, rows = [], []
+        for part_id in checkpoint.state['parts']:
+            path = checkpoint.part_path(part_id, 'firsts')
+            if not path.exists():
+                continue
+            hashes, row_numbers, positions = np.load(path)
+            wanted = np.isin(hashes, hits)
+            if wanted.any():
+                clean = pd.read_csv(checkpoint.part_path(part_id, 'out'), dtype=str, keep_default_na=False,
+                                    encoding='utf-8')
+                frames.append(clean.iloc[positions[wanted].astype(np.int64)])
+                rows.extend(row_numbers[wanted].astype(np.int64).tolist())
+        if not rows:
+            return
+        logging.warning(f"Reporting the first occurrences of {len(rows)} keys found again in later chunks of {present_file}")
+        part_id = max(checkpoint.state['parts']) + 1
+        self.save_part(checkpoint, part_id, 'bad', pd.concat(frames))
+        self.save_part(checkpoint, part_id, 'metadata', pd.DataFrame([{'Type_of_issue': 'duplicate', 'Row_num_list': rows}]))
+        checkpoint.state['first_occurrences_part'] = part_id
+        checkpoint.commit(part_id, checkpoint.state['byte_offset'], 0,
+                          {'clean_rows': 0, 'bad_rows': len(rows), 'issues': {'duplicate': len(rows)}})
+
+    def flag_near_duplicates(self, present_file, checkpoint):
+        """Run the fuzzy duplicate check of a chunked file on all of its committed clean records at once.
+
+        Near duplicates in different chunks are found as in memory: only the
+        attributes of the clean parts are read back to group the keys. Every
+        member of a group is committed as one more part of bad records and
+        metadata, and the clean parts holding members other than the first are
+        written again without them, as 'kept' parts that replace them once
+        the pass is committed.
+        """
+        attributes = self.schema_manager.config.get(file_family(present_file), {}).get('fuzzy_duplicate_check', [])
+        if not attributes or checkpoint.state.get('near_duplicates_part') is not None:
+            return
+        part_ids = [part_id for part_id in checkpoint.state['parts']
+                    if checkpoint.part_path(part_id, 'out').exists()]
+        if not part_ids:
+            return
+        header = pd.read_csv(checkpoint.part_path(part_ids[0], 'out'), nrows=0).columns
+        attributes = [a for a in attributes if a in header]
+        if not attributes:
+            return
+        logging.info(f"Performing fuzzy duplicate check on all clean records of file: {present_file}")
+        from fuzzy import normalize_keys, near_duplicate_groups
+        keys, row_numbers, owners = [], [], []
+        for part_id in part_ids:
+            values = pd.read_csv(checkpoint.part_path(part_id, 'out'), usecols=attributes, dtype=str, encoding='utf-8')
+            keys.append(normalize_keys(values, attributes).to_numpy())
+            row_numbers.append(np.load(checkpoint.part_path(part_id, 'rows')).astype(np.int64))
+            owners.append(np.full(len(values), part_id))
+        keys, row_numbers, owners = np.concatenate(keys), np.concatenate(row_numbers), np.concatenate(owners)
+        groups = near_duplicate_groups(keys)
+        in_group = np.bincount(groups)[groups] > 1
+        if not in_group.any():
+            return
+        logging.warning(f"Near-duplicate records found based on attributes {attributes} in file {present_file}")
+        dropped = in_group & pd.Series(groups).duplicated(keep='first').to_numpy()
+        members = []
+        for part_id in np.unique(owners[in_group]):
+            in_part = owners == part_id
+            clean = pd.read_csv(checkpoint.part_path(part_id, 'out'), dtype=str, keep_default_na=False, encoding='utf-8')
+            members.append(clean[in_group[in_part]])
+            if dropped[in_part].any():
+                self.save_part(checkpoint, part_id, 'kept', clean[~dropped[in_part]])
+        part_id = max(checkpoint.state['parts']) + 1
+        rows = row_numbers[in_group].tolist()
+        self.save_part(checkpoint, part_id, 'bad', pd.concat(members))
+        self.save_part(checkpoint, part_id, 'metadata', pd.DataFrame([{'Type_of_issue': 'fuzzy_duplicate',
+                                                                      'Row_num_list': rows}]))
+        checkpoint.state['near_duplicates_part'] = part_id
+        checkpoint.commit(part_id, checkpoint.state['byte_offset'], 0,
+                          {'clean_rows': -int(dropped.sum()), 'bad_rows': len(rows),
+                           'issues': {'fuzzy_duplicate': len(rows)}})
+
+    def drop_seen_duplicates(self, file, duplicate_check_attributes, seen_keys):
+        """Move rows whose duplicate-check key already appeared in an earlier chunk to bad_records.
+
+        seen_keys is any key set with a contains(hashes) method. Returns the
+        key hashes of the rows kept and the distinct hashes of the rows
+        dropped, or (None, None) if the file has no duplicate check.
+        """
+        if not duplicate_check_attributes or self.clean_records.empty:
+            return None, None
+        try:
+            hashes = self.key_hashes(duplicate_check_attributes)
+        except Exception as e:
+            logging.error(f"duplicate check across chunks failed because {e}")
+            return None, None
+        seen = seen_keys.contains(hashes)
+        if seen.any():
+            # The kept record of a group the chunk's own duplicate check found is already in bad_records.
+            duplicates = self.clean_records[seen & ~self.reported_duplicates()]
+            if not duplicates.empty:
+                logging.warning(f"Duplicate records found in earlier chunks based on attributes {duplicate_check_attributes} in file {file}")
+                self.metadata.append({
+                    'Type_of_issue': 'duplicate',
+                    'Row_num_list': duplicates.index.tolist()
+                })
+                self.bad_records = pd.concat([self.bad_records, duplicates])
+            self.clean_records = self.clean_records[~seen]
+        return hashes[~seen], np.unique(hashes[seen])
+
+    def reported_duplicates(self):
+        """Return a boolean mask of the clean records whose rows are already in the duplicate metadata."""
+        reported = set()
+        for issue in self.metadata:
+            if issue['Type_of_issue'] == 'duplicate':
+                reported.update(issue['Row_num_list'])
+        return self.clean_records.index.isin(list(reported))
+
+    def key_hashes(self, duplicate_check_attributes):
+        """Hash the duplicate-check attributes of every clean record."""
+        return pd.util.hash_pandas_object(self.clean_records[duplicate_check_attributes], index=False).to_numpy()
+
+    def tail_files(self, poll_interval=0):
+        """Incrementally process the records appended to each pending file since the last cycle.
+
+        Runs a single cycle, or keeps polling every poll_interval seconds if it is set.
+        """
+        while True:
+            for present_file in self.file_manager.get_files_to_process():
+                try:
+                    self.tail_file(present_file)
+                except Exception as e:
+                    logging.exception(f"tail cycle failed for {present_file} because {e}")
+            if not poll_interval:
+                return
+            time.sleep(poll_interval)
+
+    def tail_file(self, present_file):
+        """Process only the complete records appended to a file since its last committed offset.
+
+        Returns the number of new rows processed. Outputs are appended to, and
+        the duplicate check also compares against the earlier rows of the file;
+        as those rows are already written, only the appended rows of a repeated
+        key are reported, not its first occurrence. Near duplicates are only
+        found among records appended together. If the header changed or the
+        file shrank, it was replaced, and it is processed again from the start.
+        """
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        if not self.input_format(present_file).splittable:
+            logging.warning(f"Cannot tail {present_file}: only delimited files with double quotes can be split into records")
+            return 0
+        tail = self.tail_states.get(present_file)
+        if tail is None:
+            output_paths = {
+                kind: Path(self.file_manager.output_file_location) / output_name(present_file, suffix)
+                for kind, suffix in (('out', '.out.csv'), ('bad', '.bad.csv'), ('metadata', '.metadata.csv'))
+            }
+            from tail import TailState
+            tail = TailState(self.tail_dir, present_file, output_paths).load()
+            self.tail_states[present_file] = tail
+
+        size = file_location.stat().st_size
+        if size == tail.state['byte_offset']:
+            return 0
+        header, header_offset = read_header(file_location)
+        header_hash = hashlib.sha1(header).hexdigest()
+        if tail.state['header_hash'] != header_hash or size < tail.state['byte_offset']:
+            if tail.state['header_hash'] is not None:
+                logging.warning(f"File {present_file} was replaced, processing it again from the start")
+            tail.reset(header_hash, header_offset)
+
+        duplicate_check_attributes = self.schema_manager.config.get(file_family(present_file), {}).get('duplicate_check', [])
+        if self.schema_manager.config.get(file_family(present_file), {}).get('fuzzy_duplicate_check'):
+            logging.warning(f"Tailing {present_file}: near duplicates are only found within each batch of appended records")
+        new_rows = 0
+        for start, end, data in iter_record_chunks(file_location, tail.state['byte_offset'],
+                                                   self.chunk_size or 64 * 1024 * 1024, complete_only=True):
+            logging.info(f"Processing {present_file} appended bytes {start}-{end}")
+            self.reset()
+            self.clean_records = self.read_input(present_file, io.BytesIO(header + data))
+            rows = len(self.clean_records)
+            first_row = tail.state['rows_committed']
+            self.clean_records.index = pd.RangeIndex(first_row, first_row + rows)
+
+            self.run_checks(present_file)
+            keys, _ = self.drop_seen_duplicates(present_file, duplicate_check_attributes, tail)
+
+            for kind, df in (('out', self.clean_records), ('bad', self.bad_records),
+                             ('metadata', pd.DataFrame(self.metadata))):
+                path = tail.output_paths[kind]
+                if not df.empty:
+                    self.engine.to_csv(df, path, append=path.exists() and path.stat().st_size > 0)
+            tail.commit(end, rows, keys)
+            new_rows += rows
+
+        if new_rows:
+            logging.info(f"Processed {new_rows} new rows of {present_file} "
+                         f"({tail.state['rows_committed']} rows in total)")
+        return new_rows
+
+    def estimate_files(self, blocks=64, block_bytes=256 * 1024, seed=None):
+        """Estimate issue rates for every pending file from a random sample, without writing outputs."""
+        files = self.file_manager.get_files_to_process()
+        reports = {}
+        for present_file in files:
+            try:
+                reports[present_file] = self.estimate_file(present_file, blocks, block_bytes, seed)
+            except Exception as e:
+                logging.exception(f"estimate failed for {present_file} because {e}")
+        return reports
+
+    def estimate_file(self, present_file, blocks=64, block_bytes=256 * 1024, seed=None):
+        """Estimate the null, type, lookup, duplicate and unparseable-phone rates of a file from sampled blocks.
+
+        Blocks of records are read at random byte offsets, aligned to record
+        boundaries, and the configured checks are run on them. Rates come with
+        95% confidence intervals that treat each block as a cluster; the
+        duplicate rate weighs rows by where their duplicates were found, see
+        duplicate_weights. Nothing is written and clean_records/bad_records
+        are left as they were.
+        """
+        started = time.time()
+        file_location = Path(self.file_manager.source_file_location) / present_file
+        file_config = self.schema_manager.config.get(file_family(present_file), {})
+        input_format = self.input_format(present_file)
+        if not input_format.splittable:
+            logging.warning(f"Cannot sample {present_file}: only delimited files with double quotes can be split into records")
+            return {}
+        header, sampled = sample_record_blocks(file_location, blocks, block_bytes, seed, input_format.delimiter)
+
+        frames = []
+        for block_id, data in enumerate(sampled):
+            frame = self.read_input(present_file, io.BytesIO(header + data))
+            frame['__block'] = block_id
+            frames.append(frame)
+        if not frames:
+            logging.warning(f"No records could be sampled from {present_file}")
+            return {}
+        sample = pd.concat(frames, ignore_index=True)
+        blocks_of_rows = sample.pop('__block')
+
+        sample_bytes = sum(len(data) for data in sampled)
+        data_bytes = file_location.stat().st_size - len(header)
+        fraction = min(1.0, sample_bytes / data_bytes) if data_bytes else 1.0
+        report = {
+            'file': present_file,
+            'sampled_rows': len(sample),
+            'sampled_fraction': round(fraction, 6),
+            'estimated_rows': int(round(len(sample) / fraction)),
+        }
+
+        issues = {}
+        null_attributes = [a for a in file_config.get('null_check', []) if a in sample.columns]
+        if null_attributes:
+            issues['null'] = sample[null_attributes].isnull().any(axis=1)
+        type_attributes = [a for a in file_config.get('type_check', [])
+                           if a in sample.columns and a in self.schema_manager.schema]
+        if type_attributes:
+            invalid = pd.Series(False, index=sample.index)
+            for attribute in type_attributes:
+                invalid |= self.invalid_type_mask(sample[attribute], self.schema_manager.schema[attribute])
+            issues['type'] = invalid
+        lookup_checks = [self.missing_from_reference(sample, spec) for spec in file_config.get('lookup_check', [])]
+        lookup_checks = [checked for checked in lookup_checks if checked is not None]
+        if lookup_checks:
+            issues['lookup'] = pd.Series(np.logical_or.reduce([missing for _, missing in lookup_checks]))
+        duplicate_attributes = [a for a in file_config.get('duplicate_check', []) if a in sample.columns]
+        if duplicate_attributes:
+            issues['duplicate'] = self.duplicate_weights(sample[duplicate_attributes], blocks_of_rows, fraction)
+        phone_attributes = [a for a in file_config.get('phonenumber_check', []) if a in sample.columns]
+        e164_attributes = [a for a in file_config.get('phonenumber_e164_check', []) if a in sample.columns]
+        if phone_attributes or e164_attributes:
+            # clean_phonenumber prints every record, so its rules are run through their vectorized copy instead.
+            from phones import MISSING, legacy_phone_numbers, normalize_phone_numbers
+            unparsed = [(legacy_phone_numbers(sample[attribute])[0] == MISSING).to_numpy()
+                        for attribute in phone_attributes]
+            unparsed += [(normalize_phone_numbers(sample[attribute], self.phone_region)[0] == MISSING).to_numpy()
+                         for attribute in e164_attributes]
+            issues['unparseable_phone'] = pd.Series(np.logical_or.reduce(unparsed))
+
+        for issue, flags in issues.items():
+            rate, low, high = (min(1.0, value) for value in
+                               self.clustered_rate(flags.to_numpy(), blocks_of_rows.to_numpy()))
+            report[issue] = {'rate': round(rate, 6), 'ci95': [round(low, 6), round(high, 6)]}
+            logging.info(f"Estimated {issue} rate for {present_file}: {rate:.4%} (95% CI {low:.4%} - {high:.4%})")
+
+        report['seconds'] = round(time.time() - started, 3)
+        logging.info(f"Estimated {present_file} from {len(sample)} sampled rows "
+                     f"({fraction:.2%} of the file) in {report['seconds']}s")
+        return report
+
+    def duplicate_weights(self, keys, blocks_of_rows, fraction):
+        """Return the weight of every sampled row in the estimated duplicate rate.
+
+        A row whose duplicate is in its own block, as in sorted or clustered
+        files, is seen whatever the sampled fraction and counts once. A row
+        whose duplicate is only in another block is seen when that block
+        happened to be sampled, with a probability of about the sampled
+        fraction of the rest of the file, so it counts as 1 / that fraction.
+        Rows whose duplicates were not sampled at all count 0. Duplicates just
+        across a block's edge are scaled up like those far away, so files
+        with short runs of repeated keys come out a little high.
+        """
+        blocks = blocks_of_rows.to_numpy()
+        in_block = self.engine.duplicated(keys.assign(__block=blocks), list(keys.columns) + ['__block'], keep=False)
+        anywhere = self.engine.duplicated(keys, list(keys.columns), keep=False)
+        in_block, anywhere = in_block.to_numpy(), anywhere.to_numpy()
+        sampled_blocks = len(np.unique(blocks))
+        other_fraction = fraction * (sampled_blocks - 1) / sampled_blocks if sampled_blocks else 0.0
+        weights = in_block.astype(float)
+        if other_fraction > 0:
+            weights[anywhere & ~in_block] = 1 / other_fraction if fraction < 1 else 1.0
+        return pd.Series(weights)
+
+    def clustered_rate(self, flags, clusters):
+        """Return a rate and its 95% confidence interval, treating each sampled block as a cluster."""
+        totals = np.bincount(clusters, weights=flags.astype(float))
+        sizes = np.bincount(clusters).astype(float)
+        rate = totals.sum() / sizes.sum()
+        k = np.count_nonzero(sizes)
+        if k < 2:
+            return rate, rate, rate
+        variance = k / (k - 1) * np.sum((totals - rate * sizes) ** 2) / sizes.sum() ** 2
+        margin = 1.96 * np.sqrt(variance)
+        return rate, max(0.0, rate - margin), min(1.0, rate + margin)
+
     def null_check(self, file, null_check_attributes):
         """Perform a null check on the specified attributes in the file."""
         logging.info(f"Performing null check on file: {file}")
@@ -191,7 +1432,128 @@ class FileProcessor:
         # Append bad records to the main bad_records DataFrame
         self.bad_records = pd.concat([self.bad_records, bad_records])
 
-        self.save_bad_records(file, bad_records)
+    def type_check(self, file, type_check_attributes):
+        """Validate the specified attributes against their DataType in the schema file."""
+        logging.info(f"Performing type check on file: {file}")
+        invalid = pd.Series(False, index=self.clean_records.index)
+
+        for attribute in type_check_attributes:
+            data_type = self.schema_manager.schema.get(attribute)
+            if attribute not in self.clean_records.columns or data_type is None:
+                logging.warning(f"Skipping type check on {attribute}: not in file {file} or schema")
+                continue
+            invalid_values = self.invalid_type_mask(self.clean_records[attribute], data_type)
+            if invalid_values.any():
+                logging.warning(f"Values not of type {data_type} found in {attribute} of file {file}")
+                invalid |= invalid_values
+
+                # Add metadata for type issue
+                self.metadata.append({
+                    'Type_of_issue': 'type',
+                    'Row_num_list': self.clean_records.index[invalid_values].tolist()
+                })
+
+        if invalid.any():
+            # Append bad records to the main bad_records DataFrame and remove them from clean_records
+            self.bad_records = pd.concat([self.bad_records, self.clean_records[invalid]])
+            self.clean_records = self.clean_records[~invalid]
+
+    def invalid_type_mask(self, column, data_type):
+        """Return a boolean mask of the non-null values in column that do not coerce to data_type.
+
+        data_type is the schema DataType, optionally with an argument in brackets:
+        a length for varchar(n)/char(n), a strftime format for date(...)/datetime(...)
+        or a regular expression for regex(...).
+        """
+        match = DATA_TYPE_RE.match(data_type)
+        if not match:
+            logging.warning(f"Unknown data type {data_type}")
+            return pd.Series(False, index=column.index)
+        base_type, argument = match.group(1).lower(), match.group(2)
+        present = column.notna()
+
+        if base_type in INT_TYPES:
+            numbers = pd.to_numeric(column, errors='coerce')
+            return present & (numbers.isna() | (numbers % 1 != 0))
+        if base_type in FLOAT_TYPES:
+            return present & pd.to_numeric(column, errors='coerce').isna()
+        if base_type in DATE_TYPES:
+            # Numbers would be taken for epoch nanoseconds, so compact dates such as 20240101 are parsed as text.
+            values = column.astype(str)
+            if column.dtype.kind in 'iuf':
+                whole = present & (column % 1 == 0)
+                values = values.mask(whole, column[whole].astype('int64').astype(str))
+            # Without a format pandas would take one from the first value and reject every other layout,
+            # so each value is parsed on its own and chunks agree whatever row they start at.
+            dates = pd.to_datetime(values.where(present), errors='coerce',
+                                   format=argument.strip() if argument else 'mixed')
+            return present & dates.isna()
+        if base_type in BOOL_TYPES:
+            return present & ~column.astype(str).str.strip().str.lower().isin(BOOL_VALUES)
+
+        values = column.astype(str)
+        if base_type == 'regex' and argument:
+            return present & ~values.str.fullmatch(re.compile(argument))
+        if base_type in TYPE_PATTERNS:
+            return present & ~values.str.strip().str.fullmatch(TYPE_PATTERNS[base_type])
+        if base_type in STRING_TYPES:
+            if argument and argument.strip().isdigit():
+                return present & (values.str.len() > int(argument))
+            return pd.Series(False, index=column.index)
+
+        logging.warning(f"Unknown data type {data_type}")
+        return pd.Series(False, index=column.index)
+
+    def reference_index(self, reference_path, column):
+        """Return the index of a reference column, shared by all files checked against it."""
+        key = (str(reference_path), column)
+        if key not in self.reference_indexes:
+            from lookup import ReferenceIndex
+            self.reference_indexes[key] = ReferenceIndex(reference_path, column, self.lookup_dir)
+        return self.reference_indexes[key]
+
+    def missing_from_reference(self, frame, spec):
+        """Return the attribute of a lookup_check spec and the mask of rows of frame whose value is not in its
+        reference, or None if the attribute is not in frame. Null values are not checked."""
+        from lookup import parse_lookup_spec, lookup_values
+        attribute, reference_path, column = parse_lookup_spec(spec, Path(self.schema_manager.config_file).parent)
+        if attribute not in frame.columns:
+            return None
+        present, values = lookup_values(frame[attribute])
+        missing = np.zeros(len(frame), dtype=bool)
+        missing[present] = ~self.reference_index(reference_path, column).contains(values)
+        return attribute, missing
+
+    def lookup_check(self, file, lookup_check_attributes):
+        """Check that the values of attributes are in a reference table.
+
+        Attributes are configured as <attribute>=<reference csv>[<column>],
+        the reference path relative to the config file and the column
+        defaulting to the attribute's name.
+        """
+        logging.info(f"Performing lookup check on file: {file}")
+        invalid = pd.Series(False, index=self.clean_records.index)
+
+        for spec in lookup_check_attributes:
+            checked = self.missing_from_reference(self.clean_records, spec)
+            if checked is None:
+                logging.warning(f"Skipping lookup check {spec}: attribute not in file {file}")
+                continue
+            attribute, missing = checked
+            if missing.any():
+                logging.warning(f"Values missing from the reference found in {attribute} of file {file}")
+                invalid |= missing
+
+                # Add metadata for lookup issue
+                self.metadata.append({
+                    'Type_of_issue': 'lookup',
+                    'Row_num_list': self.clean_records.index[missing].tolist()
+                })
+
+        if invalid.any():
+            # Append bad records to the main bad_records DataFrame and remove them from clean_records
+            self.bad_records = pd.concat([self.bad_records, self.clean_records[invalid]])
+            self.clean_records = self.clean_records[~invalid]
 
     def duplicate_check(self, file, duplicate_check_attributes):
         """Perform a duplicate check on the specified attributes in the file."""
@@ -199,7 +1561,9 @@ class FileProcessor:
         bad_records = pd.DataFrame()
 
         if duplicate_check_attributes:
-            duplicates = self.clean_records[self.clean_records.duplicated(subset=duplicate_check_attributes, keep=False)]
+            # In a batch of files, rows are only duplicates of rows from the same file.
+            subset = duplicate_check_attributes + ([self.batch_scope] if self.batch_scope else [])
+            duplicates = self.clean_records[self.engine.duplicated(self.clean_records, subset, keep=False)]
             if not duplicates.empty:
                 logging.warning(f"Duplicate records found based on attributes {duplicate_check_attributes} in file {file}")
                 bad_records = pd.concat([bad_records, duplicates])
@@ -211,13 +1575,51 @@ class FileProcessor:
                 })
 
             # Remove duplicates from clean_records
-            self.clean_records = self.clean_records.drop_duplicates(subset=duplicate_check_attributes, keep='first')
+            self.clean_records = self.clean_records[~self.engine.duplicated(self.clean_records, subset, keep='first')]
 
             # Append bad records to the main bad_records DataFrame
             self.bad_records = pd.concat([self.bad_records, bad_records])
 
-            self.save_bad_records(file, bad_records)
+    def fuzzy_duplicate_check(self, file, fuzzy_duplicate_check_attributes):
+        """Perform a near-duplicate check on the specified attributes in the file.
 
+        Keys are normalized (case, punctuation, URL scheme, 'www.' and trailing
+        slashes) and compared with MinHash/LSH, so values like 'http://www.a.com/'
+        and 'a.com' count as duplicates. As with duplicate_check, every member
+        of a duplicate group is reported and the first one is kept as clean.
+        """
+        logging.info(f"Performing fuzzy duplicate check on file: {file}")
+        attributes = [a for a in fuzzy_duplicate_check_attributes if a in self.clean_records.columns]
+        if not attributes or self.clean_records.empty:
+            return
+
+        from fuzzy import normalize_keys, near_duplicate_groups
+        keys = normalize_keys(self.clean_records, attributes).to_numpy()
+        if self.batch_scope is None:
+            groups = near_duplicate_groups(keys)
+        else:
+            # Group each file of the batch on its own, with group ids that do not collide between files.
+            groups = np.empty(len(keys), dtype=np.int64)
+            scopes = self.clean_records[self.batch_scope].to_numpy()
+            offset = 0
+            for scope in np.unique(scopes):
+                rows = scopes == scope
+                groups[rows] = near_duplicate_groups(keys[rows]) + offset
+                offset += 2 * int(rows.sum())
+        in_group = np.bincount(groups)[groups] > 1
+        if in_group.any():
+            duplicates = self.clean_records[in_group]
+            logging.warning(f"Near-duplicate records found based on attributes {attributes} in file {file}")
+            self.bad_records = pd.concat([self.bad_records, duplicates])
+
+            # Add metadata for fuzzy duplicate issue
+            self.metadata.append({
+                'Type_of_issue': 'fuzzy_duplicate',
+                'Row_num_list': duplicates.index.tolist()
+            })
+
+            # Keep the first record of every group in clean_records
+            self.clean_records = self.clean_records[~pd.Series(groups).duplicated(keep='first').to_numpy()]
 
     def clean_phonenumber(self, file, phonenumber_check_attributes):
         """Check and clean phone numbers in the specified attributes."""
@@ -328,6 +1730,28 @@ class FileProcessor:
         except Exception as e:
             logging.error(f"phone number check failed(within function) because {e}")
 
+    def normalize_phonenumber(self, file, phonenumber_attributes):
+        """Write the phone numbers of the specified attributes in E.164 format to contact number 1 and 2.
+
+        Unlike clean_phonenumber, numbers with a country code or trunk prefix,
+        hyphens or brackets are recognised; numbers without a country code
+        are taken to be of phone_region. The whole column is normalized at
+        once, see phones.normalize_phone_numbers.
+        """
+        logging.info(f"Performing phone number normalization on file: {file}")
+        from phones import MISSING, normalize_phone_numbers
+        for attribute in phonenumber_attributes:
+            if attribute not in self.clean_records.columns:
+                logging.warning(f"Skipping phone number normalization on {attribute}: not in file {file}")
+                continue
+            contact1, contact2 = normalize_phone_numbers(self.clean_records[attribute], self.phone_region)
+            unparsed = int(((contact1 == MISSING) & self.clean_records[attribute].notna()).sum())
+            if unparsed:
+                logging.warning(f"{unparsed} values of {attribute} in file {file} hold no recognisable phone number")
+            self.clean_records['contact number 1'] = contact1
+            self.clean_records['contact number 2'] = contact2
+            self.clean_records = self.clean_records.drop(columns=[attribute])
+
     def test_phone_number(self,file,phone_column):
         logging.info(f"testing phone numbers on column: {phone_column}")
         try:
@@ -373,8 +1797,8 @@ class FileProcessor:
         """Save clean records to a file."""
         try:
             if df is not None and not df.empty:
-                clean_file_location = Path(self.file_manager.output_file_location) / file.replace('.csv', '.out.csv')
-                df.to_csv(clean_file_location, index=False, encoding='utf-8')
+                clean_file_location = Path(self.file_manager.output_file_location) / output_name(file, '.out.csv')
+                self.engine.to_csv(df, clean_file_location)
                 logging.info(f"Clean records saved to {clean_file_location}")
         except Exception as e:
             logging.error(f"Error saving good records: {e}")
@@ -383,11 +1807,8 @@ class FileProcessor:
         """Save bad records to a file."""
         try:
             if df is not None and not df.empty:
-                bad_file_location = Path(self.file_manager.output_file_location) / file.replace('.csv', '.bad.csv')
-                if bad_file_location.exists():
-                    df.to_csv(bad_file_location, mode='a', index=False, encoding='utf-8')
-                else:
-                    df.to_csv(bad_file_location, index=False, encoding='utf-8')
+                bad_file_location = Path(self.file_manager.output_file_location) / output_name(file, '.bad.csv')
+                self.engine.to_csv(df, bad_file_location)
                 logging.info(f"Bad records saved to {bad_file_location}")
         except Exception as e:
             logging.error(f"Error saving bad records: {e}")
@@ -395,23 +1816,166 @@ class FileProcessor:
     def save_metadata(self, file):
         """Save metadata about the issues found in the file."""
         try:
-            metadata_file_location = Path(self.file_manager.output_file_location) / file.replace('.csv', '.metadata.csv')
+            metadata_file_location = Path(self.file_manager.output_file_location) / output_name(file, '.metadata.csv')
             metadata_df = pd.DataFrame(self.metadata)
-            metadata_df.to_csv(metadata_file_location, index=False, encoding='utf-8')
+            self.engine.to_csv(metadata_df, metadata_file_location)
             logging.info(f"Metadata saved to {metadata_file_location}")
         except Exception as e:
             logging.error(f"Error saving metadata: {e}")
 
 
+def size_argument(text):
+    """Command line type of byte sizes, see governor.parse_size; the governor is only loaded for sizes given."""
+    from governor import parse_size
+    return parse_size(text)
+
+
 if __name__ == '__main__':
-    source_file_location = sys.argv[1]
-    scanned_files = sys.argv[2]
-    config_file = sys.argv[3]
-    schema_file = sys.argv[4]
-    output_file_location = sys.argv[5]
+    parser = argparse.ArgumentParser(description="Run data quality checks on new files in a source directory.")
+    parser.add_argument('source_file_location')
+    parser.add_argument('scanned_files')
+    parser.add_argument('config_file')
+    parser.add_argument('schema_file')
+    parser.add_argument('output_file_location')
+    parser.add_argument('--chunk-size', type=int, default=256 * 1024 * 1024,
+                        help="files larger than this many bytes are processed in checkpointed chunks (0 disables)")
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help="directory for chunk checkpoints (default: <output_file_location>/.checkpoints)")
+    parser.add_argument('--lease-dir', default=None,
+                        help="shared directory for file leases when several workers process the same source directory")
+    parser.add_argument('--worker-id', default=None, help="worker name used in leases (default: <host>:<pid>)")
+    parser.add_argument('--lease-ttl', type=int, default=300,
+                        help="seconds without a heartbeat after which a lease is considered stale")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='pandas',
+                        help="DataFrame engine: pandas (default) or arrow for the multithreaded PyArrow reader")
+    parser.add_argument('--estimate', action='store_true',
+                        help="only estimate issue rates from a random sample of each pending file, writing no outputs")
+    parser.add_argument('--sample-blocks', type=int, default=64, help="number of random blocks sampled per file in estimate mode")
+    parser.add_argument('--sample-block-size', type=int, default=256 * 1024, help="bytes per sampled block in estimate mode")
+    parser.add_argument('--tail', action='store_true',
+                        help="incrementally process only the records appended to each file since the last run")
+    parser.add_argument('--poll-interval', type=float, default=0,
+                        help="in tail mode, keep polling every this many seconds instead of running once")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes that check the chunks of one large file in parallel (default: 1)")
+    parser.add_argument('--memory-budget', type=size_argument, default=None,
+                        help="memory budget such as 4G; each file is then processed in memory, in chunks or with its "
+                             "duplicate keys spilled to disk to fit it, and large files wait for budget to free up")
+    parser.add_argument('--memory-dir', default=None,
+                        help="directory for the memory reservations shared by the workers on this host "
+                             "(default: <tmp>/dqm-memory)")
+    parser.add_argument('--batch-small-files', type=size_argument, default=0,
+                        help="check files up to this size together with other small files of their family "
+                             "(such as 1M; default: 0, every file alone)")
+    parser.add_argument('--batch-max-size', type=size_argument, default=64 * 1024 * 1024,
+                        help="largest total size of one batch of small files (default: 64M)")
+    parser.add_argument('--cross-file-duplicates', action='store_true',
+                        help="in a batch, also report duplicates between different files")
+    parser.add_argument('--schedule', choices=POLICIES, default='listdir',
+                        help="order of the pending files: listdir (default), priority (per-family 'priority' rows "
+                             "of the config file, highest first), oldest (by file name timestamp) or smallest")
+    parser.add_argument('--aging', type=float, default=3600,
+                        help="seconds of waiting that raise a file's priority by one and halve its effective size "
+                             "(0 disables aging)")
+    parser.add_argument('--latency-log', default=None,
+                        help="CSV file that queue wait and latency of every processed file are appended to "
+                             "(default: <cache_dir>/latency.csv)")
+    parser.add_argument('--dataset-dir', default=None,
+                        help="write clean records into a dataset partitioned by family and date under this "
+                             "directory instead of one .out.csv per file")
+    parser.add_argument('--compact', action='store_true',
+                        help="merge the small files of every dataset partition and exit (needs --dataset-dir)")
+    parser.add_argument('--target-file-size', type=size_argument, default=128 * 1024 * 1024,
+                        help="size compaction aims for per dataset file (default: 128M)")
+    parser.add_argument('--parse-cache', default=None,
+                        help="directory for Arrow sidecars of parsed input files and of the chunks of chunked or "
+                             "parallel runs, reused while a file is unchanged; tailed appends are always parsed")
+    parser.add_argument('--parse-cache-size', type=size_argument, default=10 * 1024 ** 3,
+                        help="size above which the least recently used sidecars are evicted (default: 10G)")
+    parser.add_argument('--check-cache', default=None,
+                        help="directory for the results of every check of files processed in memory, so that "
+                             "--reprocess only runs the checks whose config or schema changed")
+    parser.add_argument('--reprocess', action='store_true',
+                        help="after a config or schema change, rebuild the outputs of the files with results in "
+                             "--check-cache, running only the changed checks of the affected families")
+    parser.add_argument('--configured-families-only', action='store_true',
+                        help="only pick up files of the families in the config file, skipping all others "
+                             "without opening them")
+    parser.add_argument('--cdc-dir', default=None,
+                        help="directory for the last clean records of every family; files of families with "
+                             "'cdc_key' attributes in the config then get a .delta.csv of inserted, updated and "
+                             "deleted rows instead of a full .out.csv")
+    parser.add_argument('--phone-region', default='IN',
+                        help="region of phone numbers without a country code, for phonenumber_e164_check; one "
+                             "of the regions in phones.REGIONS (default: IN)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="directory for the parsed config/schema cache and the empty-poll signature "
+                             "(default: <output_file_location>/.cache)")
+    args = parser.parse_args()
+    if args.phone_region != parser.get_default('phone_region'):
+        from phones import REGIONS
+        if args.phone_region not in REGIONS:
+            parser.error(f"argument --phone-region: invalid choice: {args.phone_region!r} "
+                         f"(choose from {', '.join(sorted(REGIONS))})")
+
+    dataset = None
+    if args.dataset_dir:
+        from dataset import PartitionedDataset
+        dataset = PartitionedDataset(args.dataset_dir, args.target_file_size)
+    if args.compact:
+        if dataset is None:
+            parser.error("--compact needs --dataset-dir")
+        dataset.compact()
+        sys.exit(0)
+    if args.reprocess and not args.check_cache:
+        parser.error("--reprocess needs --check-cache")
+    if args.cdc_dir and dataset is not None:
+        parser.error("--cdc-dir cannot be used with --dataset-dir")
+
+    cache_dir = args.cache_dir or Path(args.output_file_location) / '.cache'
+    file_manager = FileManager(args.source_file_location, args.scanned_files, args.output_file_location, cache_dir)
+    # The parsed config is cached, so loading it before the empty-poll check costs a single read.
+    schema_manager = SchemaManager(args.config_file, args.schema_file, cache_dir)
+    if args.configured_families_only:
+        file_manager.families = set(schema_manager.config)
+    file_manager.input_suffixes = schema_manager.input_suffixes()
+    if not args.tail and not args.estimate and not args.reprocess and file_manager.nothing_new():
+        logging.info(f"no new files in {args.source_file_location}")
+        sys.exit(0)
+    from leases import LeaseManager
+    from governor import MemoryGovernor
+    from parsecache import ParseCache
+    from cdc import ChangeCapture
+    leases = LeaseManager(args.lease_dir, args.worker_id, args.lease_ttl) if args.lease_dir else None
+    scheduler = Scheduler(args.schedule, args.source_file_location, schema_manager.config, args.aging,
+                          args.latency_log or Path(cache_dir) / 'latency.csv')
+    governor = MemoryGovernor(args.memory_budget, args.memory_dir) if args.memory_budget else None
+    processor = FileProcessor(file_manager, schema_manager, chunk_size=args.chunk_size,
+                              checkpoint_dir=args.checkpoint_dir, leases=leases, engine=get_engine(args.engine),
+                              governor=governor, workers=args.workers, dataset=dataset,
+                              batch_bytes=args.batch_small_files, batch_max_bytes=args.batch_max_size,
+                              cross_file_duplicates=args.cross_file_duplicates, scheduler=scheduler,
+                              parse_cache=ParseCache(args.parse_cache, args.parse_cache_size) if args.parse_cache else None,
+                              check_cache_dir=args.check_cache,
+                              change_capture=ChangeCapture(args.cdc_dir) if args.cdc_dir else None,
+                              phone_region=args.phone_region)
+
+    if args.estimate:
+        processor.estimate_files(args.sample_blocks, args.sample_block_size)
+        sys.exit(0)
+
+    if args.tail:
+        processor.tail_files(args.poll_interval)
+        sys.exit(0)
 
-    file_manager = FileManager(source_file_location, scanned_files, output_file_location)
-    schema_manager = SchemaManager(config_file, schema_file)
-    processor = FileProcessor(file_manager, schema_manager)
+    if args.reprocess:
+        processor.reprocess_files()
+        sys.exit(0)
 
-    processor.process_files()
+    if leases is not None:
+        leases.start()
+    try:
+        processor.process_files()
+    finally:
+        if leases is not None:
+            leases.stop()
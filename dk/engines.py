@@ -0,0 +1,172 @@
+import io
+import csv
+import logging
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Imported by ArrowEngine, so the pandas engine never pays for loading pyarrow.
+pa = None
+pa_csv = None
+pa_json = None
+
+
+def header_names(source, delimiter=',', quotechar='"', encoding='utf-8'):
+    """Return the column names in the header of a delimited file path or byte buffer, leaving a buffer where it was."""
+    if hasattr(source, 'read'):
+        position = source.tell()
+        text = io.TextIOWrapper(source, encoding=encoding, newline='')
+        try:
+            return next(csv.reader(text, delimiter=delimiter, quotechar=quotechar), [])
+        finally:
+            text.detach()
+            source.seek(position)
+    with open(source, 'r', encoding=encoding, newline='') as f:
+        return next(csv.reader(f, delimiter=delimiter, quotechar=quotechar), [])
+
+
+class PandasEngine:
+    """DataFrame engine backed by plain pandas. This is the default.
+
+    Unlike the original reader it does not infer column types, so values such
+    as 1.50 or 007 are written as they were read rather than as 1.5 or 7.0.
+    """
+
+    name = 'pandas'
+
+    def read_csv(self, source, delimiter=',', quotechar='"', encoding='utf-8'):
+        """Read a CSV (or other delimited) file path or byte buffer into a DataFrame of text columns.
+
+        Types are not inferred, so a value is written out as it was read,
+        however the file was split: a chunk or a batch with a blank in an
+        integer column would otherwise be read as float and write '1.0'.
+        """
+        return pd.read_csv(source, sep=delimiter, quotechar=quotechar, encoding=encoding, dtype=str)
+
+    def read_jsonl(self, source, text_columns=()):
+        """Read a JSON Lines file path or byte buffer into a DataFrame.
+
+        JSON strings are kept as they are instead of being converted to
+        numbers, as by the arrow reader, and JSON numbers of text_columns are
+        written as text. pandas reads integers of a column with nulls as
+        floats, so whole numbers lose the '.0' it gives them.
+        """
+        frame = pd.read_json(source, lines=True, convert_dates=False, encoding='utf-8', dtype=False)
+        for column in text_columns:
+            if column not in frame.columns:
+                continue
+            values = frame[column]
+            # Only JSON numbers are rewritten; strings such as '007' are left as they are.
+            numbers = pd.to_numeric(values.where(values.map(type).isin([int, float])), errors='coerce')
+            found = numbers.notna()
+            text = numbers[found].map(lambda number: str(int(number)) if number % 1 == 0 else str(number))
+            frame[column] = values.astype(object).mask(found, text)
+        return frame
+
+    def read_fixed_width(self, source, colspecs, encoding='utf-8', text_columns=()):
+        """Read a fixed-width file path or byte buffer, with its column names in the first line."""
+        return pd.read_fwf(source, colspecs=colspecs, encoding=encoding,
+                           dtype={column: str for column in text_columns} or None)
+
+    def duplicated(self, df, subset, keep='first'):
+        """Return a boolean mask of duplicate rows over the subset columns, like DataFrame.duplicated."""
+        return df.duplicated(subset=subset, keep=keep)
+
+    def to_csv(self, df, path, append=False):
+        """Write a DataFrame to a CSV file, or append it without a header."""
+        df.to_csv(path, mode='a' if append else 'w', header=not append, index=False, encoding='utf-8')
+
+
+class ArrowEngine(PandasEngine):
+    """DataFrame engine that parses with the multithreaded PyArrow CSV reader.
+
+    Text columns are kept in Arrow-backed string storage instead of Python
+    objects, and duplicates are found with an Arrow hash group-by. Output is
+    still written by pandas so that both engines produce identical files.
+    """
+
+    name = 'arrow'
+
+    def __init__(self):
+        global pa, pa_csv, pa_json
+        try:
+            import pyarrow
+            import pyarrow.csv
+            import pyarrow.json
+        except ImportError:
+            raise ImportError("the arrow engine requires pyarrow (pip install pyarrow)")
+        pa, pa_csv, pa_json = pyarrow, pyarrow.csv, pyarrow.json
+        self.read_options = pa_csv.ReadOptions(use_threads=True)
+        self.parse_options = pa_csv.ParseOptions(newlines_in_values=True)
+
+    def read_csv(self, source, delimiter=',', quotechar='"', encoding='utf-8'):
+        read_options, parse_options = self.read_options, self.parse_options
+        if delimiter != ',' or quotechar != '"':
+            parse_options = pa_csv.ParseOptions(delimiter=delimiter, quote_char=quotechar, newlines_in_values=True)
+        if encoding not in ('utf-8', 'utf-8-sig'):
+            read_options = pa_csv.ReadOptions(use_threads=True, encoding=encoding)
+        # Every column is read as text, as by the pandas engine; arrow only takes the types by column name.
+        names = header_names(source, delimiter, quotechar, encoding)
+        convert_options = pa_csv.ConvertOptions(strings_can_be_null=True,
+                                                column_types={name: pa.string() for name in names})
+        table = pa_csv.read_csv(source, read_options=read_options,
+                                parse_options=parse_options, convert_options=convert_options)
+        return table.to_pandas(types_mapper=self.types_mapper)
+
+    def read_jsonl(self, source, text_columns=()):
+        # The arrow reader never converts JSON strings to numbers; numbers of text_columns are written as text
+        # here, as an integer column with nulls would otherwise become float.
+        try:
+            table = pa_json.read_json(source)
+        except pa.ArrowInvalid as e:
+            # Arrow wants one type per field; records that mix types, such as an id that is a number in some
+            # and a string in others, are still read by pandas.
+            logging.warning(f"arrow JSON reader fell back to pandas because {e}")
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            return super().read_jsonl(source, text_columns)
+        for column in text_columns:
+            if column in table.column_names and not pa.types.is_string(table.schema.field(column).type):
+                index = table.column_names.index(column)
+                table = table.set_column(index, column, table.column(column).cast(pa.string()))
+        return table.to_pandas(types_mapper=self.types_mapper)
+
+    @staticmethod
+    def types_mapper(arrow_type):
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+            return pd.StringDtype('pyarrow')
+        return None
+
+    def duplicated(self, df, subset, keep='first'):
+        try:
+            table = pa.Table.from_pandas(df[subset], preserve_index=False)
+        except Exception as e:
+            logging.warning(f"arrow duplicate check fell back to pandas because {e}")
+            return super().duplicated(df, subset, keep)
+        table = table.append_column('__row', pa.array(np.arange(len(df))))
+        groups = table.group_by(subset, use_threads=True).aggregate([('__row', 'min'), ('__row', 'count')])
+        first_rows = groups.column('__row_min').to_numpy()
+        mask = np.ones(len(df), dtype=bool)
+        if keep == 'first':
+            mask[first_rows] = False
+        elif keep is False:
+            counts = groups.column('__row_count').to_numpy()
+            mask[first_rows[counts == 1]] = False
+        else:
+            return super().duplicated(df, subset, keep)
+        return pd.Series(mask, index=df.index)
+
+
+ENGINES = {
+    'pandas': PandasEngine,
+    'arrow': ArrowEngine,
+}
+
+
+def get_engine(name):
+    """Return an engine instance by name."""
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"unknown engine {name}, expected one of {sorted(ENGINES)}")
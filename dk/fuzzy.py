@@ -0,0 +1,193 @@
+import re
+import logging
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+URL_PREFIX_RE = re.compile(r'^(?:[a-z][a-z0-9+.-]*://)?(?:www\d?\.)?')
+PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+SHINGLE_SIZE = 3
+GRAM_BITS = 8 * SHINGLE_SIZE + 8  # shingle bytes plus an occurrence number
+NUM_PERM = 64
+BANDS = 16
+THRESHOLD = 0.9
+PRIME = (1 << 31) - 1
+BATCH_ROWS = 500000
+MAX_BUCKET = 100  # LSH buckets with more keys only have a random sample of their pairs verified
+
+
+def normalize_keys(frame, attributes):
+    """Build one normalized key per row from the given attributes.
+
+    Values are lowercased, URL schemes and a leading 'www.' are dropped and
+    punctuation and repeated whitespace are collapsed, so 'https://www.a.com/'
+    and 'a.com' or 'ACME, Inc.' and 'acme inc' get the same key. Rows where
+    every attribute is null get None.
+    """
+    parts = []
+    for attribute in attributes:
+        values = frame[attribute].astype(str).str.lower().str.strip()
+        values = values.str.replace(URL_PREFIX_RE, '', regex=True)
+        values = values.str.replace(PUNCTUATION_RE, ' ', regex=True)
+        values = values.str.replace(WHITESPACE_RE, ' ', regex=True).str.strip()
+        parts.append(values.where(frame[attribute].notna(), ''))
+    keys = parts[0]
+    for values in parts[1:]:
+        keys = keys + ' | ' + values
+    return keys.where(frame[attributes].notna().any(axis=1), None)
+
+
+def shingle_sets(keys):
+    """Return (starts, counts, grams): the character shingles of every key, concatenated.
+
+    Shingles are SHINGLE_SIZE consecutive bytes packed into one integer, so
+    they are exact and computed for all keys at once. Repeated shingles within
+    a key are numbered so that 'x111' and 'x1111' do not look identical. Keys
+    shorter than a shingle are padded. The shingles of key i are
+    grams[starts[i]:starts[i] + counts[i]].
+    """
+    encoded = [key.encode('utf-8').ljust(SHINGLE_SIZE, b'\0') for key in keys]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    buf = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    per_key = lengths - SHINGLE_SIZE + 1
+    row_ids = np.repeat(np.arange(len(encoded), dtype=np.uint64), per_key)
+    positions = np.repeat(np.cumsum(lengths) - lengths - (np.cumsum(per_key) - per_key), per_key) + np.arange(per_key.sum())
+    gram_bits = np.uint64(GRAM_BITS)
+    grams = (buf[positions] << np.uint64(16)) | (buf[positions + 1] << np.uint64(8)) | buf[positions + 2]
+    codes = np.sort((row_ids << gram_bits) | grams)
+    index = np.arange(len(codes))
+    run_start = np.maximum.accumulate(np.where(np.concatenate([[True], codes[1:] != codes[:-1]]), index, 0))
+    occurrence = np.minimum(index - run_start, 255).astype(np.uint64)
+    codes = np.unique(codes | (occurrence << np.uint64(8 * SHINGLE_SIZE)))
+    counts = np.bincount((codes >> gram_bits).astype(np.int64), minlength=len(encoded))
+    return np.cumsum(counts) - counts, counts, codes & np.uint64((1 << GRAM_BITS) - 1)
+
+
+def minhash_signatures(sets, seed=1):
+    """Return a (keys, NUM_PERM) array of MinHash signatures of the shingle sets."""
+    starts, counts, grams = sets
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, PRIME, size=NUM_PERM).astype(np.uint64)
+    b = rng.randint(0, PRIME, size=NUM_PERM).astype(np.uint64)
+    signatures = np.empty((len(starts), NUM_PERM), dtype=np.uint64)
+    for batch_start in range(0, len(starts), BATCH_ROWS):
+        batch = slice(batch_start, batch_start + BATCH_ROWS)
+        first, last = starts[batch][0], starts[batch][-1] + counts[batch][-1]
+        batch_grams = grams[first:last]
+        for p in range(NUM_PERM):
+            hashed = (a[p] * batch_grams + b[p]) % np.uint64(PRIME)
+            signatures[batch, p] = np.minimum.reduceat(hashed, starts[batch] - first)
+    return signatures
+
+
+def jaccard(sets, left, right):
+    """Return the exact Jaccard similarity of the shingle sets of each (left, right) key pair."""
+    starts, counts, grams = sets
+    gram_bits = np.uint64(GRAM_BITS)
+    similarity = np.empty(len(left))
+    for batch_start in range(0, len(left), BATCH_ROWS):
+        batch_left = left[batch_start:batch_start + BATCH_ROWS]
+        batch_right = right[batch_start:batch_start + BATCH_ROWS]
+        pair_ids = np.arange(len(batch_left), dtype=np.uint64)
+        codes = []
+        for keys in (batch_left, batch_right):
+            n = counts[keys]
+            positions = np.repeat(starts[keys] - (np.cumsum(n) - n), n) + np.arange(n.sum())
+            codes.append((np.repeat(pair_ids, n) << gram_bits) | grams[positions])
+        codes = np.sort(np.concatenate(codes))
+        shared = codes[1:][codes[1:] == codes[:-1]] >> gram_bits
+        intersection = np.bincount(shared.astype(np.int64), minlength=len(batch_left))
+        union = counts[batch_left] + counts[batch_right] - intersection
+        similarity[batch_start:batch_start + len(batch_left)] = intersection / union
+    return similarity
+
+
+def candidate_pairs(signatures, max_bucket=MAX_BUCKET):
+    """Return (left, right) index arrays of keys that share at least one LSH band bucket.
+
+    Every pair of keys in a bucket of up to max_bucket keys is a candidate.
+    Larger buckets, which only come from many keys that are nearly the
+    same, would make the number of pairs grow with the square of their size,
+    so their keys are shuffled and each is paired with the next
+    max_bucket - 1; such buckets are logged, as some of their pairs are
+    never verified.
+    """
+    rows_per_band = NUM_PERM // BANDS
+    multipliers = np.random.RandomState(0).randint(1, 1 << 62, size=rows_per_band).astype(np.uint64)
+    left, right = [], []
+    oversized = 0
+    for band in range(BANDS):
+        band_hash = signatures[:, band * rows_per_band:(band + 1) * rows_per_band] @ multipliers
+        # Members of a bucket are in random order, so the pairs sampled from a large bucket are random too.
+        order = np.lexsort((np.random.RandomState(band).permutation(len(band_hash)), band_hash))
+        sorted_hash = band_hash[order]
+        starts = np.flatnonzero(np.concatenate([[True], sorted_hash[1:] != sorted_hash[:-1]]))
+        sizes = np.diff(np.append(starts, len(order)))
+        if sizes.max(initial=0) < 2:
+            continue
+        oversized += int((sizes > max_bucket).sum())
+        position = np.arange(len(order))
+        bucket_end = np.repeat(starts + sizes, sizes)
+        partners = np.minimum(bucket_end - position - 1, max_bucket - 1)
+        first = np.repeat(position, partners)
+        step = np.arange(len(first)) - np.repeat(np.cumsum(partners) - partners, partners) + 1
+        left.append(order[first])
+        right.append(order[first + step])
+    if oversized:
+        logging.warning(f"{oversized} LSH buckets hold more than {max_bucket} keys; only a random sample of "
+                        f"their pairs is verified")
+    if not left:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def connected_components(n, left, right):
+    """Label each of n nodes with the smallest node id in its connected component."""
+    labels = np.arange(n)
+    while True:
+        linked = np.minimum(labels[left], labels[right])
+        previous = labels.copy()
+        np.minimum.at(labels, left, linked)
+        np.minimum.at(labels, right, linked)
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def near_duplicate_groups(keys, threshold=THRESHOLD):
+    """Return a group id per key so that keys in the same group are near duplicates.
+
+    Identical keys are blocked together first. MinHash/LSH then proposes
+    candidate pairs among the distinct keys, and only pairs whose Jaccard
+    similarity of character shingles reaches the threshold are merged, so all
+    n^2 pairs are never compared. Null keys each get a group of their own.
+    """
+    keys = pd.Series(keys)
+    present = keys.notna().to_numpy()
+    codes, uniques = pd.factorize(keys[present])
+    labels = np.arange(len(uniques))
+    if len(uniques) > 1:
+        sets = shingle_sets(list(uniques))
+        signatures = minhash_signatures(sets)
+        left, right = candidate_pairs(signatures)
+        pairs = np.unique(np.minimum(left, right) * len(uniques) + np.maximum(left, right))
+        left, right = pairs // len(uniques), pairs % len(uniques)
+
+        # Drop pairs whose estimated similarity is clearly too low, then confirm the rest exactly.
+        estimated = np.zeros(len(pairs), dtype=bool)
+        for start in range(0, len(pairs), BATCH_ROWS):
+            batch = slice(start, start + BATCH_ROWS)
+            estimated[batch] = (signatures[left[batch]] == signatures[right[batch]]).mean(axis=1) >= threshold - 0.1
+        left, right = left[estimated], right[estimated]
+        similar = jaccard(sets, left, right) >= threshold
+        logging.info(f"Fuzzy duplicate check verified {len(left)} of {len(pairs)} candidate pairs among "
+                     f"{len(uniques)} distinct keys, {int(similar.sum())} at or above threshold {threshold}")
+        labels = connected_components(len(uniques), left[similar], right[similar])
+
+    groups = np.arange(len(keys)) + len(uniques)
+    groups[present] = labels[codes]
+    return groups
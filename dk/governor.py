@@ -0,0 +1,178 @@
+import io
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+from records import sample_record_blocks
+from leases import lock_file, filesystem_now
+
+SIZE_RE = re.compile(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+WORKING_SET_FACTOR = 3  # the parsed frame plus the copies the checks make of it
+KEY_BYTES_PER_ROW = 24  # a key hash plus the copies made while merging it into the seen keys
+CHUNK_SHARE = 0.25  # share of the budget one chunk may use
+KEY_SHARE = 0.5  # share of the budget the in-memory seen keys of one file may use
+MIN_CHUNK_BYTES = 1024 * 1024
+DEFAULT_RATIO = 10.0  # memory bytes per file byte assumed when the sample cannot be parsed
+MAX_RATIO = 20.0  # files this small fit in memory whatever their ratio, so they are not sampled
+
+
+def parse_size(text):
+    """Parse a byte size such as '512M', '4G' or '1.5GiB' into a number of bytes."""
+    match = SIZE_RE.match(str(text))
+    if not match:
+        raise ValueError(f"invalid size {text!r}, expected a number with an optional K, M, G or T suffix")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+class MemoryGovernor:
+    """Chooses how each file is processed so that its working memory stays within a budget.
+
+    A file's footprint is estimated from its size and the memory per byte of
+    a sampled parse. Files that fit are processed as one in-memory frame,
+    larger files are streamed in chunks sized to a share of the budget, and
+    files with too many rows to keep their duplicate-check keys in memory
+    have those keys spilled to disk as well.
+
+    Every file holds a reservation of its expected memory while it runs.
+    Reservations are files in a directory shared by all workers on the host,
+    and a file waits until the reservations of the others leave room for it,
+    so large files are throttled instead of pushing the host into swap.
+    """
+
+    def __init__(self, budget, reservation_dir=None, sample_blocks=8, sample_block_bytes=256 * 1024, ttl=60):
+        self.budget = budget
+        self.reservation_dir = Path(reservation_dir or Path(tempfile.gettempdir()) / 'dqm-memory')
+        self.reservation_dir.mkdir(parents=True, exist_ok=True)
+        self.sample_blocks = sample_blocks
+        self.sample_block_bytes = sample_block_bytes
+        self.ttl = ttl  # seconds without a refresh after which a reservation belongs to a dead worker
+
+    def memory_ratio(self, path, engine, input_format=None):
+        """Return (memory bytes per file byte, rows per file byte) from a sampled parse of the file."""
+        if input_format is not None and not input_format.splittable:
+            # Records of other formats cannot be sampled at random offsets, so parse the start of the file.
+            with open(path, 'rb') as f:
+                data = f.read(self.sample_blocks * self.sample_block_bytes)
+            if len(data) == self.sample_blocks * self.sample_block_bytes:
+                data = data[:data.rfind(b'\n') + 1]
+            header, blocks = b'', [data]
+        else:
+            delimiter = input_format.delimiter if input_format is not None else ','
+            header, blocks = sample_record_blocks(path, self.sample_blocks, self.sample_block_bytes, 0, delimiter)
+        sample_bytes = sum(len(block) for block in blocks)
+        if not sample_bytes:
+            return DEFAULT_RATIO, 0.0
+        source = io.BytesIO(header + b''.join(blocks))
+        frame = input_format.read(engine, source) if input_format is not None else engine.read_csv(source)
+        return frame.memory_usage(deep=True).sum() / sample_bytes, len(frame) / sample_bytes
+
+    def plan(self, path, engine, workers=1, input_format=None):
+        """Choose the strategy for a file.
+
+        Returns a dict with the strategy ('memory', 'chunked' or 'spilled'),
+        the chunk size in bytes for the streaming strategies, the estimated
+        footprint and the number of bytes to reserve while it runs. With
+        several workers, that many chunks are in memory at once. A file that
+        cannot be split is always read whole; if it is over the budget it
+        reserves all of it, so it runs only once nothing else holds memory.
+        """
+        size = os.path.getsize(path)
+        if size * MAX_RATIO * WORKING_SET_FACTOR <= self.budget * CHUNK_SHARE:
+            footprint = int(size * MAX_RATIO * WORKING_SET_FACTOR)
+            return {'strategy': 'memory', 'chunk_size': None, 'footprint': footprint, 'reserve': footprint}
+        try:
+            ratio, rows_per_byte = self.memory_ratio(path, engine, input_format)
+        except Exception as e:
+            logging.warning(f"Could not sample {path} to estimate its memory use, assuming {DEFAULT_RATIO}x: {e}")
+            ratio, rows_per_byte = DEFAULT_RATIO, 0.0
+
+        footprint = int(size * ratio * WORKING_SET_FACTOR)
+        if footprint <= self.budget:
+            plan = {'strategy': 'memory', 'chunk_size': None, 'footprint': footprint, 'reserve': footprint}
+        elif input_format is not None and not input_format.splittable:
+            logging.warning(f"{Path(path).name} cannot be processed in chunks as {input_format}, so it is read "
+                            f"whole although its estimated {footprint / 2**20:.0f} MiB exceed the memory budget of "
+                            f"{self.budget / 2**20:.0f} MiB")
+            plan = {'strategy': 'memory', 'chunk_size': None, 'footprint': footprint, 'reserve': footprint}
+        else:
+            chunk_size = max(MIN_CHUNK_BYTES, int(self.budget * CHUNK_SHARE / (ratio * WORKING_SET_FACTOR * workers)))
+            chunk_memory = int(chunk_size * ratio * WORKING_SET_FACTOR) * workers
+            key_memory = int(size * rows_per_byte * KEY_BYTES_PER_ROW)
+            if key_memory <= self.budget * KEY_SHARE:
+                plan = {'strategy': 'chunked', 'chunk_size': chunk_size, 'footprint': footprint,
+                        'reserve': chunk_memory + key_memory}
+            else:
+                plan = {'strategy': 'spilled', 'chunk_size': chunk_size, 'footprint': footprint,
+                        'reserve': chunk_memory}
+        plan['reserve'] = min(plan['reserve'], self.budget)
+        logging.info(f"Memory plan for {Path(path).name}: {plan['strategy']} "
+                     f"(estimated {footprint / 2**20:.0f} MiB in memory, budget {self.budget / 2**20:.0f} MiB)")
+        return plan
+
+    @contextmanager
+    def reserve(self, nbytes, label=''):
+        """Hold a reservation of nbytes for the duration of the block, waiting until the budget has room."""
+        reservation = self.reservation_dir / f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}.json"
+        waited = False
+        while True:
+            with lock_file(self.reservation_dir / '.lock', self.ttl):
+                used = self.reserved_bytes()
+                # A file always runs when nothing else holds a reservation, so one large file cannot wait forever.
+                if used == 0 or used + nbytes <= self.budget:
+                    with open(reservation, 'w', encoding='utf-8') as f:
+                        json.dump({'bytes': nbytes, 'file': label}, f)
+                    break
+            if not waited:
+                logging.info(f"Waiting for {nbytes / 2**20:.0f} MiB of the memory budget to process {label} "
+                             f"({used / 2**20:.0f} MiB reserved by other files)")
+                waited = True
+            time.sleep(1)
+
+        stop = threading.Event()
+
+        def refresh():
+            while not stop.wait(self.ttl / 3):
+                try:
+                    os.utime(reservation)
+                except OSError as e:
+                    logging.error(f"Could not refresh memory reservation {reservation}: {e}")
+        refresher = threading.Thread(target=refresh, name='memory-reservation', daemon=True)
+        refresher.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            refresher.join()
+            try:
+                reservation.unlink()
+            except FileNotFoundError:
+                pass
+
+    def reserved_bytes(self):
+        """Total bytes held by live reservations, removing those of workers that stopped refreshing them."""
+        total = 0
+        # Reservations may be shared over NFS, so their age is judged by the filesystem's clock.
+        now = filesystem_now(self.reservation_dir)
+        for path in self.reservation_dir.glob('*.json'):
+            try:
+                if now - path.stat().st_mtime > self.ttl:
+                    logging.warning(f"Removing stale memory reservation {path.name}")
+                    path.unlink()
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    total += json.load(f)['bytes']
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable memory reservation {path}: {e}")
+        return total
@@ -0,0 +1,15 @@
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    """Import a module on first attribute access, so runs with nothing to process skip its import cost."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
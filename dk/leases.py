@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+
+def filesystem_now(directory):
+    """Current time as seen by the filesystem holding directory, from the mtime of a file created there."""
+    clock = Path(directory) / f".clock.{uuid.uuid4().hex}"
+    clock.touch()
+    try:
+        return clock.stat().st_mtime
+    finally:
+        clock.unlink()
+
+
+class LeaseManager:
+    """File-based claim/lease protocol for sharing a source directory between workers.
+
+    A worker claims a file by hard-linking a lease file into the lease
+    directory, which fails atomically if another worker already holds it.
+    Held leases are kept alive by touching them from a heartbeat thread; a
+    lease whose mtime is older than the ttl belongs to a dead worker and can
+    be taken over. Finished files get a done marker so no worker claims them
+    again. Only the filesystem is used, so it works over NFS without an
+    external coordinator. Times are taken from file mtimes written in the
+    lease directory, so workers on hosts with skewed clocks agree on expiry.
+    """
+
+    def __init__(self, lease_dir, worker_id=None, ttl=300, suffix='.lease'):
+        self.lease_dir = Path(lease_dir)
+        self.lease_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = ttl
+        self.suffix = suffix  # appended to a file's name to get its lease
+        self.held = {}  # file -> lease token
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def lease_path(self, file):
+        return self.lease_dir / f"{file}{self.suffix}"
+
+    def done_path(self, file):
+        return self.lease_dir / f"{file}.done"
+
+    def now(self):
+        """Current time as seen by the filesystem holding the leases."""
+        return filesystem_now(self.lease_dir)
+
+    def is_done(self, file):
+        """Check if any worker has already finished the file."""
+        return self.done_path(file).exists()
+
+    def claim(self, file):
+        """Try to claim the file. Returns True if this worker now holds its lease."""
+        if self.is_done(file):
+            return False
+        if not self.acquire(file):
+            return False
+        # A file finished between the done check and the link must not be processed again.
+        if self.is_done(file):
+            self.release(file)
+            return False
+        logging.info(f"Worker {self.worker_id} claimed {file}")
+        return True
+
+    def acquire(self, file):
+        """Try to take the lease on file, breaking it if stale. Returns True if this worker now holds it."""
+        lease_path = self.lease_path(file)
+        token = uuid.uuid4().hex
+        tmp_path = self.lease_dir / f".{file}.{token}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'worker': self.worker_id, 'token': token}, f)
+        try:
+            for attempt in range(2):
+                try:
+                    os.link(tmp_path, lease_path)
+                except FileExistsError:
+                    if attempt == 0 and self.break_stale_lease(file):
+                        continue
+                    return False
+                with self.lock:
+                    self.held[file] = token
+                return True
+            return False
+        finally:
+            tmp_path.unlink()
+
+    def break_stale_lease(self, file):
+        """Remove the lease on file if its holder stopped heartbeating. Returns True if it was removed."""
+        lease_path = self.lease_path(file)
+        token = self.lease_token(lease_path)
+        try:
+            age = self.now() - lease_path.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        if age <= self.ttl:
+            return False
+        # Renaming is atomic, so only one worker wins the stale lease.
+        stale_path = self.lease_dir / f".{file}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+        if self.lease_token(stale_path) != token:
+            # Another worker broke the stale lease and claimed the file since we looked; its lease goes back.
+            try:
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                logging.error(f"Lease on {file} changed hands twice while it was being broken")
+            stale_path.unlink()
+            return False
+        try:
+            with open(stale_path, 'r', encoding='utf-8') as f:
+                holder = json.load(f).get('worker')
+        except Exception:
+            holder = 'unknown'
+        stale_path.unlink()
+        logging.warning(f"Recovered stale lease on {file} from worker {holder} ({age:.0f}s old)")
+        return True
+
+    @staticmethod
+    def lease_token(path):
+        """The claim token written in a lease file, or None if it is missing or unreadable."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('token')
+        except Exception:
+            return None
+
+    def holds(self, file):
+        """Check if this worker still holds the lease on file."""
+        token = self.held.get(file)
+        return token is not None and self.lease_token(self.lease_path(file)) == token
+
+    def complete(self, file):
+        """Mark the file as done and release its lease."""
+        if self.holds(file):
+            self.done_path(file).touch()
+        self.release(file)
+
+    def release(self, file):
+        """Release the lease on file without marking it done.
+
+        Only the lease with this worker's claim token is removed. It is first
+        renamed to a private name and checked again there, so a lease that was
+        broken and claimed by another worker, or by a restarted worker with the
+        same id, in the meantime is put back instead of deleted.
+        """
+        with self.lock:
+            token = self.held.pop(file, None)
+        lease_path = self.lease_path(file)
+        if token is None or self.lease_token(lease_path) != token:
+            return
+        released_path = self.lease_dir / f".{file}.{token}.released"
+        try:
+            os.rename(lease_path, released_path)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"Error releasing lease on {file}: {e}")
+            return
+        if self.lease_token(released_path) != token:
+            try:
+                os.link(released_path, lease_path)
+            except FileExistsError:
+                logging.error(f"Lease on {file} changed hands twice while it was released")
+        released_path.unlink()
+
+    def refresh(self, file, token):
+        """Refresh the mtime of the lease on file if it still has token. Returns False if the lease was lost.
+
+        The token is read and the mtime set through the same open file, so a
+        lease that replaced ours in the meantime is never kept alive by us.
+        """
+        try:
+            with open(self.lease_path(file), 'r', encoding='utf-8') as f:
+                if json.load(f).get('token') != token:
+                    return False
+                os.utime(f.fileno())
+                return True
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self):
+        """Refresh the mtime of every lease this worker holds."""
+        with self.lock:
+            held = list(self.held.items())
+        for file, token in held:
+            if not self.refresh(file, token):
+                logging.error(f"Worker {self.worker_id} lost its lease on {file}")
+                with self.lock:
+                    if self.held.get(file) == token:
+                        del self.held[file]
+
+    def start(self):
+        """Start the background heartbeat thread."""
+        def run():
+            while not self.stop_event.wait(self.ttl / 3):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    logging.error(f"Lease heartbeat failed: {e}")
+        self.heartbeat_thread = threading.Thread(target=run, name='lease-heartbeat', daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop(self):
+        """Stop heartbeating and release all leases still held."""
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+        for file in list(self.held):
+            self.release(file)
+
+
+@contextmanager
+def lock_file(lock, stale_after=60):
+    """Hold a lock file for the duration of the block.
+
+    The lock is a lease on its own path (see LeaseManager): it is taken by
+    hard-linking, refreshed by a heartbeat thread while held, and only
+    broken, by an atomic rename, once its holder stopped refreshing it for
+    stale_after seconds by the clock of the filesystem holding it.
+    """
+    lock = Path(lock)
+    locks = LeaseManager(lock.parent, ttl=stale_after, suffix='')
+    while not locks.acquire(lock.name):
+        time.sleep(0.05)
+    locks.start()
+    try:
+        yield
+    finally:
+        locks.stop()
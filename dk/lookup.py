@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+from lazy import lazy_import
+from checkpoint import write_keys
+from parsecache import content_hash
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Rows of the reference file read at a time while the index is built
+REFERENCE_CHUNK_ROWS = 1_000_000
+# <attribute>=<reference csv>[<reference column>], the column defaulting to the attribute's name
+LOOKUP_SPEC_RE = re.compile(r'\s*([^=]+?)\s*=\s*(.+?)\s*(?:\[([^\]]+)\])?\s*$')
+
+
+def parse_lookup_spec(spec, base_dir='.'):
+    """Return (attribute, reference path, reference column) of a lookup_check attribute from the config.
+
+    Relative reference paths are taken from base_dir, the directory of the config file.
+    """
+    match = LOOKUP_SPEC_RE.match(spec)
+    if not match:
+        raise ValueError(f"lookup_check attribute {spec!r} is not <attribute>=<reference csv>[<column>]")
+    attribute, reference, column = match.groups()
+    return attribute, Path(base_dir) / reference, column or attribute
+
+
+def lookup_values(column):
+    """Return the mask of non-null values of column and those values as stripped text.
+
+    Looked-up attributes are read from the input as text, see
+    FileProcessor.input_format, so their values are compared as written.
+    Only numbers from JSON Lines inputs reach here as floats, and whole ones
+    are written without their '.0', as a JSON id with missing values is
+    parsed as float.
+    """
+    present = column.notna()
+    values = column[present]
+    if values.dtype.kind == 'f' and (values % 1 == 0).all():
+        values = values.astype('int64')
+    return present.to_numpy(), values.astype(str).str.strip()
+
+
+def value_hashes(values):
+    """Return the uint64 hash of every value of a Series of text."""
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+class ReferenceIndex:
+    """The distinct values of one column of a reference CSV, as a sorted array of 64-bit hashes.
+
+    The array is stored as a .npy file keyed by the reference path and
+    column and memory-mapped when loaded, so large reference tables cost no
+    parse and little memory after the first run. It is rebuilt only when the
+    contents of the reference file change. Membership is tested for a whole
+    column at once with searchsorted; two distinct values sharing a hash is
+    possible but vanishingly rare at 64 bits.
+    """
+
+    def __init__(self, reference_path, column, index_dir):
+        self.reference_path = Path(reference_path)
+        self.column = column
+        key = hashlib.sha1(f"{self.reference_path.resolve()}|{column}".encode('utf-8')).hexdigest()[:16]
+        self.index_file = Path(index_dir) / f"{key}.npy"
+        self.state_file = Path(index_dir) / f"{key}.json"
+        self.signature = None  # (size, mtime_ns) of the reference file the loaded index belongs to
+        self.digest = None  # sha1 of the reference file the loaded index belongs to
+        self.hashes = None
+
+    def current(self):
+        """Return the index, rebuilding it first if the reference file changed."""
+        stat = self.reference_path.stat()
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if self.hashes is not None and signature == self.signature:
+            return self.hashes
+
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = None
+        if state is not None and state['signature'] != signature:
+            # Touched but possibly unchanged references are recognised by their contents.
+            if state['sha1'] == content_hash(self.reference_path):
+                state['signature'] = signature
+                self.save_state(state)
+            else:
+                state = None
+        if state is None or not self.index_file.exists():
+            state = self.build(signature)
+
+        self.hashes = np.load(self.index_file, mmap_mode='r')
+        self.signature, self.digest = signature, state['sha1']
+        return self.hashes
+
+    def build(self, signature):
+        """Read the reference column in chunks and store its sorted distinct hashes."""
+        started_digest = content_hash(self.reference_path)
+        parts = []
+        reader = pd.read_csv(self.reference_path, usecols=[self.column], dtype=str, keep_default_na=False,
+                             encoding='utf-8', chunksize=REFERENCE_CHUNK_ROWS)
+        for chunk in reader:
+            values = chunk[self.column].str.strip()
+            parts.append(np.unique(value_hashes(values[values != ''])))
+        hashes = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        write_keys(self.index_file, hashes)
+        state = {'signature': signature, 'sha1': started_digest, 'values': int(len(hashes))}
+        self.save_state(state)
+        logging.info(f"Indexed {len(hashes)} distinct values of {self.column} in {self.reference_path}")
+        return state
+
+    def save_state(self, state):
+        tmp_file = self.state_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def contains(self, values):
+        """Return a boolean array telling which of the values (a Series of text) are in the reference."""
+        hashes = self.current()
+        probes = value_hashes(values)
+        if not len(hashes):
+            return np.zeros(len(probes), dtype=bool)
+        positions = np.minimum(np.searchsorted(hashes, probes), len(hashes) - 1)
+        return hashes[positions] == probes
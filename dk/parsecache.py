@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Imported by ParseCache, so runs without a parse cache never load pyarrow.
+pa = None
+
+HASH_BLOCK = 1024 * 1024
+
+
+def content_hash(path):
+    """Return the sha1 of a file's contents, read in blocks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """Parsed input files kept as Arrow IPC sidecars, so a file read again is not parsed again.
+
+    A sidecar is keyed by the sha1 of the file's bytes, the reader options
+    of its format and the engine, so it is never used for changed bytes or a
+    different way of reading. Files processed in chunks have a sidecar per
+    chunk, keyed by its byte range as well. The sha1 of a path is remembered with its size
+    and mtime and only recomputed when they change. Sidecars are memory
+    mapped on load, but converting them to pandas copies every column, so a
+    hit saves the parse, not the memory of the frame. The cache is bounded
+    by max_bytes; every hit touches the sidecar's mtime and the least
+    recently used sidecars are evicted first.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        global pa
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("the parse cache requires pyarrow (pip install pyarrow)")
+        pa = pyarrow
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.fingerprints_file = self.cache_dir / 'fingerprints.json'
+        try:
+            with open(self.fingerprints_file, 'r', encoding='utf-8') as f:
+                self.fingerprints = json.load(f)  # path -> [size, mtime_ns, sha1]
+        except (FileNotFoundError, ValueError):
+            self.fingerprints = {}
+
+    def fingerprint(self, path):
+        """Return the sha1 of the file's contents, hashing it only if its size or mtime changed."""
+        stat = os.stat(path)
+        key = str(Path(path).resolve())
+        cached = self.fingerprints.get(key)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = content_hash(path)
+        self.fingerprints[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        tmp_file = self.fingerprints_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.fingerprints, f)
+        os.replace(tmp_file, self.fingerprints_file)
+        return digest
+
+    def sidecar_path(self, path, input_format, engine, byte_range=None):
+        options = json.dumps([engine.name, vars(input_format), byte_range], sort_keys=True)
+        key = hashlib.sha1(f"{self.fingerprint(path)}|{options}".encode('utf-8')).hexdigest()
+        return self.cache_dir / f"{key}.arrow"
+
+    def read(self, path, input_format, engine, byte_range=None, source=None):
+        """Return the parsed file from its sidecar, or parse it with the engine and store the sidecar.
+
+        For a chunk, byte_range is its (start, end) in the file and source
+        the buffer of the header and its records that is parsed on a miss.
+        """
+        sidecar = self.sidecar_path(path, input_format, engine, byte_range)
+        name = Path(path).name if byte_range is None else f"{Path(path).name} bytes {byte_range[0]}-{byte_range[1]}"
+        if sidecar.exists():
+            try:
+                frame = self.load(sidecar, engine)
+                os.utime(sidecar)
+                logging.info(f"Loaded {name} from the parse cache")
+                return frame
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable parse cache sidecar {sidecar}: {e}")
+
+        frame = input_format.read(engine, path if source is None else source)
+        try:
+            self.store(sidecar, frame)
+        except Exception as e:
+            logging.debug(f"not caching the parse of {path} because {e}")
+        return frame
+
+    def load(self, sidecar, engine):
+        with pa.memory_map(str(sidecar), 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        frame = table.to_pandas(types_mapper=getattr(engine, 'types_mapper', None))
+        # Arrow hands back missing text as None where the CSV reader gives NaN.
+        for column in frame.columns[frame.dtypes == object]:
+            missing = frame[column].isna()
+            if missing.any():
+                frame[column] = frame[column].where(~missing, np.nan)
+        return frame
+
+    def store(self, sidecar, frame):
+        """Write a parsed frame as a sidecar, then evict sidecars until the cache fits max_bytes."""
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if table.nbytes > self.max_bytes:
+            return
+        tmp_path = sidecar.with_suffix(f".{os.getpid()}.tmp")
+        with pa.OSFile(str(tmp_path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, sidecar)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used sidecars while the cache is larger than max_bytes."""
+        sidecars = []
+        for path in self.cache_dir.glob('*.arrow'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            sidecars.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in sidecars)
+        for _, size, path in sorted(sidecars):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                logging.info(f"Evicted {path.name} from the parse cache")
+            except FileNotFoundError:
+                pass
+            total -= size
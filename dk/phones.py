@@ -0,0 +1,202 @@
+import re
+import itertools
+from functools import lru_cache
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Country calling code -> (trunk prefix, lengths of the national significant number).
+# Calling codes are prefix-free, so a number written with one matches at most one entry.
+COUNTRY_CODES = {
+    '1': ('', (10,)),
+    '7': ('8', (10,)),
+    '33': ('0', (9,)),
+    '44': ('0', (9, 10)),
+    '49': ('0', (10, 11)),
+    '61': ('0', (9,)),
+    '65': ('', (8,)),
+    '81': ('0', (9, 10)),
+    '86': ('0', (10, 11)),
+    '91': ('0', (10,)),
+    '92': ('0', (9, 10)),
+    '94': ('0', (9,)),
+    '880': ('0', (10,)),
+    '966': ('0', (9,)),
+    '971': ('0', (8, 9)),
+    '977': ('0', (8, 10)),
+}
+# Region -> (calling code, lengths of its area codes) for numbers written in national format
+REGIONS = {
+    'IN': ('91', (2, 3, 4)),
+    'GB': ('44', (2, 3, 4)),
+    'US': ('1', (3,)),
+    'AU': ('61', (1,)),
+    'SG': ('65', ()),
+    'AE': ('971', (1, 2)),
+    'PK': ('92', (2, 3)),
+    'BD': ('880', (1, 2)),
+}
+INTERNATIONAL_PREFIXES = r'(?:\+|(?<!\d)00)'
+# Formatting characters removed before matching; dots too, as the legacy phone check does
+FORMATTING_RE = r'[.()\[\]\-]'
+# Characters that always separate two numbers
+SEPARATOR_RE = r'[\r\n,;/|]+'
+MISSING = 'None'
+
+
+def digits(count):
+    """Pattern for count digits, with single spaces allowed between them."""
+    return rf"(?:\d ?){{{count - 1}}}\d" if count > 1 else r"\d"
+
+
+@lru_cache(maxsize=None)
+def prefix_pattern(region):
+    """Compile the pattern matching every number of the prefix table, for numbers written in region.
+
+    Alternatives are tried in order: international numbers by calling code,
+    national numbers of the region with their trunk prefix and area code
+    (followed by an optional second subscriber number that shares the area
+    code, as in '080 42297555 41714161'), and bare national significant
+    numbers of the region. Each alternative has its own named groups, so
+    the kind of every match is known from which group is set.
+    """
+    if region not in REGIONS:
+        raise ValueError(f"unknown phone region {region}, expected one of {sorted(REGIONS)}")
+    region_code, area_lengths = REGIONS[region]
+    trunk, lengths = COUNTRY_CODES[region_code]
+    international = []
+    for code, (code_trunk, code_lengths) in sorted(COUNTRY_CODES.items(), key=lambda item: -len(item[0])):
+        optional_trunk = f"(?:{code_trunk} ?)?" if code_trunk else ''
+        numbers = '|'.join(digits(length) for length in sorted(code_lengths, reverse=True))
+        international.append(rf"{code} ?{optional_trunk}(?P<i{code}>{numbers})(?!\d)")
+    alternatives = [rf"{INTERNATIONAL_PREFIXES} ?(?:{'|'.join(international)})"]
+    for length in sorted(lengths, reverse=True):
+        national = [rf"(?P<a{length}_{area}>\d{{{area}}}) ?(?P<s{length}_{area}>{digits(length - area)})(?!\d)"
+                    rf"(?: (?P<m{length}_{area}>\d{{{length - area}}})(?!\d))?"
+                    for area in area_lengths if area < length]
+        if trunk and national:
+            alternatives.append(rf"(?<![\d+]){trunk} ?(?:{'|'.join(national)})")
+        alternatives.append(rf"(?<![\d+])(?P<b{length}>{digits(length)})(?!\d)")
+    return re.compile('|'.join(alternatives))
+
+
+def normalize_phone_numbers(column, region='IN'):
+    """Return the first and second phone number of every value of column in E.164 format ('+<code><number>').
+
+    Formatting characters are removed for the whole column at once, and the
+    compiled prefix pattern is only run on the distinct values, so repeated
+    numbers cost nothing. Values with fewer numbers get 'None' for the
+    missing ones, as in the legacy phone check.
+    """
+    pattern = prefix_pattern(region)
+    region_code = REGIONS[region][0]
+    first = np.full(len(column), MISSING, dtype=object)
+    second = np.full(len(column), MISSING, dtype=object)
+    present = np.flatnonzero(column.notna().to_numpy())
+    values = pd.Series(column.to_numpy()[present], dtype=object).astype(str)
+    values = (values.str.replace(FORMATTING_RE, '', regex=True)
+                    .str.replace(SEPARATOR_RE, ' | ', regex=True)
+                    .str.replace(r'\s+', ' ', regex=True))
+    codes, uniques = pd.factorize(values)
+    matches = pd.Series(uniques, dtype=object).str.findall(pattern)
+    counts = matches.str.len().to_numpy() if len(matches) else np.zeros(0, dtype=np.int64)
+    if not counts.sum():
+        return pd.Series(first, index=column.index), pd.Series(second, index=column.index)
+
+    # One row per match, one column per group of the pattern; unmatched groups are ''.
+    groups = np.array(list(itertools.chain.from_iterable(matches.to_numpy())), dtype=object)
+    owners = np.repeat(np.arange(len(uniques)), counts)
+    order = (np.arange(len(groups)) - np.repeat(np.cumsum(counts) - counts, counts)) * 2
+    numbers = np.full(len(groups), None, dtype=object)
+    shared_area = np.full(len(groups), None, dtype=object)
+    for name, index in pattern.groupindex.items():
+        kind, key = name[0], name[1:]
+        found = groups[:, index - 1] != ''
+        if kind not in 'ibs' or not found.any():
+            continue
+        text = pd.Series(groups[found, index - 1]).str.replace(' ', '', regex=False)
+        if kind == 'i':
+            numbers[found] = ('+' + key + text).to_numpy()
+        elif kind == 'b':
+            numbers[found] = ('+' + region_code + text).to_numpy()
+        else:
+            area = pd.Series(groups[found, pattern.groupindex['a' + key] - 1])
+            numbers[found] = ('+' + region_code + area + text).to_numpy()
+            more = groups[:, pattern.groupindex['m' + key] - 1]
+            shared = found & (more != '')
+            shared_area[shared] = ('+' + region_code + pd.Series(groups[shared, pattern.groupindex['a' + key] - 1])
+                                   + pd.Series(more[shared])).to_numpy()
+
+    # Every match gives a number, and a shared-area match a second one right after it.
+    owners = np.concatenate([owners, owners])
+    order = np.concatenate([order, order + 1])
+    numbers = np.concatenate([numbers, shared_area])
+    kept = np.flatnonzero(pd.notna(numbers))
+    kept = kept[np.lexsort((order[kept], owners[kept]))]
+    starts = np.flatnonzero(np.r_[True, owners[kept][1:] != owners[kept][:-1]])
+    rank = np.arange(len(kept)) - np.repeat(starts, np.diff(np.r_[starts, len(kept)]))
+    by_value = []
+    for wanted in (0, 1):
+        picked = kept[rank == wanted]
+        numbers_of_values = np.full(len(uniques), MISSING, dtype=object)
+        numbers_of_values[owners[picked]] = numbers[picked]
+        by_value.append(numbers_of_values)
+    first[present] = by_value[0][codes]
+    second[present] = by_value[1][codes]
+    return pd.Series(first, index=column.index), pd.Series(second, index=column.index)
+
+
+def legacy_phone_numbers(column):
+    """Return contact number 1 and 2 of every value of column by the rules of FileProcessor.clean_phonenumber.
+
+    Values are split on spaces once dots are removed. A token of 10
+    characters is a mobile number, and one of 8 characters after a token of
+    3, or after a token of 3 and one of 8, is a landline number with that
+    area code. One mobile and one landline, two mobiles or two landlines
+    give both numbers, a single number gives it and 'None', and anything
+    else 'None' twice. Unlike clean_phonenumber, the whole column is split
+    at once and nothing is printed, so estimates can run it on large samples.
+    """
+    # Text as str() writes it, 'None' and 'nan' for nulls, as clean_phonenumber splits it
+    codes, uniques = pd.factorize(column.to_numpy(dtype=object).astype(str))
+    tokens = (pd.Series(uniques, dtype=object).str.strip().str.replace('.', '', regex=False)
+              .str.replace(r'\r\n', ' ', regex=False).str.split(' ').explode())
+    owners = tokens.index.to_numpy()
+    tokens = tokens.fillna('').reset_index(drop=True)
+    before = [tokens.groupby(owners).shift(step).fillna('') for step in (1, 2)]
+    length, length_before = tokens.str.len(), [previous.str.len() for previous in before]
+
+    mobile = (length == 10).to_numpy()
+    after_area = ((length == 8) & (length_before[0] == 3)).to_numpy()
+    after_number = ((length == 8) & (length_before[1] == 3) & (length_before[0] == 8)).to_numpy()
+    positions = np.arange(len(tokens))
+    # Landlines in the order clean_phonenumber appends them: by token, the one after the area code first.
+    landline_owners = np.concatenate([owners[after_area], owners[after_number]])
+    landline_order = np.concatenate([2 * positions[after_area], 2 * positions[after_number] + 1])
+    landline_numbers = np.concatenate([(before[0] + tokens).to_numpy()[after_area],
+                                       (before[1] + tokens).to_numpy()[after_number]])
+    landline_sort = np.argsort(landline_order, kind='stable')
+
+    def nth_numbers(number_owners, numbers):
+        """The first and second number of every distinct value, and how many it has."""
+        starts = np.searchsorted(number_owners, np.arange(len(uniques)))
+        count = np.bincount(number_owners, minlength=len(uniques))
+        picked = []
+        for n in (0, 1):
+            found = np.full(len(uniques), MISSING, dtype=object)
+            has = count > n
+            found[has] = numbers[starts[has] + n]
+            picked.append(found)
+        return picked, count
+
+    (mobile_1, mobile_2), mobiles = nth_numbers(owners[mobile], tokens.to_numpy()[mobile])
+    (landline_1, landline_2), landlines = nth_numbers(landline_owners[landline_sort].astype(np.int64),
+                                                      landline_numbers[landline_sort])
+    conditions = [(mobiles == 1) & (landlines == 1), (mobiles == 2) & (landlines == 0),
+                  (mobiles == 0) & (landlines == 2), (mobiles == 1) & (landlines == 0),
+                  (mobiles == 0) & (landlines == 1)]
+    first = np.select(conditions, [mobile_1, mobile_1, landline_1, mobile_1, landline_1], MISSING)
+    second = np.select(conditions, [landline_1, mobile_2, landline_2, MISSING, MISSING], MISSING)
+    return pd.Series(first[codes], index=column.index), pd.Series(second[codes], index=column.index)
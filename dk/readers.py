@@ -0,0 +1,156 @@
+import io
+import re
+import csv
+from pathlib import Path
+
+SAMPLE_BYTES = 64 * 1024
+DELIMITERS = [',', '\t', '|', ';']
+
+# Suffixes of the input files picked up from the source directory, with the format they suggest. Suffixes
+# such as .txt or .dat say nothing about the format, so files with them are only picked up for families that
+# list them in 'input_suffix' config rows, and their format is sniffed from their contents.
+SUFFIX_FORMATS = {
+    '.csv': 'delimited',
+    '.tsv': 'delimited',
+    '.tab': 'delimited',
+    '.psv': 'delimited',
+    '.pipe': 'delimited',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+SUFFIX_DELIMITERS = {'.tsv': '\t', '.tab': '\t', '.psv': '|', '.pipe': '|'}
+QUOTED_FIELD_RE = re.compile(r"(?:^|[,\t|;])'[^'\n]*'(?:[,\t|;]|$)", re.MULTILINE)
+BOMS = [
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+]
+
+
+def file_family(file):
+    """The family of an input file named <family>YYYYMMDDHHMMSS.<suffix>, which the config is keyed by."""
+    return Path(file).stem[0:-14]
+
+
+def file_timestamp_text(file):
+    """The YYYYMMDDHHMMSS suffix of an input file name."""
+    return Path(file).stem[-14:]
+
+
+def output_name(file, suffix):
+    """Name of an output of an input file, such as <name>.out.csv for suffix '.out.csv'."""
+    return Path(file).stem + suffix
+
+
+def is_input_file(file, extra_suffixes=()):
+    """Check if the file has the suffix of a supported input format, or one of extra_suffixes."""
+    suffix = Path(file).suffix.lower()
+    return suffix in SUFFIX_FORMATS or suffix in extra_suffixes
+
+
+class InputFormat:
+    """How an input file is parsed: its kind, encoding and dialect.
+
+    kind is 'delimited' (CSV, TSV, pipe and other separated values),
+    'jsonl' (one JSON object per line) or 'fixed_width'. Only delimited
+    files can be split at record boundaries by quote parity, so only they
+    can be processed in chunks, in parallel or tailed. Delimited files are
+    read with every column as text; of the other kinds, only the columns
+    listed in text_columns are, so codes such as '007' keep their leading
+    zeros.
+    """
+
+    def __init__(self, kind, encoding='utf-8', delimiter=',', quotechar='"', colspecs=None, text_columns=()):
+        self.kind = kind
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.colspecs = colspecs  # [(start, end), ...] character ranges of the fixed-width columns
+        self.text_columns = sorted(text_columns)
+
+    @property
+    def splittable(self):
+        return self.kind == 'delimited' and self.quotechar == '"' and self.encoding in ('utf-8', 'utf-8-sig')
+
+    def read(self, engine, source):
+        """Parse a file path or byte buffer into a DataFrame with the fastest reader the engine has for it."""
+        if self.kind == 'jsonl':
+            return engine.read_jsonl(source, self.text_columns)
+        if self.kind == 'fixed_width':
+            return engine.read_fixed_width(source, self.colspecs, self.encoding, self.text_columns)
+        return engine.read_csv(source, delimiter=self.delimiter, quotechar=self.quotechar, encoding=self.encoding)
+
+    def __repr__(self):
+        if self.kind == 'delimited':
+            return (f"InputFormat(delimited, delimiter={self.delimiter!r}, quotechar={self.quotechar!r}, "
+                    f"encoding={self.encoding})")
+        return f"InputFormat({self.kind}, encoding={self.encoding})"
+
+
+def sniff(path):
+    """Detect the format of an input file from its suffix, its first bytes and a sample of its records.
+
+    Files with the suffix of a delimited format are always read as delimited;
+    only files with other suffixes are taken for JSON Lines when they start
+    with '{' or for fixed-width when no delimiter fits.
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_BYTES)
+    suffix = Path(path).suffix.lower()
+
+    encoding = 'utf-8'
+    for bom, bom_encoding in BOMS:
+        if sample.startswith(bom):
+            encoding = bom_encoding
+            break
+    text = sample.decode(encoding, errors='replace')
+    known_format = SUFFIX_FORMATS.get(suffix)
+
+    if known_format == 'jsonl' or (known_format is None and text.lstrip().startswith('{')):
+        return InputFormat('jsonl', encoding)
+
+    if len(sample) == SAMPLE_BYTES and '\n' in text:
+        # The last record of the sample may be cut off.
+        text = text[:text.rindex('\n') + 1]
+    quotechar = "'" if '"' not in text and QUOTED_FIELD_RE.search(text) else '"'
+    delimiter = SUFFIX_DELIMITERS.get(suffix) or sniff_delimiter(text, quotechar)
+    if delimiter is None and known_format is None:
+        colspecs = sniff_colspecs([line for line in text.splitlines() if line.strip()][:50])
+        if colspecs is not None and len(colspecs) > 1:
+            return InputFormat('fixed_width', encoding, colspecs=colspecs)
+    return InputFormat('delimited', encoding, delimiter or ',', quotechar)
+
+
+def sniff_delimiter(text, quotechar='"'):
+    """Return the candidate delimiter that splits the sampled records into the header's number of fields, or None.
+
+    Records are parsed with the csv module, so quoted fields holding the
+    delimiter or line breaks do not throw the count off. The delimiter giving
+    the most fields to at least 90% of the records wins.
+    """
+    best, best_fields = None, 1
+    for delimiter in DELIMITERS:
+        rows = [row for row in csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar) if row]
+        if not rows:
+            continue
+        fields = len(rows[0])
+        matching = sum(len(row) == fields for row in rows)
+        if fields > best_fields and matching >= 0.9 * len(rows):
+            best, best_fields = delimiter, fields
+    return best
+
+
+def sniff_colspecs(lines):
+    """Return the column ranges of fixed-width lines, split where every line has a space, or None."""
+    width = max((len(line) for line in lines), default=0)
+    if not width or len(lines) < 2:
+        return None
+    blank = [all(i >= len(line) or line[i] == ' ' for line in lines) for i in range(width)]
+    colspecs, start = [], None
+    for i, is_blank in enumerate(blank + [True]):
+        if not is_blank and start is None:
+            start = i
+        elif is_blank and start is not None:
+            colspecs.append((start, i))
+            start = None
+    return colspecs or None
@@ -0,0 +1,152 @@
+import io
+import os
+import csv
+import random
+import logging
+
+
+QUOTE = b'"'
+NEWLINE = b'\n'
+
+
+def find_record_end(buf, quote=QUOTE):
+    """Return the offset just past the last complete record in buf, or -1.
+
+    buf must start on a record boundary so that quote parity can be tracked
+    from its first byte; a newline only ends a record when it is not inside
+    a quoted field.
+    """
+    quotes = buf.count(quote)
+    end = len(buf)
+    while True:
+        pos = buf.rfind(NEWLINE, 0, end)
+        if pos == -1:
+            return -1
+        quotes -= buf.count(quote, pos, end)
+        if quotes % 2 == 0:
+            return pos + 1
+        end = pos
+
+
+def read_header(path):
+    """Return the header record of a CSV file and the offset of the first data record."""
+    with open(path, 'rb') as f:
+        buf = b''
+        while True:
+            block = f.read(64 * 1024)
+            buf += block
+            # The header is the first record, so scan forward for its end.
+            quotes = 0
+            start = 0
+            while True:
+                pos = buf.find(NEWLINE, start)
+                if pos == -1:
+                    break
+                quotes += buf.count(QUOTE, start, pos)
+                if quotes % 2 == 0:
+                    return buf[:pos + 1], pos + 1
+                start = pos + 1
+            if not block:
+                return buf, len(buf)
+
+
+def iter_record_chunks(path, start, chunk_bytes, complete_only=False):
+    """Yield (start, end, data) for record-aligned byte chunks of path beginning at start.
+
+    With complete_only, a last record without a trailing newline is left
+    unread, since a file that is still being appended to may not have
+    finished writing it.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pending = b''
+        offset = start
+        while offset < size:
+            block = f.read(chunk_bytes)
+            data = pending + block
+            if not block:
+                # Last record without a trailing newline.
+                if not complete_only:
+                    yield offset, offset + len(data), data
+                return
+            cut = find_record_end(data)
+            if cut == -1:
+                # A single record is longer than the chunk; keep reading.
+                logging.debug(f"record at offset {offset} exceeds chunk size {chunk_bytes}")
+                pending = data
+                continue
+            yield offset, offset + cut, data[:cut]
+            offset += cut
+            pending = data[cut:]
+
+
+def record_ranges(path, start, chunk_bytes):
+    """Yield (start, end) of the record-aligned chunks of path, without keeping their data."""
+    for chunk_start, chunk_end, _ in iter_record_chunks(path, start, chunk_bytes):
+        yield chunk_start, chunk_end
+
+
+def read_range(path, start, end):
+    """Return the bytes of path between start and end."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def align_to_record(buf, columns, candidates=64, delimiter=','):
+    """Return the offset of the first record start in buf, or -1 if none can be found.
+
+    buf starts at an arbitrary byte offset, so quote parity is unknown. Each
+    newline is tried in turn and accepted when the records that follow it
+    parse to the header's number of columns.
+    """
+    pos = -1
+    for _ in range(candidates):
+        pos = buf.find(NEWLINE, pos + 1)
+        if pos == -1:
+            return -1
+        window = buf[pos + 1:pos + 1 + 64 * 1024]
+        end = find_record_end(window)
+        if end <= 0:
+            continue
+        text = window[:end].decode('utf-8', errors='replace')
+        rows = [row for _, row in zip(range(2), csv.reader(io.StringIO(text), delimiter=delimiter))]
+        if rows and all(len(row) == columns for row in rows):
+            return pos + 1
+    return -1
+
+
+def sample_record_blocks(path, blocks, block_bytes, seed=None, delimiter=','):
+    """Return the header and a list of record-aligned byte blocks read at random offsets of path.
+
+    If the data is no bigger than the sample budget the whole data section is
+    returned as a single block, so the estimate becomes exact.
+    """
+    header, header_offset = read_header(path)
+    columns = len(next(csv.reader(io.StringIO(header.decode('utf-8', errors='replace')), delimiter=delimiter), []))
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size - header_offset <= blocks * block_bytes:
+            f.seek(header_offset)
+            return header, [f.read()]
+
+        rng = random.Random(seed)
+        offsets = sorted(rng.randrange(header_offset, size) for _ in range(blocks))
+        sampled = []
+        last_end = header_offset
+        for offset in offsets:
+            # Start at the previous block's end rather than reading the same records twice.
+            offset = max(offset, last_end)
+            f.seek(offset)
+            buf = f.read(block_bytes)
+            start = 0 if offset == last_end else align_to_record(buf, columns, delimiter=delimiter)
+            if start == -1:
+                logging.debug(f"no record boundary found at offset {offset} of {path}")
+                continue
+            end = find_record_end(buf[start:])
+            if end <= 0:
+                continue
+            sampled.append(buf[start:start + end])
+            last_end = offset + start + end
+        return header, sampled
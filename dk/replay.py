@@ -0,0 +1,387 @@
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import contextlib
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from dqm3 import FileManager, SchemaManager, FileProcessor
+from engines import ENGINES, get_engine
+from governor import parse_size
+from records import read_header
+from scheduler import POLICIES, Scheduler, percentile
+from readers import file_family
+
+NEWLINE = b'\n'
+QUOTE = b'"'
+
+
+def record_ends(body):
+    """Return the offsets just past every record in body, a run of whole CSV records."""
+    ends, quotes, start = [], 0, 0
+    while True:
+        pos = body.find(NEWLINE, start)
+        if pos == -1:
+            return ends
+        quotes += body.count(QUOTE, start, pos)
+        if quotes % 2 == 0:
+            ends.append(pos + 1)
+        start = pos + 1
+
+
+@contextlib.contextmanager
+def stdout_to_stderr():
+    """Send what the pipeline logs and prints to stdout to stderr instead, so stdout holds only the report."""
+    handlers = [handler for handler in logging.getLogger().handlers
+                if type(handler) is logging.StreamHandler and handler.stream is sys.stdout]
+    for handler in handlers:
+        handler.setStream(sys.stderr)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        for handler in handlers:
+            handler.setStream(sys.stdout)
+
+
+class Template:
+    """The records of a real input file, repeated to make input files of any size."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.header, offset = read_header(self.path)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            self.body = f.read()
+        if self.body and not self.body.endswith(NEWLINE):
+            self.body += NEWLINE
+        self.ends = record_ends(self.body)
+        if not self.ends:
+            raise ValueError(f"template {self.path} has no records")
+
+    def make(self, size, key_columns=()):
+        """Return the bytes of a file of about size bytes and its number of records, at least one.
+
+        Values of key_columns get the number of their copy of the template
+        as a suffix of digits, so the duplicates within the template stay
+        duplicates but its copies do not repeat each other's keys.
+        """
+        target = max(0, size - len(self.header))
+        repeats, remainder = divmod(target, len(self.body))
+        whole = sum(1 for end in self.ends if end <= remainder)
+        if repeats == 0 and whole == 0:
+            whole = 1
+        rows = repeats * len(self.ends) + whole
+        if key_columns:
+            return self.header + self.keyed_records(repeats, whole, key_columns), rows
+        data = self.header + self.body * repeats + self.body[:self.ends[whole - 1] if whole else 0]
+        return data, rows
+
+    def keyed_records(self, repeats, whole, key_columns):
+        """Return repeats copies of the records and whole records of one more, with their keys made unique per copy."""
+        names = next(csv.reader(io.StringIO(self.header.decode('utf-8'))))
+        keys = [names.index(column) for column in key_columns if column in names]
+        records = list(csv.reader(io.StringIO(self.body.decode('utf-8'), newline='')))
+        width = len(str(repeats))
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\r\n' if b'\r\n' in self.body else '\n')
+        for copy in range(repeats + 1):
+            suffix = str(copy).zfill(width)
+            for record in records if copy < repeats else records[:whole]:
+                record = list(record)
+                for index in keys:
+                    if index < len(record) and record[index]:
+                        record[index] += suffix
+                writer.writerow(record)
+        return out.getvalue().encode('utf-8')
+
+
+def load_trace(path):
+    """Read an arrival trace as [(seconds after the first arrival, family, bytes)].
+
+    The trace is a CSV with at, family and bytes columns. A latency log
+    written by the scheduler (arrived, family, bytes) is accepted as well,
+    so that a recorded day can be replayed.
+    """
+    arrivals = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            at = float(row['at'] if 'at' in row else row['arrived'])
+            arrivals.append((at, row['family'], int(float(row['bytes']))))
+    if not arrivals:
+        return []
+    first = min(at for at, _, _ in arrivals)
+    return sorted((at - first, family, size) for at, family, size in arrivals)
+
+
+def synthetic_trace(files, interval, size, family, poisson=False, seed=None):
+    """Return a trace of files of one size arriving every interval seconds, or at Poisson times with that mean gap."""
+    rng = random.Random(seed)
+    arrivals, at = [], 0.0
+    for _ in range(files):
+        arrivals.append((at, family, size))
+        at += rng.expovariate(1 / interval) if poisson and interval > 0 else interval
+    return arrivals
+
+
+class ReplayScheduler(Scheduler):
+    """A Scheduler that also tells the harness which files are done, as soon as each batch finishes."""
+
+    def __init__(self, harness, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.harness = harness
+
+    def record(self, files, started, finished):
+        super().record(files, started, finished)
+        self.harness.finished(files, finished)
+
+
+class ReplayProcessor(FileProcessor):
+    """A FileProcessor that counts a file it failed to process as done, so that the replay cannot stall on it."""
+
+    def process_scheduled(self, batch):
+        try:
+            super().process_scheduled(batch)
+        except Exception as e:
+            logging.exception(f"processing {batch} failed because {e}")
+            self.scheduler.harness.finished(batch, time.time(), failed=True)
+
+
+class ReplayHarness:
+    """Replays an arrival trace into a temporary source directory while the pipeline processes it.
+
+    Files are written at their arrival times (divided by speed) by a
+    producer thread and land atomically under their final name. The
+    pipeline polls the directory as in production, with FileManager,
+    SchemaManager and FileProcessor, and every processed file is added to
+    the scanned registry. While the replay runs the backlog of arrived but
+    unprocessed files is sampled, and at the end a report gives the
+    sustained rows per second, the growth of the backlog and the
+    arrival-to-output latency percentiles. Files still pending drain_timeout
+    seconds after the last arrival, such as files no config row matches,
+    are counted as failed. The duplicate-check keys of every family are
+    made unique per copy of its template, see Template.make.
+    """
+
+    def __init__(self, trace, templates, config_file, schema_file, work_dir, speed=1.0, poll_interval=1.0,
+                 sample_interval=1.0, processor_options=None, schedule='listdir', drain_timeout=600.0):
+        self.trace = trace
+        self.templates = templates  # family -> Template
+        self.config_file = config_file
+        self.schema_file = schema_file
+        self.work_dir = Path(work_dir)
+        self.speed = speed
+        self.poll_interval = poll_interval
+        self.sample_interval = sample_interval
+        self.processor_options = processor_options or {}
+        self.schedule = schedule
+        self.drain_timeout = drain_timeout
+        self.config = {}  # family -> test -> attributes, loaded by run
+        self.source = self.work_dir / 'source'
+        self.output = self.work_dir / 'output'
+        self.registry = self.work_dir / 'scanned.csv'
+        self.lock = threading.Lock()
+        self.arrived = {}  # file -> (arrival time, rows, bytes)
+        self.done = {}  # file -> finish time
+        self.failed = set()
+        self.backlog = []  # (time since start, files waiting, bytes waiting)
+        self.producer_done = threading.Event()
+        self.started = None
+
+    def file_name(self, family, index):
+        """A unique <family>YYYYMMDDHHMMSS.csv name for the index-th arrival."""
+        stamp = datetime(2000, 1, 1) + timedelta(seconds=index)
+        return f"{family}{stamp.strftime('%Y%m%d%H%M%S')}.csv"
+
+    def produce(self):
+        """Write the files of the trace into the source directory at their arrival times."""
+        contents = {}
+        try:
+            for index, (at, family, size) in enumerate(self.trace):
+                template = self.templates.get(family) or next(iter(self.templates.values()))
+                key = (template.path, size, family)
+                if key not in contents:
+                    contents[key] = template.make(size, self.config.get(family, {}).get('duplicate_check', []))
+                data, rows = contents[key]
+                delay = self.started + at / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                name = self.file_name(family, index)
+                tmp_path = self.source / f".{name}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.source / name)
+                with self.lock:
+                    self.arrived[name] = (time.time(), rows, len(data))
+        finally:
+            self.producer_done.set()
+
+    def finished(self, files, finished, failed=False):
+        """Mark files as done and add them to the scanned registry."""
+        with self.lock:
+            for file in files:
+                self.done[file] = finished
+                if failed:
+                    self.failed.add(file)
+        with open(self.registry, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([file] for file in files)
+
+    def sample(self):
+        """Sample the backlog every sample_interval seconds until the replay ends."""
+        while True:
+            with self.lock:
+                waiting = [file for file in self.arrived if file not in self.done]
+                self.backlog.append((time.time() - self.started, len(waiting),
+                                     sum(self.arrived[file][2] for file in waiting)))
+                complete = self.producer_done.is_set() and not waiting
+            if complete:
+                return
+            time.sleep(self.sample_interval)
+
+    def run(self):
+        """Run the replay to the end and return the report."""
+        self.source.mkdir(parents=True, exist_ok=True)
+        self.output.mkdir(parents=True, exist_ok=True)
+        with open(self.registry, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['files_scanned'])
+
+        schema_manager = SchemaManager(self.config_file, self.schema_file, self.work_dir / 'cache')
+        self.config = schema_manager.config
+        file_manager = FileManager(str(self.source), str(self.registry), str(self.output), self.work_dir / 'cache')
+        scheduler = ReplayScheduler(self, self.schedule, str(self.source), schema_manager.config,
+                                    latency_log=self.work_dir / 'latency.csv')
+        processor = ReplayProcessor(file_manager, schema_manager, scheduler=scheduler, **self.processor_options)
+
+        self.started = time.time()
+        deadline = self.started + (self.trace[-1][0] / self.speed if self.trace else 0.0) + self.drain_timeout
+        producer = threading.Thread(target=self.produce, daemon=True)
+        sampler = threading.Thread(target=self.sample, daemon=True)
+        producer.start()
+        sampler.start()
+        while True:
+            with self.lock:
+                pending = [file for file in self.arrived if file not in self.done]
+                done = len(self.done)
+            if self.producer_done.is_set() and not pending:
+                break
+            if self.producer_done.is_set() and time.time() > deadline:
+                logging.error(f"Counting {len(pending)} files still pending {self.drain_timeout}s after the last "
+                              f"arrival as failed: {', '.join(sorted(pending))}")
+                self.finished(pending, time.time(), failed=True)
+                break
+            if pending:
+                processor.process_files()
+            # A pass that finished nothing, as for files no config row matches, waits for the next poll.
+            with self.lock:
+                progressed = len(self.done) > done
+            if not progressed:
+                time.sleep(self.poll_interval)
+        ended = time.time()
+        sampler.join()
+        return self.report(scheduler, ended)
+
+    def report(self, scheduler, ended):
+        """Summarize the replay: throughput, backlog and latency percentiles."""
+        elapsed = ended - self.started
+        rows = sum(rows for _, rows, _ in self.arrived.values())
+        size = sum(size for _, _, size in self.arrived.values())
+        waits = [wait for wait, _ in scheduler.latencies]
+        latencies = [latency for _, latency in scheduler.latencies]
+        offered = self.trace[-1][0] / self.speed if self.trace else 0.0
+        # Backlog growth is the least squares slope of the waiting files while files still arrive, not while
+        # the last ones are drained.
+        arriving = [(at, count) for at, count, _ in self.backlog if at <= offered] or \
+            [(at, count) for at, count, _ in self.backlog]
+        growth = 0.0
+        if len(arriving) > 1 and arriving[-1][0] > arriving[0][0]:
+            mean_t = sum(at for at, _ in arriving) / len(arriving)
+            mean_c = sum(count for _, count in arriving) / len(arriving)
+            growth = (sum((at - mean_t) * (count - mean_c) for at, count in arriving)
+                      / sum((at - mean_t) ** 2 for at, _ in arriving))
+        report = {
+            'files': len(self.arrived),
+            'failed': len(self.failed),
+            'rows': rows,
+            'bytes': size,
+            'cpus': os.cpu_count(),
+            'workers': self.processor_options.get('workers', 1),
+            'seconds': round(elapsed, 3),
+            'offered_rows_per_second': round(rows / offered, 1) if offered else None,
+            'rows_per_second': round(rows / elapsed, 1) if elapsed else None,
+            'bytes_per_second': round(size / elapsed, 1) if elapsed else None,
+            'backlog': {
+                'max_files': max((count for _, count, _ in self.backlog), default=0),
+                'max_bytes': max((waiting for _, _, waiting in self.backlog), default=0),
+                'growth_files_per_minute': round(growth * 60, 3),
+            },
+            'queue_wait': {f"p{q}": round(percentile(waits, q), 3) if waits else None for q in (50, 95, 99)},
+            'latency': {f"p{q}": round(percentile(latencies, q), 3) if latencies else None for q in (50, 95, 99)},
+        }
+        logging.info(f"Replayed {report['files']} files ({rows} rows) in {report['seconds']}s: "
+                     f"{report['rows_per_second']} rows/s, backlog max {report['backlog']['max_files']} files "
+                     f"growing {report['backlog']['growth_files_per_minute']} files/min, latency p50 "
+                     f"{report['latency']['p50']}s p95 {report['latency']['p95']}s p99 {report['latency']['p99']}s")
+        return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay file arrivals into a temporary source directory and report "
+                                                 "the pipeline's throughput, backlog and latency.")
+    parser.add_argument('config_file')
+    parser.add_argument('schema_file')
+    parser.add_argument('template', nargs='+',
+                        help="input files whose records are repeated to make the replayed files; each one is "
+                             "used for the family of its name")
+    parser.add_argument('--trace', default=None,
+                        help="CSV of arrivals with at (seconds), family and bytes columns, or a latency log to "
+                             "replay; without it a synthetic trace is generated")
+    parser.add_argument('--files', type=int, default=20, help="synthetic trace: number of files (default: 20)")
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help="synthetic trace: seconds between arrivals (default: 1)")
+    parser.add_argument('--file-size', type=parse_size, default=1024 * 1024,
+                        help="synthetic trace: size of every file (default: 1M)")
+    parser.add_argument('--poisson', action='store_true', help="synthetic trace: Poisson arrivals")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--speed', type=float, default=1.0, help="replay this many times faster than the trace")
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help="seconds between polls of the source directory when nothing is pending")
+    parser.add_argument('--drain-timeout', type=float, default=600.0,
+                        help="seconds to wait after the last arrival for pending files, which are then counted as "
+                             "failed (default: 600)")
+    parser.add_argument('--work-dir', default=None,
+                        help="directory for the source, output and registry (default: a temporary directory)")
+    parser.add_argument('--report', default=None, help="also write the report as JSON to this file")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='pandas')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=256 * 1024 * 1024)
+    parser.add_argument('--batch-small-files', type=parse_size, default=0)
+    parser.add_argument('--schedule', choices=POLICIES, default='listdir')
+    args = parser.parse_args()
+
+    templates = {file_family(path): Template(path) for path in args.template}
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.files, args.interval, args.file_size, next(iter(templates)),
+                                args.poisson, args.seed)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='dqm-replay-')
+    harness = ReplayHarness(trace, templates, args.config_file, args.schema_file, work_dir, args.speed,
+                            args.poll_interval,
+                            processor_options={'engine': get_engine(args.engine), 'workers': args.workers,
+                                               'chunk_size': args.chunk_size,
+                                               'batch_bytes': args.batch_small_files},
+                            schedule=args.schedule, drain_timeout=args.drain_timeout)
+    with stdout_to_stderr():
+        report = harness.run()
+    print(json.dumps(report, indent=1))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,133 @@
+import os
+import csv
+import math
+import time
+import logging
+from pathlib import Path
+from datetime import datetime
+
+from readers import file_family, file_timestamp_text
+
+POLICIES = ('listdir', 'priority', 'oldest', 'smallest')
+LATENCY_FIELDS = ['file', 'family', 'bytes', 'arrived', 'started', 'finished', 'queue_wait', 'latency']
+
+
+def file_timestamp(file):
+    """Return the epoch time of the YYYYMMDDHHMMSS suffix of a file name, or None if it has none."""
+    try:
+        return datetime.strptime(file_timestamp_text(file), '%Y%m%d%H%M%S').timestamp()
+    except ValueError:
+        return None
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values by linear interpolation."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class Scheduler:
+    """Orders the pending files by a policy and records how long each one waited.
+
+    Policies:
+      listdir   the order the directory listing returned (the default)
+      priority  highest per-family 'priority' from the config file first
+      oldest    oldest YYYYMMDDHHMMSS timestamp in the file name first
+      smallest  fewest bytes first
+
+    A file arrives when it lands in the source directory (its mtime). With
+    aging, every aging seconds a file has waited raise its priority by one
+    and halve its effective size, so old files are never starved by a steady
+    stream of urgent or small ones. For every processed file the arrival,
+    start and finish times are appended to a latency log.
+    """
+
+    def __init__(self, policy, source_file_location, config, aging=3600, latency_log=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown schedule {policy}, expected one of {list(POLICIES)}")
+        self.policy = policy
+        self.source_file_location = source_file_location
+        self.config = config
+        self.aging = aging
+        self.latency_log = Path(latency_log) if latency_log else None
+        self.latencies = []  # (queue_wait, latency) of the files processed by this run
+
+    def priority(self, file):
+        """The configured priority of the file's family, 0 if it has none."""
+        try:
+            return float(self.config.get(file_family(file), {}).get('priority', ['0'])[0])
+        except ValueError:
+            logging.warning(f"Ignoring priority of family {file_family(file)}: not a number")
+            return 0.0
+
+    def order(self, files):
+        """Return the files in the order they should be processed, without those that vanished since discovery."""
+        if self.policy == 'listdir':
+            return list(files)
+        now = time.time()
+        keys = {}
+        for file in files:
+            try:
+                stat = os.stat(Path(self.source_file_location) / file)
+            except OSError as e:
+                logging.warning(f"Not scheduling {file}: {e}")
+                continue
+            aged = max(0.0, now - stat.st_mtime) / self.aging if self.aging else 0.0
+            if self.policy == 'priority':
+                keys[file] = (-(self.priority(file) + aged), stat.st_mtime)
+            elif self.policy == 'oldest':
+                timestamp = file_timestamp(file)
+                keys[file] = (timestamp if timestamp is not None else stat.st_mtime, file)
+            else:
+                # The size halved once per aging period, compared as log2 so files that waited months do not overflow
+                keys[file] = (math.log2(stat.st_size + 1) - aged, stat.st_mtime)
+        ordered = sorted(keys, key=keys.get)
+        logging.info(f"Scheduled {len(ordered)} files by {self.policy}")
+        return ordered
+
+    def record(self, files, started, finished):
+        """Record the queue wait and end-to-end latency of files processed between started and finished."""
+        rows = []
+        for file in files:
+            try:
+                stat = os.stat(Path(self.source_file_location) / file)
+            except OSError:
+                continue
+            arrived = min(stat.st_mtime, started)
+            rows.append({
+                'file': file,
+                'family': file_family(file),
+                'bytes': stat.st_size,
+                'arrived': round(arrived, 3),
+                'started': round(started, 3),
+                'finished': round(finished, 3),
+                'queue_wait': round(started - arrived, 3),
+                'latency': round(finished - arrived, 3),
+            })
+            self.latencies.append((started - arrived, finished - arrived))
+        if self.latency_log is None or not rows:
+            return
+        try:
+            self.latency_log.parent.mkdir(parents=True, exist_ok=True)
+            new_log = not self.latency_log.exists()
+            with open(self.latency_log, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=LATENCY_FIELDS)
+                if new_log:
+                    writer.writeheader()
+                writer.writerows(rows)
+        except Exception as e:
+            logging.error(f"Error writing latency log {self.latency_log}: {e}")
+
+    def summary(self):
+        """Log the p50 and p95 queue wait and latency of the files processed by this run."""
+        if not self.latencies:
+            return
+        waits = [wait for wait, _ in self.latencies]
+        latencies = [latency for _, latency in self.latencies]
+        logging.info(f"Processed {len(latencies)} files by {self.policy}: queue wait p50 {percentile(waits, 50):.1f}s "
+                     f"p95 {percentile(waits, 95):.1f}s, latency p50 {percentile(latencies, 50):.1f}s "
+                     f"p95 {percentile(latencies, 95):.1f}s")
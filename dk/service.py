@@ -0,0 +1,206 @@
+import os
+import json
+import socket
+import logging
+import ipaddress
+import argparse
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from dqm3 import FileManager, SchemaManager, FileProcessor, file_signature
+from engines import ENGINES, get_engine
+
+
+class ValidationService:
+    """Keeps the schema, config and engine loaded and validates files on request.
+
+    Only files directly in source_file_location are validated, as by the
+    batch pipeline, so their names are unique and name their outputs and
+    scanned-registry entries. Results are remembered per file together with
+    the file's mtime and size and the config/schema signature, so asking
+    again about an unchanged file returns the earlier result without reading
+    it. At most max_concurrent validations run at once.
+    """
+
+    def __init__(self, source_file_location, scanned_files, config_file, schema_file, output_file_location,
+                 engine='pandas', max_concurrent=2, cache_dir=None):
+        self.source_file_location = Path(source_file_location).resolve()
+        self.scanned_files = scanned_files
+        self.config_file = config_file
+        self.schema_file = schema_file
+        self.output_file_location = str(Path(output_file_location).resolve())
+        self.cache_dir = cache_dir or Path(output_file_location) / '.cache'
+        self.engine = get_engine(engine)
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.results = {}  # path -> (signature, result)
+        self.path_locks = {}  # path -> Lock, so one file is never validated twice at the same time
+        self.schema_signature = None
+        self.schema_manager = None
+        self.scanned_index = FileManager(None, scanned_files, output_file_location)
+
+    def current_schema_manager(self):
+        """Return the loaded SchemaManager, reloading it if the config or schema file changed."""
+        signature = [file_signature(self.config_file), file_signature(self.schema_file)]
+        with self.lock:
+            if signature != self.schema_signature:
+                logging.info("Loading config and schema")
+                self.schema_manager = SchemaManager(self.config_file, self.schema_file, self.cache_dir)
+                self.schema_signature = signature
+            return self.schema_manager, signature
+
+    def validate(self, path, wait=True):
+        """Validate one file and return its summary, reusing the last result if nothing changed.
+
+        path is absolute or relative to the source directory. A file outside
+        it is refused with a ValueError, as its outputs and registry entry
+        would be those of the source file of the same name.
+        """
+        path = (self.source_file_location / path).resolve()
+        if path.parent != self.source_file_location:
+            raise ValueError(f"{path} is not in the source directory {self.source_file_location}")
+        if not path.is_file():
+            raise FileNotFoundError(f"no such file: {path}")
+        with self.lock:
+            path_lock = self.path_locks.setdefault(str(path), threading.Lock())
+        with path_lock:
+            schema_manager, schema_signature = self.current_schema_manager()
+            signature = [file_signature(path), schema_signature]
+            cached = self.results.get(str(path))
+            if cached is not None and cached[0] == signature:
+                return dict(cached[1], cached=True)
+
+            if not self.slots.acquire(blocking=wait):
+                raise BusyError("all validation slots are busy")
+            try:
+                file_manager = FileManager(str(self.source_file_location), self.scanned_files,
+                                           self.output_file_location)
+                processor = FileProcessor(file_manager, schema_manager, engine=self.engine)
+                processor.process_one(path.name)
+                result = dict(processor.result, scanned=self.scanned_index.check_if_file_already_scanned(path.name))
+            finally:
+                self.slots.release()
+            self.results[str(path)] = (signature, result)
+            return dict(result, cached=False)
+
+
+class BusyError(Exception):
+    pass
+
+
+class ValidationHandler(BaseHTTPRequestHandler):
+    """HTTP API: POST /validate with {"path": ..., "wait": true} returns the file's summary as JSON."""
+
+    service = None
+
+    def do_POST(self):
+        if self.path != '/validate':
+            return self.reply(404, {'error': f"unknown endpoint {self.path}"})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            result = self.service.validate(request['path'], request.get('wait', True))
+        except KeyError:
+            return self.reply(400, {'error': "request needs a 'path'"})
+        except FileNotFoundError as e:
+            return self.reply(404, {'error': str(e)})
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        except BusyError as e:
+            return self.reply(503, {'error': str(e)})
+        except Exception as e:
+            logging.exception(f"validation failed because {e}")
+            return self.reply(500, {'error': str(e)})
+        self.reply(200, result)
+
+    def do_GET(self):
+        if self.path == '/health':
+            return self.reply(200, {'status': 'ok'})
+        self.reply(404, {'error': f"unknown endpoint {self.path}"})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, None
+
+
+def is_loopback(host):
+    """Check if every address a host name resolves to is a loopback address."""
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None, socket.AF_INET)}
+    except OSError:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address).is_loopback for address in addresses)
+
+
+def make_server(listen, service, allow_remote=False):
+    """Create an HTTP server on 'host:port' or on a Unix socket given as 'unix:/path'.
+
+    The service has no authentication, so hosts that are not loopback
+    addresses are refused with a ValueError unless allow_remote is set.
+    """
+    handler = type('BoundValidationHandler', (ValidationHandler,), {'service': service})
+    if listen.startswith('unix:'):
+        socket_path = listen[len('unix:'):]
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    host, _, port = listen.rpartition(':')
+    host = host or '127.0.0.1'
+    if not allow_remote and not is_loopback(host):
+        raise ValueError(f"refusing to listen on {host}: it is not a loopback address and the service has no "
+                         f"authentication")
+    return ThreadingHTTPServer((host, int(port)), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve data quality validation over localhost HTTP or a Unix socket.")
+    parser.add_argument('source_file_location', help="directory of the files that may be validated")
+    parser.add_argument('scanned_files')
+    parser.add_argument('config_file')
+    parser.add_argument('schema_file')
+    parser.add_argument('output_file_location')
+    parser.add_argument('--listen', default='127.0.0.1:8765',
+                        help="host:port to listen on, or unix:/path/to/socket (default: 127.0.0.1:8765)")
+    parser.add_argument('--allow-remote', action='store_true',
+                        help="allow --listen on a host that is not a loopback address, exposing the "
+                             "unauthenticated service to the network")
+    parser.add_argument('--max-concurrent', type=int, default=2, help="validations allowed to run at once")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='pandas')
+    parser.add_argument('--cache-dir', default=None)
+    args = parser.parse_args()
+
+    service = ValidationService(args.source_file_location, args.scanned_files, args.config_file, args.schema_file,
+                                args.output_file_location, engine=args.engine, max_concurrent=args.max_concurrent,
+                                cache_dir=args.cache_dir)
+    try:
+        server = make_server(args.listen, service, args.allow_remote)
+    except ValueError as e:
+        parser.error(f"{e}; pass --allow-remote to listen on it anyway")
+    logging.info(f"Validation service listening on {args.listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
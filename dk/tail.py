@@ -0,0 +1,118 @@
+import os
+import json
+import shutil
+import logging
+from pathlib import Path
+
+from checkpoint import write_keys
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+class TailState:
+    """Incremental processing state for a file that grows by appends.
+
+    Records the byte offset and row count committed so far, a hash of the
+    header, the sizes of the output files at the last commit and the
+    duplicate-check key hashes of every committed row. Output files are
+    truncated back to their committed sizes on load, so a cycle that died
+    after appending but before committing is not written twice.
+    """
+
+    def __init__(self, state_dir, file, output_paths):
+        self.state_dir = Path(state_dir) / file
+        self.state_file = self.state_dir / 'state.json'
+        self.file = file
+        self.output_paths = output_paths  # kind -> Path of the output file
+        self.state = None
+        self.seen_keys = np.array([], dtype=np.uint64)
+
+    def load(self):
+        """Load the saved state and roll the outputs back to the last commit."""
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = self.fresh_state(None, 0)
+            return self
+        except Exception as e:
+            logging.error(f"Error reading tail state {self.state_file}: {e}")
+            self.state = self.fresh_state(None, 0)
+            return self
+
+        for kind, path in self.output_paths.items():
+            committed = self.state['output_sizes'].get(kind, 0)
+            if path.exists() and path.stat().st_size > committed:
+                logging.warning(f"Rolling {path} back to its last committed size of {committed} bytes")
+                with open(path, 'r+b') as f:
+                    f.truncate(committed)
+        keys = []
+        for path in sorted(self.state_dir.glob('keys-*.npy')):
+            # Key parts written after the last commit belong to records that will be processed again.
+            if int(path.stem.split('-')[1]) <= self.state['key_parts']:
+                keys.append(np.load(path))
+            else:
+                path.unlink()
+        if keys:
+            self.seen_keys = np.unique(np.concatenate(keys))
+        return self
+
+    def contains(self, hashes):
+        """Return a boolean mask of the key hashes already seen in committed rows."""
+        return np.isin(hashes, self.seen_keys)
+
+    @staticmethod
+    def fresh_state(header_hash, header_offset):
+        return {
+            'header_hash': header_hash,
+            'byte_offset': header_offset,
+            'rows_committed': 0,
+            'output_sizes': {},
+            'key_parts': 0,
+        }
+
+    def reset(self, header_hash, header_offset):
+        """Start the file over, removing its outputs and saved keys."""
+        for path in self.output_paths.values():
+            if path.exists():
+                path.unlink()
+        if self.state_dir.exists():
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+        self.state = self.fresh_state(header_hash, header_offset)
+        self.seen_keys = np.array([], dtype=np.uint64)
+
+    def commit(self, byte_offset, rows, keys=None):
+        """Record newly processed records as committed."""
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        if keys is not None and len(keys):
+            self.state['key_parts'] += 1
+            write_keys(self.state_dir / f"keys-{self.state['key_parts']:06d}.npy", keys)
+            self.seen_keys = np.union1d(self.seen_keys, keys)
+        self.state['byte_offset'] = byte_offset
+        self.state['rows_committed'] += rows
+        self.state['output_sizes'] = {
+            kind: path.stat().st_size for kind, path in self.output_paths.items() if path.exists()
+        }
+        self.save()
+        if self.state['key_parts'] > 64:
+            self.compact_keys()
+
+    def save(self):
+        """Atomically write the state file."""
+        tmp_file = self.state_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+
+    def compact_keys(self):
+        """Merge the saved key parts into one so loading stays cheap for long-lived files."""
+        merged = self.state_dir / 'keys-000000.npy'
+        parts = [path for path in self.state_dir.glob('keys-*.npy') if path != merged]
+        write_keys(merged, self.seen_keys)
+        for path in parts:
+            path.unlink()
+        self.state['key_parts'] = 0
+        self.save()
@@ -0,0 +1,41 @@
+import sys
+import csv
+from pathlib import Path
+
+import pytest
+
+# The modules of the pipeline import each other by their bare names, as when it is run from dk/.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'dk'))
+
+
+def write_csv(path, header, rows):
+    """Write a CSV file with a header row and return its path."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    """Build a FileProcessor over a fresh source, output and config under tmp_path.
+
+    Call it with the config rows as (file_prefix, test, attribute) and any
+    FileProcessor options; the source directory is processor.file_manager.source_file_location.
+    """
+    from dqm3 import FileManager, SchemaManager, FileProcessor
+
+    def build(config_rows, schema_rows=(), **options):
+        source, output = tmp_path / 'source', tmp_path / 'output'
+        source.mkdir(exist_ok=True)
+        output.mkdir(exist_ok=True)
+        write_csv(tmp_path / 'config.csv', ['file_prefix', 'test', 'attribute'], config_rows)
+        write_csv(tmp_path / 'schema.csv', ['Field Name', 'DataType'], schema_rows)
+        write_csv(tmp_path / 'scanned.csv', ['files_scanned'], [])
+        file_manager = FileManager(str(source), str(tmp_path / 'scanned.csv'), str(output))
+        schema_manager = SchemaManager(str(tmp_path / 'config.csv'), str(tmp_path / 'schema.csv'))
+        return FileProcessor(file_manager, schema_manager, **options)
+    return build
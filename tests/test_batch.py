@@ -0,0 +1,55 @@
+import random
+
+import pandas as pd
+
+from conftest import write_csv
+
+FILES = [f"orders_2024010{day}000000.csv" for day in range(1, 5)]
+CONFIG = [(FILES[0], 'duplicate_check', 'id'), (FILES[0], 'type_check', 'age'),
+          (FILES[0], 'phonenumber_e164_check', 'phone'), (FILES[0], 'fuzzy_duplicate_check', 'company')]
+
+
+def small_inputs(source, rows=80, seed=17):
+    """Write small files of one family, with ids repeated within and across files and some bad ages."""
+    rng = random.Random(seed)
+    companies = ['Acme Traders Pvt Ltd', 'ACME TRADERS PVT. LTD', 'Globex Corporation', 'Initech Systems']
+    for present_file in FILES:
+        write_csv(source / present_file, ['id', 'age', 'phone', 'company'],
+                  [[rng.randrange(rows), rng.choice(['31', '', 'x']), rng.choice(['9845012345', '', 'n/a']),
+                    f"{rng.choice(companies)} {i % 7}"] for i in range(rows)])
+
+
+def take_outputs(output):
+    """Return the bytes of every output file by name and remove them."""
+    outputs = {}
+    for path in sorted(output.glob('*.csv')):
+        outputs[path.name] = path.read_bytes()
+        path.unlink()
+    return outputs
+
+
+def test_batch_writes_the_outputs_of_single_files(pipeline, tmp_path):
+    small_inputs(tmp_path / 'source')
+    single = pipeline(CONFIG, [('age', 'int')])
+    for present_file in FILES:
+        single.process_one(present_file)
+    expected = take_outputs(tmp_path / 'output')
+    assert len(expected) == 3 * len(FILES)
+    metadata = b''.join(data for name, data in expected.items() if name.endswith('.metadata.csv'))
+    assert b'type' in metadata and b'fuzzy_duplicate' in metadata and b'duplicate' in metadata
+
+    batched = pipeline(CONFIG, [('age', 'int')], batch_bytes=1024 * 1024)
+    assert batched.plan_batches(FILES) == [FILES]
+    batched.process_batch(FILES)
+    assert take_outputs(tmp_path / 'output') == expected
+
+
+def test_cross_file_duplicates_reject_ids_of_earlier_files(pipeline, tmp_path):
+    source = tmp_path / 'source'
+    write_csv(source / FILES[0], ['id', 'name'], [[1, 'a'], [2, 'b']])
+    write_csv(source / FILES[1], ['id', 'name'], [[2, 'c'], [3, 'd']])
+    processor = pipeline([(FILES[0], 'duplicate_check', 'id')], batch_bytes=1024 * 1024, cross_file_duplicates=True)
+    processor.process_batch(FILES[:2])
+
+    bad = pd.read_csv(tmp_path / 'output' / 'orders_20240102000000.bad.csv')
+    assert bad['name'].tolist() == ['c']
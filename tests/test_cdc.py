@@ -0,0 +1,109 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from conftest import write_csv
+from cdc import CDC_OP_COLUMN, ChangeCapture, LateDeliveryError
+
+HEADER = ['id', 'name']
+DELIVERIES = {
+    'orders_20240101000000.csv': [[1, 'a'], [2, 'b'], [3, 'c']],
+    'orders_20240102000000.csv': [[1, 'a'], [2, 'B'], [4, 'd']],
+    'orders_20240103000000.csv': [[1, 'a'], [4, 'd'], [5, 'e']],
+}
+
+
+def capture(change_capture, tmp_path, present_file):
+    clean = write_csv(tmp_path / f"{present_file}.out.csv", HEADER, DELIVERIES[present_file])
+    delta_path = tmp_path / f"{present_file}.delta.csv"
+    return change_capture.capture(present_file, clean, ['id'], delta_path), delta_path
+
+
+def changes(delta_path):
+    delta = pd.read_csv(delta_path, dtype=str)
+    return sorted(zip(delta[CDC_OP_COLUMN], delta['id'], delta['name']))
+
+
+def test_delta_against_the_last_delivery(tmp_path):
+    change_capture = ChangeCapture(tmp_path / 'cdc')
+    first, second, third = DELIVERIES
+    assert capture(change_capture, tmp_path, first)[0] is None
+    counts, delta_path = capture(change_capture, tmp_path, second)
+    assert counts == {'insert': 1, 'update': 1, 'delete': 1}
+    assert changes(delta_path) == [('delete', '3', 'c'), ('insert', '4', 'd'), ('update', '2', 'B')]
+
+    capture(change_capture, tmp_path, third)
+    assert len(list(change_capture.snapshot_dir('orders_').iterdir())) == 2
+
+
+def test_capturing_the_last_delivery_again_gives_the_same_delta(tmp_path):
+    change_capture = ChangeCapture(tmp_path / 'cdc')
+    first, second, _ = DELIVERIES
+    capture(change_capture, tmp_path, first)
+    _, delta_path = capture(change_capture, tmp_path, second)
+    expected = changes(delta_path)
+
+    counts, delta_path = capture(change_capture, tmp_path, second)
+    assert counts == {'insert': 1, 'update': 1, 'delete': 1}
+    assert changes(delta_path) == expected
+    assert len(list(change_capture.snapshot_dir('orders_').iterdir())) == 2
+
+
+def test_crash_before_the_state_is_replaced_loses_no_changes(tmp_path, monkeypatch):
+    change_capture = ChangeCapture(tmp_path / 'cdc')
+    first, second, _ = DELIVERIES
+    capture(change_capture, tmp_path, first)
+
+    def crash(family, state):
+        raise OSError('disk full')
+    monkeypatch.setattr(change_capture, 'save_state', crash)
+    with pytest.raises(OSError):
+        capture(change_capture, tmp_path, second)
+    monkeypatch.undo()
+    assert change_capture.load_state('orders_')['file'] == first
+
+    counts, delta_path = capture(change_capture, tmp_path, second)
+    assert counts == {'insert': 1, 'update': 1, 'delete': 1}
+    assert len(list(change_capture.snapshot_dir('orders_').iterdir())) == 2
+
+
+def test_late_delivery_is_an_error(tmp_path):
+    change_capture = ChangeCapture(tmp_path / 'cdc')
+    first, second, _ = DELIVERIES
+    capture(change_capture, tmp_path, second)
+    with pytest.raises(LateDeliveryError):
+        capture(change_capture, tmp_path, first)
+    assert change_capture.load_state('orders_')['file'] == second
+
+
+def test_deliveries_are_processed_oldest_first(pipeline, tmp_path, caplog):
+    processor = pipeline([('orders_20240101000000.csv', 'cdc_key', 'id'),
+                          ('orders_20240101000000.csv', 'duplicate_check', 'id')],
+                         change_capture=ChangeCapture(tmp_path / 'cdc'))
+    for present_file, rows in DELIVERIES.items():
+        write_csv(tmp_path / 'source' / present_file, HEADER, rows)
+    files = list(DELIVERIES)
+    assert processor.deliveries_in_order(files[::-1]) == files
+    assert processor.deliveries_in_order(['b_20240102000000.csv', files[2], 'b_20240101000000.csv', files[0]]) == \
+        ['b_20240101000000.csv', files[0], 'b_20240102000000.csv', files[2]]
+
+    with caplog.at_level(logging.ERROR):
+        processor.process_files()
+    assert 'older than' not in caplog.text
+    outputs = sorted(path.name for path in (tmp_path / 'output').glob('*.csv'))
+    assert outputs == ['orders_20240101000000.metadata.csv', 'orders_20240101000000.out.csv',
+                       'orders_20240102000000.delta.csv', 'orders_20240102000000.metadata.csv',
+                       'orders_20240103000000.delta.csv', 'orders_20240103000000.metadata.csv']
+
+
+def test_late_delivery_keeps_its_full_clean_records(pipeline, tmp_path, caplog):
+    processor = pipeline([('orders_20240101000000.csv', 'cdc_key', 'id')],
+                         change_capture=ChangeCapture(tmp_path / 'cdc'))
+    first, second, _ = DELIVERIES
+    for present_file in (second, first):
+        write_csv(tmp_path / 'source' / present_file, HEADER, DELIVERIES[present_file])
+        with caplog.at_level(logging.ERROR):
+            processor.process_one(present_file)
+    assert 'is older than orders_20240102000000.csv' in caplog.text
+    assert (tmp_path / 'output' / 'orders_20240101000000.out.csv').exists()
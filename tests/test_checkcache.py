@@ -0,0 +1,73 @@
+import logging
+import random
+
+from conftest import write_csv
+
+FILE = 'orders_20240101000000.csv'
+CONFIG = [(FILE, 'phonenumber_e164_check', 'phone'), (FILE, 'type_check', 'age'), (FILE, 'duplicate_check', 'id')]
+
+
+def write_input(source, rows=400, seed=29):
+    """Write records with repeated ids, ages that are not whole numbers and phone numbers to normalize."""
+    rng = random.Random(seed)
+    write_csv(source / FILE, ['id', 'age', 'phone'],
+              [[rng.randrange(rows // 2), rng.choice(['31', '', '4.5', 'x']), rng.choice(['9845012345', '', 'n/a'])]
+               for _ in range(rows)])
+
+
+def take_outputs(output):
+    """Return the bytes of every output file by name and remove them."""
+    outputs = {}
+    for path in sorted(output.glob('*.csv')):
+        outputs[path.name] = path.read_bytes()
+        path.unlink()
+    return outputs
+
+
+def fresh_outputs(pipeline, tmp_path, config, schema):
+    pipeline(config, schema).process_one(FILE)
+    return take_outputs(tmp_path / 'output')
+
+
+def test_cached_checks_write_the_bytes_of_a_fresh_run(pipeline, tmp_path, caplog):
+    write_input(tmp_path / 'source')
+    expected = fresh_outputs(pipeline, tmp_path, CONFIG, [('age', 'int')])
+    assert b'duplicate' in expected['orders_20240101000000.metadata.csv']
+
+    for _ in range(2):
+        with caplog.at_level(logging.INFO):
+            pipeline(CONFIG, [('age', 'int')], check_cache_dir=tmp_path / 'check-cache').process_one(FILE)
+        assert take_outputs(tmp_path / 'output') == expected
+    assert 'Reused' in caplog.text
+
+
+def test_reprocessing_after_a_change_writes_the_bytes_of_a_fresh_run(pipeline, tmp_path, caplog):
+    write_input(tmp_path / 'source')
+    pipeline(CONFIG, [('age', 'int')], check_cache_dir=tmp_path / 'check-cache').process_one(FILE)
+    take_outputs(tmp_path / 'output')
+
+    # The type check changes; the phone check before it is replayed and the duplicate check after it runs again.
+    for config, schema in ((CONFIG, [('age', 'float')]), (CONFIG[:2], [('age', 'float')])):
+        expected = fresh_outputs(pipeline, tmp_path, config, schema)
+        caplog.clear()
+        with caplog.at_level(logging.INFO):
+            pipeline(config, schema, check_cache_dir=tmp_path / 'check-cache').reprocess_files()
+        assert 'Reprocessing' in caplog.text
+        assert take_outputs(tmp_path / 'output') == expected
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        pipeline(CONFIG[:2], [('age', 'float')], check_cache_dir=tmp_path / 'check-cache').reprocess_files()
+    assert 'Reprocessing' not in caplog.text
+    assert take_outputs(tmp_path / 'output') == {}
+
+
+def test_changed_file_is_checked_again(pipeline, tmp_path):
+    write_input(tmp_path / 'source')
+    pipeline(CONFIG, [('age', 'int')], check_cache_dir=tmp_path / 'check-cache').process_one(FILE)
+    take_outputs(tmp_path / 'output')
+
+    write_input(tmp_path / 'source', rows=300, seed=31)
+    expected = fresh_outputs(pipeline, tmp_path, CONFIG, [('age', 'int')])
+    pipeline(CONFIG, [('age', 'int')], check_cache_dir=tmp_path / 'check-cache').process_one(FILE)
+    assert take_outputs(tmp_path / 'output') == expected
@@ -0,0 +1,138 @@
+import ast
+import random
+
+import pandas as pd
+
+from conftest import write_csv
+
+FILE = 'orders_20240101000000.csv'
+
+
+def duplicate_input(source, rows=3000, seed=7):
+    """Write an input whose duplicate keys are spread over the whole file, so they span chunks."""
+    rng = random.Random(seed)
+    records = [[rng.randrange(rows // 2), f"name {i}", rng.choice(['a', 'b', 'c'])] for i in range(rows)]
+    return write_csv(source / FILE, ['id', 'name', 'kind'], records)
+
+
+def outputs(processor):
+    output = processor.file_manager.output_file_location
+    bad = pd.read_csv(f"{output}/orders_20240101000000.bad.csv", dtype=str)
+    clean = pd.read_csv(f"{output}/orders_20240101000000.out.csv", dtype=str)
+    metadata = pd.read_csv(f"{output}/orders_20240101000000.metadata.csv")
+    duplicate_rows = sorted(row for rows in metadata[metadata['Type_of_issue'] == 'duplicate']['Row_num_list']
+                            for row in ast.literal_eval(rows))
+    return sorted(map(tuple, bad.values)), sorted(map(tuple, clean.values)), duplicate_rows
+
+
+def test_chunked_reports_first_occurrences_like_in_memory(pipeline, tmp_path):
+    config = [(FILE, 'duplicate_check', 'id')]
+    in_memory = pipeline(config)
+    duplicate_input(tmp_path / 'source')
+    in_memory.process_file(FILE)
+    expected = outputs(in_memory)
+    assert expected[2], "the input should have duplicates"
+
+    for chunk_size in (2048, 16 * 1024):
+        chunked = pipeline(config, chunk_size=chunk_size, checkpoint_dir=tmp_path / f"checkpoints-{chunk_size}")
+        chunked.process_file_chunked(FILE)
+        assert outputs(chunked) == expected
+        assert chunked.result['bad_rows'] == in_memory.result['bad_rows']
+        assert chunked.result['issues'] == in_memory.result['issues']
+
+
+def test_chunked_spilled_keys_report_first_occurrences(pipeline, tmp_path):
+    config = [(FILE, 'duplicate_check', 'id')]
+    in_memory = pipeline(config)
+    duplicate_input(tmp_path / 'source')
+    in_memory.process_file(FILE)
+    expected = outputs(in_memory)
+
+    chunked = pipeline(config, chunk_size=4096, checkpoint_dir=tmp_path / 'checkpoints')
+    chunked.process_file_chunked(FILE, spill_keys=True)
+    assert outputs(chunked) == expected
+
+
+def test_parallel_chunks_report_first_occurrences(pipeline, tmp_path):
+    config = [(FILE, 'duplicate_check', 'id')]
+    in_memory = pipeline(config)
+    duplicate_input(tmp_path / 'source')
+    in_memory.process_file(FILE)
+    expected = outputs(in_memory)
+
+    parallel = pipeline(config, chunk_size=4096, workers=2, checkpoint_dir=tmp_path / 'checkpoints')
+    parallel.process_file_parallel(FILE)
+    assert outputs(parallel) == expected
+
+
+def mixed_input(source, rows=3000, seed=5):
+    """Write an input whose number columns have blanks in some chunks only, and values pandas would reformat."""
+    rng = random.Random(seed)
+    records = [[rng.randrange(rows // 2), rng.choice(['1', '2', '']) if i > rows // 2 else rng.choice(['1', '2']),
+                rng.choice(['1.50', '2.0', '007', '1e3']), f"name {i}"] for i in range(rows)]
+    return write_csv(source / FILE, ['id', 'age', 'score', 'name'], records)
+
+
+def output_bytes(processor):
+    """The clean records file as written, and the lines of the bad records file, which chunks write in another order."""
+    output = processor.file_manager.output_file_location
+    with open(f"{output}/orders_20240101000000.out.csv", 'rb') as f:
+        clean = f.read()
+    with open(f"{output}/orders_20240101000000.bad.csv", 'rb') as f:
+        header, *bad = f.read().splitlines()
+    return clean, header, sorted(bad)
+
+
+def test_chunked_and_parallel_outputs_are_the_in_memory_bytes(pipeline, tmp_path):
+    config = [(FILE, 'duplicate_check', 'id'), (FILE, 'null_check', 'age')]
+    in_memory = pipeline(config)
+    mixed_input(tmp_path / 'source')
+    in_memory.process_file(FILE)
+    expected = output_bytes(in_memory)
+    assert b'007' in expected[0] and b'1.50' in expected[0]
+
+    for chunk_size in (4096, 32 * 1024):
+        chunked = pipeline(config, chunk_size=chunk_size, checkpoint_dir=tmp_path / f"checkpoints-{chunk_size}")
+        chunked.process_file_chunked(FILE)
+        assert output_bytes(chunked) == expected
+    parallel = pipeline(config, chunk_size=4096, workers=2, checkpoint_dir=tmp_path / 'checkpoints-parallel')
+    parallel.process_file_parallel(FILE)
+    assert output_bytes(parallel) == expected
+
+
+def near_duplicate_input(source, rows=2000, seed=9):
+    """Write an input whose near-duplicate company names are far apart in the file, along with exact duplicate ids."""
+    rng = random.Random(seed)
+    names = [' '.join(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(8)) for _ in range(4))
+             for _ in range(rows)]
+    for i in rng.sample(range(rows // 2), 40):
+        names[i + rows // 2] = names[i].upper().replace(' ', ', ', 1) + '.'
+    records = [[rng.randrange(rows), name] for name in names]
+    return write_csv(source / FILE, ['id', 'company'], records)
+
+
+def issue_rows(processor, issue):
+    output = processor.file_manager.output_file_location
+    metadata = pd.read_csv(f"{output}/orders_20240101000000.metadata.csv")
+    return sorted(row for rows in metadata[metadata['Type_of_issue'] == issue]['Row_num_list']
+                  for row in ast.literal_eval(rows))
+
+
+def test_near_duplicates_are_found_across_chunks(pipeline, tmp_path):
+    config = [(FILE, 'duplicate_check', 'id'), (FILE, 'fuzzy_duplicate_check', 'company')]
+    in_memory = pipeline(config)
+    near_duplicate_input(tmp_path / 'source')
+    in_memory.process_file(FILE)
+    expected = output_bytes(in_memory)
+    assert len(issue_rows(in_memory, 'fuzzy_duplicate')) >= 20
+
+    chunked = pipeline(config, chunk_size=8192, checkpoint_dir=tmp_path / 'checkpoints')
+    chunked.process_file_chunked(FILE)
+    parallel = pipeline(config, chunk_size=32 * 1024, workers=2, checkpoint_dir=tmp_path / 'checkpoints-parallel')
+    parallel.process_file_parallel(FILE)
+    for processor in (chunked, parallel):
+        assert output_bytes(processor) == expected
+        for issue in ('duplicate', 'fuzzy_duplicate'):
+            assert issue_rows(processor, issue) == issue_rows(in_memory, issue)
+        for count in ('clean_rows', 'bad_rows', 'issues'):
+            assert processor.result[count] == in_memory.result[count]
@@ -0,0 +1,80 @@
+import csv
+import multiprocessing
+
+from conftest import write_csv
+from dataset import PartitionedDataset, file_partition
+
+
+def add_files(root, worker, files, target_bytes):
+    """Add files clean outputs of 5 rows each to the dataset, as one worker process would."""
+    dataset = PartitionedDataset(root, target_bytes)
+    for i in range(files):
+        day = 1 + i % 3
+        present_file = f"orders_202401{day:02d}{worker:02d}{i:04d}.csv"
+        clean_path = write_csv(root.parent / f"{present_file}.out.csv", ['id', 'worker'],
+                               [[f"{worker}-{i}-{row}", worker] for row in range(5)])
+        dataset.add(present_file, clean_path, 5)
+
+
+def compact_repeatedly(root, target_bytes, passes):
+    dataset = PartitionedDataset(root, target_bytes)
+    for _ in range(passes):
+        dataset.compact()
+
+
+def run_processes(*targets):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=target, args=args) for target, args in targets]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+
+def stored_ids(root):
+    """Ids of all rows in the data files listed in the manifest, checking each file's listed row count."""
+    ids = []
+    for name, entry in PartitionedDataset(root).load_manifest()['files'].items():
+        with open(root / name, newline='') as f:
+            rows = [row['id'] for row in csv.DictReader(f)]
+        assert len(rows) == entry['rows']
+        ids.extend(rows)
+    return ids
+
+
+def test_file_partition():
+    assert file_partition('orders_20240131120000.csv') == ('orders', '2024-01-31')
+    assert file_partition('orders_20241399000000.csv') == ('orders', 'unknown')
+
+
+def test_concurrent_adds_keep_every_partition(tmp_path):
+    root = tmp_path / 'dataset'
+    run_processes((add_files, (root, 1, 20, 1 << 20)), (add_files, (root, 2, 20, 1 << 20)))
+
+    manifest = PartitionedDataset(root).load_manifest()
+    assert len(manifest['files']) == 40
+    assert {entry['date'] for entry in manifest['files'].values()} == {'2024-01-01', '2024-01-02', '2024-01-03'}
+    ids = stored_ids(root)
+    assert len(ids) == len(set(ids)) == 200
+
+
+def test_compaction_during_adds_loses_no_rows(tmp_path):
+    root = tmp_path / 'dataset'
+    run_processes((add_files, (root, 1, 20, 1 << 20)), (add_files, (root, 2, 20, 1 << 20)),
+                  (compact_repeatedly, (root, 1 << 20, 10)))
+    PartitionedDataset(root, 1 << 20).compact()
+
+    ids = stored_ids(root)
+    assert len(ids) == len(set(ids)) == 200
+    listed = set(PartitionedDataset(root).load_manifest()['files'])
+    assert {path.relative_to(root).as_posix() for path in root.glob('family=*/date=*/*')} == listed
+    assert len(listed) == 3
+
+
+def test_adding_a_compacted_file_again_is_dropped(tmp_path):
+    root = tmp_path / 'dataset'
+    add_files(root, 1, 2, 1 << 20)
+    PartitionedDataset(root).compact()
+    add_files(root, 1, 2, 1 << 20)
+    assert len(stored_ids(root)) == 10
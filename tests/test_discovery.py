@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+from conftest import write_csv
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """A FileManager over an empty source directory, with a cache directory and a registry of scanned files."""
+    from dqm3 import FileManager
+    (tmp_path / 'source').mkdir()
+    write_csv(tmp_path / 'scanned.csv', ['files_scanned'], [['orders_20240101000000.csv']])
+    return FileManager(str(tmp_path / 'source'), str(tmp_path / 'scanned.csv'), str(tmp_path / 'output'),
+                       cache_dir=str(tmp_path / 'cache'))
+
+
+def age_directory(path, seconds=3600):
+    """Set the mtime of a directory back, as if it had last changed a while ago."""
+    then = time.time_ns() - seconds * 10 ** 9
+    os.utime(path, ns=(then, then))
+
+
+def test_new_input_files_with_records_are_found(manager, tmp_path):
+    source = tmp_path / 'source'
+    write_csv(source / 'orders_20240101000000.csv', ['id'], [[1]])
+    write_csv(source / 'orders_20240102000000.csv', ['id'], [[1]])
+    write_csv(source / 'orders_20240103000000.tsv', ['id'], [[1]])
+    (source / 'orders_20240104000000.csv').write_text('')
+    (source / 'notes.txt').write_text('id\n1\n')
+    (source / 'orders_20240105000000.csv').mkdir()
+    assert sorted(manager.get_files_to_process()) == ['orders_20240102000000.csv', 'orders_20240103000000.tsv']
+
+    manager.families = {'customers_'}
+    assert manager.get_files_to_process() == []
+
+
+def test_new_file_invalidates_an_empty_poll(manager, tmp_path):
+    source = tmp_path / 'source'
+    (source / 'orders_20240102000000.csv').write_text('')
+    age_directory(source)
+    assert manager.get_files_to_process() == []
+    assert manager.nothing_new()
+
+    write_csv(source / 'orders_20240103000000.csv', ['id'], [[1]])
+    assert not manager.nothing_new()
+    assert manager.get_files_to_process() == ['orders_20240103000000.csv']
+
+    # Records written into a file skipped as empty are found too, though the directory did not change.
+    age_directory(source)
+    (source / 'orders_20240103000000.csv').unlink()
+    age_directory(source)
+    assert manager.get_files_to_process() == []
+    write_csv(source / 'orders_20240102000000.csv', ['id'], [[1]])
+    assert manager.get_files_to_process() == ['orders_20240102000000.csv']
+
+
+def test_new_registry_entries_invalidate_an_empty_poll(manager, tmp_path):
+    source = tmp_path / 'source'
+    write_csv(source / 'orders_20240102000000.csv', ['id'], [[1]])
+    age_directory(source)
+    assert manager.get_files_to_process() == ['orders_20240102000000.csv']
+    write_csv(tmp_path / 'scanned.csv', ['files_scanned'], [['orders_20240101000000.csv'], ['orders_20240102000000.csv']])
+    assert manager.get_files_to_process() == []
+    assert manager.nothing_new()
+
+    write_csv(tmp_path / 'scanned.csv', ['files_scanned'], [['orders_20240101000000.csv']])
+    assert manager.get_files_to_process() == ['orders_20240102000000.csv']
+
+
+def test_file_added_in_the_tick_of_an_empty_poll_is_found(manager, tmp_path):
+    source = tmp_path / 'source'
+    assert manager.get_files_to_process() == []
+    stat = source.stat()
+    write_csv(source / 'orders_20240102000000.csv', ['id'], [[1]])
+    # A coarse clock gives the directory the same mtime it had when the poll looked at it.
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert manager.get_files_to_process() == ['orders_20240102000000.csv']
@@ -0,0 +1,58 @@
+import json
+import random
+
+import pandas as pd
+import pytest
+
+from conftest import write_csv
+from engines import ENGINES
+
+
+def engine_input(source, present_file, rows=1500, seed=11):
+    """Write records with duplicate ids, blank and malformed numbers, text that looks numeric and phone numbers."""
+    rng = random.Random(seed)
+    records = [{'id': rng.randrange(rows // 2),
+                'age': rng.choice(['31', '', '4.5', 'n/a']),
+                'code': rng.choice(['007', '1e3', '1.50', '12']),
+                'phone': rng.choice(['9845012345', '080 42297555 41714161', '', 'unknown']),
+                'name': f"name {i}, \"quoted\""} for i in range(rows)]
+    if present_file.endswith('.csv'):
+        write_csv(source / present_file, list(records[0]), [list(record.values()) for record in records])
+    else:
+        source.mkdir(parents=True, exist_ok=True)
+        (source / present_file).write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+
+def output_files(processor, present_file):
+    output = processor.file_manager.output_file_location
+    stem = present_file.rsplit('.', 1)[0]
+    return {kind: open(f"{output}/{stem}.{kind}.csv", 'rb').read() for kind in ('out', 'bad', 'metadata')}
+
+
+@pytest.mark.parametrize('present_file', ['orders_20240101000000.csv', 'orders_20240101000000.jsonl'])
+def test_arrow_writes_the_bytes_pandas_writes(pipeline, tmp_path, present_file):
+    pytest.importorskip('pyarrow')
+    config = [(present_file, 'duplicate_check', 'id'), (present_file, 'type_check', 'age'),
+              (present_file, 'phonenumber_e164_check', 'phone')]
+    engine_input(tmp_path / 'source', present_file)
+    outputs = {}
+    for name in sorted(ENGINES):
+        processor = pipeline(config, [('age', 'int')], engine=ENGINES[name]())
+        processor.process_one(present_file)
+        outputs[name] = output_files(processor, present_file)
+    assert b'007' in outputs['pandas']['out'] and b'1.50' in outputs['pandas']['out']
+    assert outputs['arrow'] == outputs['pandas']
+
+
+def test_pandas_writes_values_as_read(pipeline, tmp_path):
+    present_file = 'orders_20240101000000.csv'
+    rows = [[1, '1.50', '007'], [2, '', '1e3'], [3, '12', '']]
+    path = write_csv(tmp_path / 'source' / present_file, ['id', 'amount', 'code'], rows)
+    processor = pipeline([(present_file, 'duplicate_check', 'id')])
+    processor.process_one(present_file)
+
+    written = (tmp_path / 'output' / 'orders_20240101000000.out.csv').read_text()
+    assert written == 'id,amount,code\n1,1.50,007\n2,,1e3\n3,12,\n'
+    # Before values were read as text, pandas inferred numbers and wrote them back in its own form.
+    inferred = pd.read_csv(path).to_csv(index=False, lineterminator='\n')
+    assert inferred == 'id,amount,code\n1,1.5,7.0\n2,,1000.0\n3,12.0,\n'
@@ -0,0 +1,37 @@
+import random
+
+import pytest
+
+from conftest import write_csv
+
+FILE = 'orders_20240101000000.csv'
+
+
+def paired_rows(rows, shuffle, seed=3):
+    """Rows of which half share their id with exactly one other row, next to it unless shuffled."""
+    ids = [i // 2 for i in range(rows // 2)] + list(range(rows, rows + rows // 2))
+    if shuffle:
+        random.Random(seed).shuffle(ids)
+    return [[key, f"customer {i:06d}", 'x' * 20] for i, key in enumerate(ids)]
+
+
+@pytest.mark.parametrize('shuffle', [False, True], ids=['clustered', 'spread'])
+def test_duplicate_estimate_is_close_for_clustered_and_spread_files(pipeline, tmp_path, shuffle):
+    processor = pipeline([(FILE, 'duplicate_check', 'id')])
+    write_csv(tmp_path / 'source' / FILE, ['id', 'name', 'note'], paired_rows(60000, shuffle))
+
+    report = processor.estimate_file(FILE, blocks=48, block_bytes=16 * 1024, seed=11)
+    assert report['sampled_fraction'] < 0.3
+    assert report['duplicate']['rate'] == pytest.approx(0.5, abs=0.1)
+    low, high = report['duplicate']['ci95']
+    assert low <= report['duplicate']['rate'] <= high
+
+
+def test_phone_estimate_is_quiet_and_matches_the_legacy_check(pipeline, tmp_path, capfd):
+    processor = pipeline([(FILE, 'phonenumber_check', 'phone')])
+    phones = ['9845012345', '080 42297555', 'unknown', '9845012345 080 42297555']
+    write_csv(tmp_path / 'source' / FILE, ['id', 'phone'], [[i, phones[i % 4]] for i in range(40000)])
+
+    report = processor.estimate_file(FILE, blocks=16, block_bytes=16 * 1024, seed=5)
+    assert report['unparseable_phone']['rate'] == pytest.approx(0.25, abs=0.05)
+    assert capfd.readouterr().out == ''
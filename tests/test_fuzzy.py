@@ -0,0 +1,51 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from fuzzy import NUM_PERM, BANDS, candidate_pairs, near_duplicate_groups, normalize_keys
+
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+
+def signatures_with_bucket(size, keys=None):
+    """Signatures of keys that differ in every band except the first, where the first size keys collide."""
+    keys = keys or size
+    signatures = np.arange(keys * NUM_PERM, dtype=np.uint64).reshape(keys, NUM_PERM) + np.uint64(1000)
+    signatures[:size, :ROWS_PER_BAND] = 7
+    return signatures
+
+
+def pair_set(left, right):
+    return {(min(a, b), max(a, b)) for a, b in zip(left.tolist(), right.tolist())}
+
+
+def test_every_pair_in_a_bucket_is_a_candidate():
+    left, right = candidate_pairs(signatures_with_bucket(6, keys=9))
+    assert pair_set(left, right) == {(a, b) for a in range(6) for b in range(a + 1, 6)}
+
+
+def test_oversized_bucket_is_sampled_and_logged(caplog):
+    with caplog.at_level(logging.WARNING):
+        left, right = candidate_pairs(signatures_with_bucket(50), max_bucket=10)
+    pairs = pair_set(left, right)
+    assert len(pairs) <= 50 * 9
+    assert all(a != b for a, b in pairs)
+    assert {key for pair in pairs for key in pair} == set(range(50))
+    assert 'hold more than 10 keys' in caplog.text
+
+
+def test_no_candidates_without_shared_buckets():
+    left, right = candidate_pairs(signatures_with_bucket(1, keys=5))
+    assert len(left) == len(right) == 0
+
+
+def test_normalized_keys_and_near_duplicates_share_a_group():
+    frame = pd.DataFrame({'site': ['https://www.acme.com/', 'acme.com', 'ACME.COM', 'globex.org', None,
+                                   'initech corporation of north america limited',
+                                   'initech corporation of north america limitd']})
+    groups = near_duplicate_groups(normalize_keys(frame, ['site']))
+    assert groups[0] == groups[1] == groups[2]
+    assert groups[3] not in (groups[0], groups[5])
+    assert groups[5] == groups[6]
+    assert groups[4] not in set(np.delete(groups, 4))
@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import threading
+
+import pytest
+
+from conftest import write_csv
+from engines import PandasEngine
+from governor import MemoryGovernor, parse_size
+from readers import sniff
+
+
+@pytest.mark.parametrize('text, size', [('512', 512), ('4K', 4096), ('1.5G', 3 << 29), ('2GiB', 2 << 30),
+                                        (' 10 mb', 10 << 20)])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+@pytest.mark.parametrize('text', ['', 'G', '4X', '-1M'])
+def test_parse_size_rejects_other_text(text):
+    with pytest.raises(ValueError):
+        parse_size(text)
+
+
+@pytest.fixture
+def big_file(tmp_path):
+    return write_csv(tmp_path / 'orders.csv', ['id', 'name', 'note'],
+                     [[i, f"customer {i}", 'x' * 40] for i in range(20000)])
+
+
+def test_plan_fits_the_budget(tmp_path, big_file):
+    size = os.path.getsize(big_file)
+    assert MemoryGovernor(size * 1000, tmp_path / 'memory').plan(big_file, PandasEngine())['strategy'] == 'memory'
+
+    plan = MemoryGovernor(size, tmp_path / 'memory').plan(big_file, PandasEngine())
+    assert plan['strategy'] in ('chunked', 'spilled')
+    assert plan['reserve'] <= size
+
+
+def test_unsplittable_file_over_budget_reserves_the_whole_budget(pipeline, tmp_path, caplog):
+    present_file = 'orders_20240101000000.jsonl'
+    path = tmp_path / 'source' / present_file
+    path.parent.mkdir()
+    path.write_text(''.join(json.dumps({'id': i % 15000, 'note': 'x' * 40}) + '\n' for i in range(20000)))
+    governor = MemoryGovernor(os.path.getsize(path), tmp_path / 'memory')
+
+    plan = governor.plan(path, PandasEngine(), input_format=sniff(path))
+    assert plan['strategy'] == 'memory' and plan['reserve'] == governor.budget
+    assert 'cannot be processed in chunks' in caplog.text
+
+    processor = pipeline([(present_file, 'duplicate_check', 'id')], governor=governor)
+    processor.process_one(present_file)
+    assert processor.result['rows'] == 20000 and processor.result['bad_rows'] == 10000
+    assert governor.reserved_bytes() == 0
+
+
+def test_reservation_waits_for_room(tmp_path):
+    governor = MemoryGovernor(100, tmp_path)
+    held, released = threading.Event(), []
+
+    def hold():
+        with governor.reserve(60, 'first'):
+            held.set()
+            time.sleep(0.5)
+            released.append(time.time())
+    first = threading.Thread(target=hold)
+    first.start()
+    held.wait(10)
+    with governor.reserve(60, 'second'):
+        assert released and time.time() >= released[0]
+        assert governor.reserved_bytes() == 60
+    first.join()
+    assert governor.reserved_bytes() == 0
+
+
+def test_stale_reservations_are_removed(tmp_path):
+    governor = MemoryGovernor(100, tmp_path, ttl=60)
+    for name, nbytes in (('live.json', 10), ('dead.json', 50)):
+        (tmp_path / name).write_text(json.dumps({'bytes': nbytes, 'file': name}))
+    old = time.time() - 1000
+    os.utime(tmp_path / 'dead.json', (old, old))
+    assert governor.reserved_bytes() == 10
+    assert sorted(path.name for path in tmp_path.glob('*.json')) == ['live.json']
@@ -0,0 +1,161 @@
+import os
+import time
+import multiprocessing
+
+import pytest
+
+from conftest import write_csv
+from leases import LeaseManager, lock_file
+
+FILE = 'orders_20240101000000.csv'
+
+
+def claim_in_process(lease_dir, worker_id, file, start, results):
+    """Claim file in a worker process once start is set, and exit without releasing what it claimed."""
+    start.wait()
+    results.put((worker_id, LeaseManager(lease_dir, worker_id).claim(file)))
+
+
+def claim_concurrently(lease_dir, worker_ids, file=FILE):
+    """Let a worker process per id claim file at the same moment; returns {worker id: claimed}."""
+    context = multiprocessing.get_context('spawn')
+    start, results = context.Event(), context.Queue()
+    workers = [context.Process(target=claim_in_process, args=(str(lease_dir), worker_id, file, start, results))
+               for worker_id in worker_ids]
+    for worker in workers:
+        worker.start()
+    start.set()
+    claimed = dict(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join(60)
+    return claimed
+
+
+def count_under_lock(lock, counter, times, stale_after, hold):
+    """Increment the number in counter times over, each time under lock_file and holding it for hold seconds."""
+    for _ in range(times):
+        with lock_file(lock, stale_after):
+            value = int(counter.read_text())
+            time.sleep(hold)
+            counter.write_text(str(value + 1))
+
+
+def count_concurrently(tmp_path, workers=4, times=10, stale_after=60, hold=0.0):
+    """Let worker processes count under one lock; returns the final count."""
+    counter = tmp_path / 'counter'
+    counter.write_text('0')
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=count_under_lock,
+                                 args=(tmp_path / '.lock', counter, times, stale_after, hold))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+    return int(counter.read_text())
+
+
+def age(lease_dir, file=FILE, seconds=1000):
+    """Make the lease on file look as if its holder stopped heartbeating seconds ago."""
+    old = time.time() - seconds
+    os.utime(lease_dir / f"{file}.lease", (old, old))
+
+
+def test_only_one_worker_claims_a_file(tmp_path):
+    claimed = claim_concurrently(tmp_path, [f"worker-{i}" for i in range(4)])
+    assert sorted(claimed.values()) == [False, False, False, True]
+
+
+def test_live_lease_is_not_taken_over(tmp_path):
+    claim_concurrently(tmp_path, ['dead'])
+    assert not LeaseManager(tmp_path, 'other', ttl=60).claim(FILE)
+
+
+def test_stale_lease_is_taken_over_by_one_worker(tmp_path):
+    claim_concurrently(tmp_path, ['dead'])
+    age(tmp_path)
+    claimed = claim_concurrently(tmp_path, [f"worker-{i}" for i in range(4)])
+    assert sorted(claimed.values()) == [False, False, False, True]
+    assert not list(tmp_path.glob('*.stale'))
+
+
+def test_release_keeps_a_lease_taken_over_by_a_worker_with_the_same_id(tmp_path):
+    leases = LeaseManager(tmp_path, 'worker', ttl=60)
+    assert leases.claim(FILE)
+    age(tmp_path)
+    # The same worker id restarted on another process and took the stale lease over.
+    assert claim_concurrently(tmp_path, ['worker']) == {'worker': True}
+    taken_over = LeaseManager.lease_token(tmp_path / f"{FILE}.lease")
+
+    assert not leases.holds(FILE)
+    leases.release(FILE)
+    assert LeaseManager.lease_token(tmp_path / f"{FILE}.lease") == taken_over
+    assert not list(tmp_path.glob('*.released'))
+
+
+def test_heartbeat_does_not_refresh_a_lease_taken_over(tmp_path):
+    leases = LeaseManager(tmp_path, 'worker', ttl=60)
+    assert leases.claim(FILE)
+    age(tmp_path)
+    assert claim_concurrently(tmp_path, ['other']) == {'other': True}
+    age(tmp_path, seconds=30)
+    before = (tmp_path / f"{FILE}.lease").stat().st_mtime
+
+    leases.heartbeat()
+    assert (tmp_path / f"{FILE}.lease").stat().st_mtime == before
+    assert FILE not in leases.held
+
+
+def test_complete_marks_the_file_done(tmp_path):
+    leases = LeaseManager(tmp_path, 'worker')
+    assert leases.claim(FILE)
+    assert leases.refresh(FILE, leases.held[FILE])
+    leases.complete(FILE)
+    assert not (tmp_path / f"{FILE}.lease").exists()
+    assert claim_concurrently(tmp_path, ['other']) == {'other': False}
+
+
+def test_in_memory_outputs_are_not_published_after_the_lease_is_lost(pipeline, tmp_path):
+    lease_dir = tmp_path / 'leases'
+    leases = LeaseManager(lease_dir, 'worker', ttl=60)
+    processor = pipeline([(FILE, 'duplicate_check', 'id')], leases=leases)
+    write_csv(tmp_path / 'source' / FILE, ['id', 'name'], [[1, 'a'], [1, 'b'], [2, 'c']])
+    assert leases.claim(FILE)
+    age(lease_dir)
+    assert claim_concurrently(lease_dir, ['other']) == {'other': True}
+
+    processor.process_one(FILE)
+    assert processor.result is None
+    assert not list((tmp_path / 'output').iterdir())
+
+
+@pytest.mark.parametrize('chunk_size', [None, 16])
+def test_outputs_are_published_while_the_lease_is_held(pipeline, tmp_path, chunk_size):
+    leases = LeaseManager(tmp_path / 'leases', 'worker')
+    processor = pipeline([(FILE, 'duplicate_check', 'id')], leases=leases, chunk_size=chunk_size)
+    write_csv(tmp_path / 'source' / FILE, ['id', 'name'], [[1, 'a'], [1, 'b'], [2, 'c']])
+    assert leases.claim(FILE)
+    processor.process_one(FILE)
+    assert processor.result['bad_rows'] == 2
+
+
+def test_lock_file_excludes_other_processes(tmp_path):
+    assert count_concurrently(tmp_path) == 40
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['counter']
+
+
+def test_lock_held_longer_than_stale_after_is_not_broken(tmp_path):
+    # Every holder keeps the lock for 3 times stale_after; its heartbeat must keep the others out.
+    assert count_concurrently(tmp_path, workers=2, times=1, stale_after=0.3, hold=0.9) == 2
+
+
+def test_lock_of_a_dead_holder_is_broken(tmp_path, caplog):
+    lock = tmp_path / '.lock'
+    lock.write_text('{"worker": "dead", "token": "x"}')
+    old = time.time() - 1000
+    os.utime(lock, (old, old))
+    with lock_file(lock, stale_after=60):
+        assert LeaseManager.lease_token(lock) != 'x'
+    assert not lock.exists()
+    assert 'Recovered stale lease on .lock from worker dead' in caplog.text
@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from conftest import write_csv
+from engines import ENGINES
+from lookup import lookup_values, parse_lookup_spec
+
+ROWS = [[1, '007'], [2, ''], [3, '12'], [4, '7'], [5, '99']]
+
+
+def rejected_ids(tmp_path, present_file):
+    bad = tmp_path / 'output' / f"{present_file.rsplit('.', 1)[0]}.bad.csv"
+    return sorted(pd.read_csv(bad)['id'].tolist()) if bad.exists() else []
+
+
+def test_parse_lookup_spec(tmp_path):
+    assert parse_lookup_spec('code = ref/codes.csv[value]', tmp_path) == ('code', tmp_path / 'ref/codes.csv', 'value')
+    assert parse_lookup_spec('code=codes.csv') == ('code', Path('codes.csv'), 'code')
+    with pytest.raises(ValueError):
+        parse_lookup_spec('codes.csv')
+
+
+def test_whole_floats_of_json_numbers_lose_their_fraction():
+    present, values = lookup_values(pd.Series([12.0, None, 7.0]))
+    assert present.tolist() == [True, False, True]
+    assert values.tolist() == ['12', '7']
+
+
+@pytest.mark.parametrize('engine_name', sorted(ENGINES))
+def test_codes_are_looked_up_as_written(pipeline, tmp_path, engine_name):
+    if engine_name == 'arrow':
+        pytest.importorskip('pyarrow')
+    write_csv(tmp_path / 'codes.csv', ['code'], [['007'], ['12']])
+    processor = pipeline([('orders_20240101000000.csv', 'lookup_check', 'code=codes.csv')],
+                         engine=ENGINES[engine_name]())
+    write_csv(tmp_path / 'source' / 'orders_20240101000000.csv', ['id', 'code'], ROWS)
+    processor.process_one('orders_20240101000000.csv')
+
+    assert rejected_ids(tmp_path, 'orders_20240101000000.csv') == [4, 5]
+    clean = pd.read_csv(tmp_path / 'output' / 'orders_20240101000000.out.csv', dtype=str)
+    assert clean['code'].fillna('').tolist() == ['007', '', '12']
+
+
+def test_json_codes_are_not_converted_to_numbers(pipeline, tmp_path):
+    write_csv(tmp_path / 'codes.csv', ['code'], [['007'], ['12']])
+    processor = pipeline([('orders_20240101000000.jsonl', 'lookup_check', 'code=codes.csv')])
+    records = [{'id': 1, 'code': '007'}, {'id': 2, 'code': None}, {'id': 3, 'code': 12}, {'id': 4, 'code': '7'}]
+    (tmp_path / 'source' / 'orders_20240101000000.jsonl').write_text(''.join(json.dumps(r) + '\n' for r in records))
+    processor.process_one('orders_20240101000000.jsonl')
+
+    assert rejected_ids(tmp_path, 'orders_20240101000000.jsonl') == [4]
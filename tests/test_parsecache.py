@@ -0,0 +1,97 @@
+import json
+import logging
+import random
+
+import pytest
+
+from conftest import write_csv
+from engines import ENGINES
+
+pytest.importorskip('pyarrow')
+
+CHECKS = [('duplicate_check', 'id'), ('type_check', 'age'), ('phonenumber_e164_check', 'phone')]
+
+
+def write_input(path, rows=400, seed=19):
+    """Write records with blanks in every column, text that looks numeric and repeated ids."""
+    rng = random.Random(seed)
+    records = [{'id': rng.randrange(rows // 2), 'age': rng.choice(['31', '', 'x']),
+                'code': rng.choice(['007', '1.50', '']), 'phone': rng.choice(['9845012345', '', 'n/a'])}
+               for _ in range(rows)]
+    if path.suffix == '.csv':
+        write_csv(path, list(records[0]), [list(record.values()) for record in records])
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+
+def take_outputs(output):
+    """Return the bytes of every output file by name and remove them."""
+    outputs = {}
+    for path in sorted(output.glob('*.csv')):
+        outputs[path.name] = path.read_bytes()
+        path.unlink()
+    return outputs
+
+
+@pytest.mark.parametrize('engine_name', sorted(ENGINES))
+@pytest.mark.parametrize('present_file', ['orders_20240101000000.csv', 'orders_20240101000000.jsonl'])
+def test_cached_parse_writes_the_bytes_of_a_fresh_parse(pipeline, tmp_path, caplog, engine_name, present_file):
+    from parsecache import ParseCache
+    config = [(present_file, test, attribute) for test, attribute in CHECKS]
+    write_input(tmp_path / 'source' / present_file)
+    fresh = pipeline(config, [('age', 'int')], engine=ENGINES[engine_name]())
+    fresh.process_one(present_file)
+    expected = take_outputs(tmp_path / 'output')
+    assert any(name.endswith('.bad.csv') for name in expected)
+
+    cache = ParseCache(tmp_path / 'parse-cache')
+    for _ in range(2):
+        with caplog.at_level(logging.INFO):
+            cached = pipeline(config, [('age', 'int')], engine=ENGINES[engine_name](), parse_cache=cache)
+            cached.process_one(present_file)
+        assert take_outputs(tmp_path / 'output') == expected
+    assert 'from the parse cache' in caplog.text
+
+
+def test_changed_file_is_parsed_again(pipeline, tmp_path):
+    from parsecache import ParseCache
+    present_file = 'orders_20240101000000.csv'
+    cache = ParseCache(tmp_path / 'parse-cache')
+    write_input(tmp_path / 'source' / present_file)
+    pipeline([], parse_cache=cache).process_one(present_file)
+
+    write_input(tmp_path / 'source' / present_file, rows=300, seed=23)
+    fresh = pipeline([])
+    fresh.process_one(present_file)
+    expected = take_outputs(tmp_path / 'output')
+    pipeline([], parse_cache=cache).process_one(present_file)
+    assert take_outputs(tmp_path / 'output') == expected
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_chunks_are_cached_by_byte_range(pipeline, tmp_path, caplog, workers):
+    from parsecache import ParseCache
+    present_file = 'orders_20240101000000.csv'
+    config = [(present_file, test, attribute) for test, attribute in CHECKS]
+    write_input(tmp_path / 'source' / present_file, rows=2000)
+    fresh = pipeline(config, [('age', 'int')], chunk_size=4096, workers=workers,
+                     checkpoint_dir=tmp_path / 'checkpoints')
+    fresh.process_one(present_file)
+    expected = take_outputs(tmp_path / 'output')
+
+    cache = ParseCache(tmp_path / 'parse-cache')
+    sidecars = []
+    for run in range(2):
+        caplog.clear()
+        chunked = pipeline(config, [('age', 'int')], chunk_size=4096, workers=workers, parse_cache=cache,
+                           checkpoint_dir=tmp_path / f"checkpoints-{run}")
+        with caplog.at_level(logging.INFO):
+            chunked.process_one(present_file)
+        assert take_outputs(tmp_path / 'output') == expected
+        sidecars.append(sorted((tmp_path / 'parse-cache').glob('*.arrow')))
+    # One sidecar per chunk, stored by the first run and all found by the second.
+    assert len(sidecars[0]) > 1 and sidecars[1] == sidecars[0]
+    if workers == 1:
+        # Workers log their hits in their own processes.
+        assert caplog.text.count('from the parse cache') == len(sidecars[0])
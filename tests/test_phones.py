@@ -0,0 +1,92 @@
+import json
+import pandas as pd
+import pytest
+
+from conftest import write_csv
+from phones import MISSING, legacy_phone_numbers, normalize_phone_numbers
+
+
+def normalized(values, region='IN'):
+    first, second = normalize_phone_numbers(pd.Series(values, dtype=object), region)
+    return list(zip(first, second))
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('+91 98450 12345', ('+919845012345', MISSING)),
+    ('0091-9845012345', ('+919845012345', MISSING)),
+    ('9845012345', ('+919845012345', MISSING)),
+    ('098450 12345', ('+919845012345', MISSING)),
+    ('(080) 4229.7555', ('+918042297555', MISSING)),
+    ('+44 20 7946 0958', ('+442079460958', MISSING)),
+    ('080 42297555 41714161', ('+918042297555', '+918041714161')),
+    ('080-42297555, 9845012345', ('+918042297555', '+919845012345')),
+    ('+1 (415) 555-0100 / +91 9845012345', ('+14155550100', '+919845012345')),
+])
+def test_numbers_are_written_in_e164(value, expected):
+    assert normalized([value]) == [expected]
+
+
+def test_nulls_and_values_without_a_number_are_missing():
+    assert normalized([None, 'abc', '12345', float('nan')]) == [(MISSING, MISSING)] * 4
+
+
+def test_repeated_values_keep_their_rows():
+    values = ['9845012345', None, '9845012345', '+44 20 7946 0958']
+    first, _ = normalize_phone_numbers(pd.Series(values, index=[10, 11, 12, 13], dtype=object))
+    assert first.index.tolist() == [10, 11, 12, 13]
+    assert first.tolist() == ['+919845012345', MISSING, '+919845012345', '+442079460958']
+
+
+def test_national_numbers_take_the_region_code():
+    assert normalized(['020 7946 0958'], 'GB') == [('+442079460958', MISSING)]
+    assert normalized(['(415) 555-0100'], 'US') == [('+14155550100', MISSING)]
+
+
+def test_unknown_region_is_rejected():
+    with pytest.raises(ValueError, match='unknown phone region'):
+        normalize_phone_numbers(pd.Series(['9845012345']), 'XX')
+
+
+def test_phone_number_normalization_check(pipeline, tmp_path):
+    processor = pipeline([('contacts_20240101000000.csv', 'phonenumber_e164_check', 'phone')])
+    write_csv(tmp_path / 'source' / 'contacts_20240101000000.csv', ['id', 'phone'],
+              [[1, '+91 98450 12345'], [2, '080 42297555 41714161'], [3, '']])
+    processor.process_one('contacts_20240101000000.csv')
+
+    clean = pd.read_csv(tmp_path / 'output' / 'contacts_20240101000000.out.csv', dtype=str, keep_default_na=False)
+    assert 'phone' not in clean.columns
+    assert clean['contact number 1'].tolist() == ['+919845012345', '+918042297555', MISSING]
+    assert clean['contact number 2'].tolist() == [MISSING, '+918041714161', MISSING]
+
+
+def test_legacy_rules_match_clean_phonenumber(pipeline, capsys):
+    values = ['9845012345', '080 42297555', '080 42297555 41714161', '9845012345 080 42297555',
+              '9845012345 9845012346', '98450.12345', 'unknown', '', None, '9845012345 080 42297555 41714161']
+    processor = pipeline([])
+    processor.clean_records = pd.DataFrame({'phone': pd.Series(values, dtype=object)})
+    processor.clean_phonenumber('contacts_20240101000000.csv', ['phone'])
+    capsys.readouterr()
+
+    first, second = legacy_phone_numbers(pd.Series(values, dtype=object))
+    assert first.tolist() == processor.clean_records['contact number 1'].tolist()
+    assert second.tolist() == processor.clean_records['contact number 2'].tolist()
+    assert capsys.readouterr().out == ''
+
+
+@pytest.mark.parametrize('engine_name, suffix', [('pandas', 'csv'), ('pandas', 'jsonl'), ('arrow', 'csv'), ('arrow', 'jsonl')])
+def test_numeric_phone_column_with_a_blank(pipeline, tmp_path, engine_name, suffix):
+    if engine_name == 'arrow':
+        pytest.importorskip('pyarrow')
+    from engines import ENGINES
+    present_file = f"contacts_20240101000000.{suffix}"
+    processor = pipeline([(present_file, 'phonenumber_e164_check', 'phone')], engine=ENGINES[engine_name]())
+    rows = [[1, 9845012345], [2, None], [3, 9900112233]]
+    if suffix == 'csv':
+        write_csv(tmp_path / 'source' / present_file, ['id', 'phone'], rows)
+    else:
+        (tmp_path / 'source' / present_file).write_text(
+            ''.join(json.dumps({'id': id, 'phone': phone}) + '\n' for id, phone in rows))
+    processor.process_one(present_file)
+
+    clean = pd.read_csv(tmp_path / 'output' / 'contacts_20240101000000.out.csv', dtype=str, keep_default_na=False)
+    assert clean['contact number 1'].tolist() == ['+919845012345', MISSING, '+919900112233']
@@ -0,0 +1,65 @@
+import io
+import logging
+
+import pytest
+
+from conftest import write_csv
+from engines import PandasEngine
+from readers import is_input_file, sniff
+
+
+def sniffed(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return sniff(path)
+
+
+def test_csv_starting_with_a_brace_is_delimited(tmp_path):
+    input_format = sniffed(tmp_path, 'orders_20240101000000.csv', '{id},name\n1,a\n2,b\n')
+    assert (input_format.kind, input_format.delimiter) == ('delimited', ',')
+    assert list(input_format.read(PandasEngine(), tmp_path / 'orders_20240101000000.csv').columns) == ['{id}', 'name']
+
+
+def test_tsv_uses_tabs(tmp_path):
+    input_format = sniffed(tmp_path, 'orders_20240101000000.tsv', 'id\tname\n1\ta,b\n')
+    assert (input_format.kind, input_format.delimiter) == ('delimited', '\t')
+
+
+@pytest.mark.parametrize('text, kind, delimiter', [
+    ('{"id": 1}\n{"id": 2}\n', 'jsonl', ','),
+    ('id|name\n1|a\n2|b\n', 'delimited', '|'),
+    ('id   name\n1    alice\n22   bob\n', 'fixed_width', ','),
+])
+def test_other_suffixes_are_sniffed_from_their_contents(tmp_path, text, kind, delimiter):
+    input_format = sniffed(tmp_path, 'orders_20240101000000.txt', text)
+    assert (input_format.kind, input_format.delimiter) == (kind, delimiter)
+
+
+def test_generic_suffixes_are_opt_in():
+    assert is_input_file('orders_20240101000000.CSV')
+    assert not is_input_file('orders_20240101000000.txt')
+    assert is_input_file('orders_20240101000000.txt', {'.txt'})
+
+
+def test_families_pick_up_the_suffixes_they_opt_in_to(pipeline, tmp_path):
+    processor = pipeline([('orders_20240101000000.csv', 'input_suffix', 'txt'),
+                          ('orders_20240101000000.csv', 'duplicate_check', 'id')])
+    for name in ('orders_20240101000000.txt', 'orders_20240102000000.dat', 'notes_20240101000000.txt',
+                 'orders_20240103000000.csv'):
+        write_csv(tmp_path / 'source' / name, ['id'], [[1]])
+    file_manager = processor.file_manager
+    assert sorted(file_manager.get_files_to_process()) == ['orders_20240103000000.csv']
+
+    file_manager.input_suffixes = processor.schema_manager.input_suffixes()
+    assert file_manager.input_suffixes == {'orders_': {'.txt'}}
+    assert sorted(file_manager.get_files_to_process()) == ['orders_20240101000000.txt', 'orders_20240103000000.csv']
+
+
+def test_arrow_jsonl_with_mixed_types_falls_back_to_pandas(caplog):
+    pytest.importorskip('pyarrow')
+    from engines import ArrowEngine
+    data = b'{"id": 1, "name": "a"}\n{"id": "x7", "name": "b"}\n'
+    with caplog.at_level(logging.WARNING):
+        frame = ArrowEngine().read_jsonl(io.BytesIO(data))
+    assert frame['id'].tolist() == [1, 'x7']
+    assert 'fell back to pandas' in caplog.text
@@ -0,0 +1,90 @@
+import sys
+import csv
+import json
+import subprocess
+from pathlib import Path
+
+from conftest import write_csv
+from replay import ReplayHarness, Template, load_trace, synthetic_trace
+
+REPLAY = Path(__file__).resolve().parent.parent / 'dk' / 'replay.py'
+
+
+def replay_files(tmp_path):
+    """Write a template with a quoted multi-line record, and a config that runs the legacy phone check on it."""
+    template = write_csv(tmp_path / 'contacts_20240101000000.csv', ['id', 'phone', 'note'],
+                         [[1, '9845012345', 'plain'], [2, '080 42297555', 'two\nlines'], [3, '', 'none']])
+    write_csv(tmp_path / 'config.csv', ['file_prefix', 'test', 'attribute'],
+              [['contacts_20240101000000.csv', 'phonenumber_check', 'phone'],
+               ['contacts_20240101000000.csv', 'duplicate_check', 'id']])
+    write_csv(tmp_path / 'schema.csv', ['Field Name', 'DataType'], [])
+    return template
+
+
+def test_template_makes_files_of_whole_records(tmp_path):
+    template = Template(replay_files(tmp_path))
+    data, rows = template.make(1)
+    assert rows == 1 and data == template.header + b'1,9845012345,plain\r\n'
+    data, rows = template.make(len(template.header) + 10 * len(template.body))
+    assert rows == 30 and data.count(b'"two\nlines"') == 10
+
+
+def test_template_keys_are_unique_per_copy(tmp_path):
+    template = Template(replay_files(tmp_path))
+    size = len(template.header) + 12 * len(template.body)
+    data, rows = template.make(size, ['id'])
+    assert rows == template.make(size)[1]
+    records = list(csv.DictReader(data.decode('utf-8').splitlines(keepends=True)))
+    assert len(records) == rows and len({record['id'] for record in records}) == rows
+    assert [record['id'] for record in records[:3]] == ['100', '200', '300']
+    assert sum(record['note'] == 'two\nlines' for record in records) == rows // 3
+
+
+def test_latency_log_is_replayed_from_its_first_arrival(tmp_path):
+    write_csv(tmp_path / 'latency.csv', ['file', 'family', 'bytes', 'arrived', 'started', 'finished'],
+              [['b', 'orders_', 200, 105.5, 0, 0], ['a', 'orders_', 100, 100.0, 0, 0]])
+    assert load_trace(tmp_path / 'latency.csv') == [(0.0, 'orders_', 100), (5.5, 'orders_', 200)]
+
+
+def test_replay_processes_every_arrival(tmp_path, capfd):
+    templates = {'contacts_': Template(replay_files(tmp_path))}
+    trace = synthetic_trace(6, 0.02, 300, 'contacts_')
+    harness = ReplayHarness(trace, templates, str(tmp_path / 'config.csv'), str(tmp_path / 'schema.csv'),
+                            tmp_path / 'work', poll_interval=0.01, sample_interval=0.01)
+    report = harness.run()
+
+    assert report['files'] == 6 and report['failed'] == 0
+    assert report['rows'] == 6 * templates['contacts_'].make(300)[1]
+    assert report['latency']['p50'] is not None and report['backlog']['max_files'] >= 0
+    with open(tmp_path / 'work' / 'scanned.csv', newline='') as f:
+        assert sorted(row['files_scanned'] for row in csv.DictReader(f)) == sorted(harness.arrived)
+    assert len(list((tmp_path / 'work' / 'output').glob('*.out.csv'))) == 6
+
+
+class UndiscoveredHarness(ReplayHarness):
+    """Writes the files of the 'unlisted_' family with a suffix that discovery never picks up."""
+
+    def file_name(self, family, index):
+        name = super().file_name(family, index)
+        return name[:-len('.csv')] + '.dat' if family == 'unlisted_' else name
+
+
+def test_files_that_are_never_processed_fail_at_the_deadline(tmp_path):
+    templates = {'contacts_': Template(replay_files(tmp_path))}
+    trace = synthetic_trace(2, 0.01, 300, 'contacts_') + synthetic_trace(1, 0.01, 300, 'unlisted_')
+    harness = UndiscoveredHarness(sorted(trace), templates, str(tmp_path / 'config.csv'), str(tmp_path / 'schema.csv'),
+                                  tmp_path / 'work', poll_interval=0.01, sample_interval=0.01, drain_timeout=0.5)
+    report = harness.run()
+    assert report['files'] == 3 and report['failed'] == 1
+    assert harness.failed == {name for name in harness.arrived if name.startswith('unlisted_')}
+
+
+def test_report_is_the_only_output_on_stdout(tmp_path):
+    template = replay_files(tmp_path)
+    done = subprocess.run([sys.executable, str(REPLAY), 'config.csv', 'schema.csv', str(template),
+                           '--files', '2', '--interval', '0', '--file-size', '2000', '--poll-interval', '0.01',
+                           '--work-dir', 'work'],
+                          cwd=tmp_path, check=True, capture_output=True, text=True, timeout=60)
+    assert 'Record Done' in done.stderr
+    report = json.loads(done.stdout)
+    assert report['files'] == 2 and report['failed'] == 0
@@ -0,0 +1,56 @@
+import os
+import time
+
+from scheduler import Scheduler, percentile
+
+
+def pending(tmp_path, sizes, ages=None):
+    """Write files of the given sizes, each with an mtime ages[name] seconds ago, and return their names."""
+    now = time.time()
+    for name, size in sizes.items():
+        (tmp_path / name).write_bytes(b'x' * size)
+        age = (ages or {}).get(name, 0)
+        os.utime(tmp_path / name, (now - age, now - age))
+    return list(sizes)
+
+
+def test_smallest_first(tmp_path):
+    files = pending(tmp_path, {'a_20240101000000.csv': 300, 'b_20240101000000.csv': 100, 'c_20240101000000.csv': 200})
+    assert Scheduler('smallest', tmp_path, {}).order(files) == [
+        'b_20240101000000.csv', 'c_20240101000000.csv', 'a_20240101000000.csv']
+
+
+def test_aging_lets_waiting_large_files_ahead(tmp_path):
+    files = pending(tmp_path, {'big_20240101000000.csv': 4000, 'small_20240101000000.csv': 1000},
+                    {'big_20240101000000.csv': 3 * 3600})
+    assert Scheduler('smallest', tmp_path, {}).order(files)[0] == 'big_20240101000000.csv'
+    assert Scheduler('smallest', tmp_path, {}, aging=0).order(files)[0] == 'small_20240101000000.csv'
+
+
+def test_files_that_waited_for_years_are_ordered(tmp_path):
+    files = pending(tmp_path, {'old_20240101000000.csv': 10 ** 6, 'new_20240101000000.csv': 10},
+                    {'old_20240101000000.csv': 3 * 365 * 86400})
+    assert Scheduler('smallest', tmp_path, {}).order(files) == ['old_20240101000000.csv', 'new_20240101000000.csv']
+
+
+def test_priority_and_oldest(tmp_path):
+    files = pending(tmp_path, {'a_20240103000000.csv': 1, 'b_20240101000000.csv': 1, 'c_20240102000000.csv': 1})
+    config = {'c_': {'priority': ['5']}, 'a_': {'priority': ['1']}}
+    assert Scheduler('priority', tmp_path, config).order(files) == [
+        'c_20240102000000.csv', 'a_20240103000000.csv', 'b_20240101000000.csv']
+    assert Scheduler('oldest', tmp_path, config).order(files) == [
+        'b_20240101000000.csv', 'c_20240102000000.csv', 'a_20240103000000.csv']
+    assert Scheduler('listdir', tmp_path, config).order(files) == files
+
+
+def test_vanished_files_are_left_out(tmp_path):
+    files = pending(tmp_path, {'a_20240101000000.csv': 300, 'b_20240101000000.csv': 100})
+    (tmp_path / 'a_20240101000000.csv').unlink()
+    for policy in ('priority', 'oldest', 'smallest'):
+        assert Scheduler(policy, tmp_path, {}).order(files + ['c_20240101000000.csv']) == ['b_20240101000000.csv']
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([5, 1, 3], 95) == 4.8
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+from conftest import write_csv
+from service import ValidationService, is_loopback, make_server
+
+FILE = 'orders_20240101000000.csv'
+
+
+@pytest.fixture
+def service(tmp_path):
+    """A service over a source directory holding one file with a duplicate id."""
+    write_csv(tmp_path / 'source' / FILE, ['id', 'name'], [[1, 'a'], [2, 'b'], [1, 'c']])
+    write_csv(tmp_path / 'config.csv', ['file_prefix', 'test', 'attribute'], [[FILE, 'duplicate_check', 'id']])
+    write_csv(tmp_path / 'schema.csv', ['Field Name', 'DataType'], [])
+    write_csv(tmp_path / 'scanned.csv', ['files_scanned'], [])
+    (tmp_path / 'output').mkdir()
+    return ValidationService(tmp_path / 'source', str(tmp_path / 'scanned.csv'), str(tmp_path / 'config.csv'),
+                             str(tmp_path / 'schema.csv'), tmp_path / 'output')
+
+
+@pytest.mark.parametrize('listen', ['127.0.0.1:0', 'localhost:0', ':0'])
+def test_listens_on_loopback(listen):
+    server = make_server(listen, service=None)
+    try:
+        assert server.server_address[0] == '127.0.0.1'
+    finally:
+        server.server_close()
+
+
+@pytest.mark.parametrize('listen', ['0.0.0.0:0', '10.1.2.3:8765', 'no-such-host.invalid:8765'])
+def test_refuses_other_hosts(listen):
+    with pytest.raises(ValueError, match='not a loopback address'):
+        make_server(listen, service=None)
+
+
+def test_other_hosts_are_allowed_explicitly():
+    server = make_server('0.0.0.0:0', service=None, allow_remote=True)
+    try:
+        assert server.server_address[0] == '0.0.0.0'
+    finally:
+        server.server_close()
+
+
+def test_loopback_addresses():
+    assert is_loopback('127.0.0.2')
+    assert not is_loopback('192.168.1.10')
+
+
+def test_validate_writes_outputs_and_returns_a_summary(service, tmp_path):
+    result = service.validate(tmp_path / 'source' / FILE)
+    assert result['cached'] is False and result['file'] == FILE and result['rows'] == 3
+    assert sorted(result['outputs']) == ['bad', 'metadata', 'out']
+    assert (tmp_path / 'output' / 'orders_20240101000000.bad.csv').read_text().splitlines()[1:] == ['1,a', '1,c']
+
+
+def test_validate_returns_the_cached_result_of_an_unchanged_file(service, tmp_path):
+    first = service.validate(FILE)
+    (tmp_path / 'output' / 'orders_20240101000000.out.csv').unlink()
+    second = service.validate(tmp_path / 'source' / FILE)
+    assert second == dict(first, cached=True)
+    assert not (tmp_path / 'output' / 'orders_20240101000000.out.csv').exists()
+
+
+def test_concurrent_requests_validate_a_file_once(service, tmp_path):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.validate(FILE))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(result['cached'] for result in results) == [False, True]
+    assert dict(results[0], cached=None) == dict(results[1], cached=None)
+
+
+def test_validate_refuses_files_outside_the_source_directory(service, tmp_path):
+    other = write_csv(tmp_path / 'elsewhere' / FILE, ['id', 'name'], [[1, 'a']])
+    with pytest.raises(ValueError, match='not in the source directory'):
+        service.validate(other)
+    with pytest.raises(ValueError, match='not in the source directory'):
+        service.validate(f"../elsewhere/{FILE}")
+    assert not (tmp_path / 'output' / 'orders_20240101000000.out.csv').exists()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import subprocess
+from pathlib import Path
+
+import pytest
+
+DQM3 = Path(__file__).resolve().parent.parent / 'dk' / 'dqm3.py'
+
+# Modules an empty poll must not load: pandas and numpy, and those of features that are not in use.
+OPTIONAL_MODULES = ['numpy', 'pandas', 'multiprocessing', 'concurrent.futures.process', 'leases', 'tail', 'fuzzy',
+                    'governor', 'dataset', 'parsecache', 'checkcache', 'cdc', 'lookup', 'phones']
+
+POLL_MODULES = """
+import os, runpy, sys
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+import importlib.util
+# Modules imported with lazy.lazy_import are only placeholders until first used.
+print(' '.join(name for name, module in sys.modules.items() if not isinstance(module, importlib.util._LazyModule)))
+"""
+
+
+# The standard modules the pipeline imports on every run, whose import time is not under its control.
+STDLIB_IMPORTS = ('import re, io, os, sys, csv, json, time, shutil, hashlib, logging, argparse, itertools, pathlib, '
+                  'importlib.util')
+
+
+@pytest.fixture
+def empty_poll(tmp_path):
+    """Arguments of a run over an empty source directory that has been polled once already."""
+    (tmp_path / 'source').mkdir()
+    (tmp_path / 'config.csv').write_text('file_prefix,test,attribute\n')
+    (tmp_path / 'schema.csv').write_text('Field Name,DataType\n')
+    (tmp_path / 'scanned.csv').write_text('files_scanned\n')
+    # The directory last changed a while ago, so the first poll remembers that it found nothing.
+    then = time.time_ns() - 3600 * 10 ** 9
+    os.utime(tmp_path / 'source', ns=(then, then))
+    args = [str(DQM3), 'source', 'scanned.csv', 'config.csv', 'schema.csv', 'output']
+    subprocess.run([sys.executable] + args, cwd=tmp_path, check=True, capture_output=True)
+    return args
+
+
+def best_time(command, cwd, runs=5):
+    """Shortest wall time of a few runs of command, the least disturbed by other load on the machine."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, capture_output=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_empty_poll_loads_no_optional_modules(tmp_path, empty_poll):
+    done = subprocess.run([sys.executable, '-c', POLL_MODULES] + empty_poll, cwd=tmp_path, check=True,
+                          capture_output=True, text=True)
+    assert b'no new files' in (tmp_path / 'file_processor.log').read_bytes()
+    loaded = set(done.stdout.split())
+    assert [module for module in OPTIONAL_MODULES if module in loaded] == []
+
+
+def test_empty_poll_starts_quickly(tmp_path, empty_poll):
+    # Timed against an interpreter that imports the same standard modules, so only the pipeline's own code counts.
+    baseline = best_time([sys.executable, '-c', STDLIB_IMPORTS], tmp_path)
+    poll = best_time([sys.executable] + empty_poll, tmp_path)
+    assert poll - baseline < 0.1
@@ -0,0 +1,87 @@
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import write_csv
+from engines import ENGINES
+
+
+@pytest.mark.parametrize('data_type, valid, invalid', [
+    ('int', ['1', '-42', '7.0'], ['1.5', 'abc']),
+    ('bigint', ['9007199254740993'], ['1e-3']),
+    ('float', ['1.5', '-2', '3e4'], ['abc', '1,5']),
+    ('date', ['2024-01-01', '2024-02-29'], ['2024-13-01', 'yesterday']),
+    ('date(%Y%m%d)', ['20240101', '20241231'], ['99999999', '2024-01-01']),
+    ('date(%d/%m/%Y)', ['31/01/2024'], ['01/31/2024']),
+    ('bool', ['true', 'No', ' Y ', '0'], ['maybe', '2']),
+    ('email', ['a.b@example.com'], ['a@b', 'example.com']),
+    ('url', ['https://example.com/path', 'www.example.com'], ['localhost', 'ftp://example.com']),
+    ('regex([A-Z]{2}\\d{3})', ['AB123'], ['ab123', 'AB1234']),
+    ('varchar(3)', ['abc', 'ab'], ['abcd']),
+    ('string', ['anything at all'], []),
+])
+def test_values_of_each_type(pipeline, data_type, valid, invalid):
+    processor = pipeline([])
+    column = pd.Series(valid + invalid + [None], dtype=object)
+    mask = processor.invalid_type_mask(column, data_type)
+    assert mask.tolist() == [False] * len(valid) + [True] * len(invalid) + [False]
+
+
+def test_unknown_type_accepts_every_value(pipeline):
+    processor = pipeline([])
+    assert not processor.invalid_type_mask(pd.Series(['x', 'y']), 'geometry').any()
+
+
+def test_compact_dates_are_not_taken_for_epoch_numbers(pipeline):
+    processor = pipeline([])
+    column = pd.Series([20240101, 99999999, None])
+    assert processor.invalid_type_mask(column, 'date').tolist() == [False, True, False]
+
+
+def test_dates_without_a_format_are_parsed_one_by_one(pipeline):
+    processor = pipeline([])
+    column = pd.Series(['2024-01-05', '05/01/2024', '2024-02-30', 'Jan 5 2024', None, '2024-01-05 10:00'])
+    assert processor.invalid_type_mask(column, 'date').tolist() == [False, False, True, False, False, False]
+    reordered = column.iloc[[3, 1, 0, 5, 2, 4]]
+    assert processor.invalid_type_mask(reordered, 'datetime').tolist() == [False, False, False, False, True, False]
+
+
+def test_mixed_date_formats_are_flagged_alike_in_every_chunk(pipeline, tmp_path):
+    present_file = 'events_20240101000000.csv'
+    write_csv(tmp_path / 'source' / present_file, ['id', 'day'],
+              [[1, 'Jan 5 2024'], [2, '2024-01-05'], [3, '2024-02-30'], [4, '05/01/2024'], [5, 'soon'],
+               [6, '2024-01-05 10:00']])
+    config, schema = [(present_file, 'type_check', 'day')], [('day', 'date')]
+    bad_ids = []
+    for chunk_size in (None, 40):
+        if chunk_size is None:
+            processor = pipeline(config, schema)
+            processor.process_file(present_file)
+        else:
+            processor = pipeline(config, schema, chunk_size=chunk_size, checkpoint_dir=tmp_path / 'checkpoints')
+            processor.process_file_chunked(present_file)
+        bad = pd.read_csv(tmp_path / 'output' / 'events_20240101000000.bad.csv', dtype=str)
+        bad_ids.append(sorted(bad['id'].tolist()))
+    assert bad_ids == [['3', '5'], ['3', '5']]
+
+
+@pytest.mark.parametrize('engine_name, suffix', [('pandas', 'csv'), ('pandas', 'jsonl'), ('arrow', 'csv'), ('arrow', 'jsonl')])
+def test_compact_date_column_with_a_blank(pipeline, tmp_path, engine_name, suffix):
+    if engine_name == 'arrow':
+        pytest.importorskip('pyarrow')
+    present_file = f"events_20240101000000.{suffix}"
+    processor = pipeline([(present_file, 'type_check', 'day')], [('day', 'date(%Y%m%d)')],
+                         engine=ENGINES[engine_name]())
+    rows = [[1, 20240101], [2, None], [3, 99999999]]
+    if suffix == 'csv':
+        write_csv(tmp_path / 'source' / present_file, ['id', 'day'], rows)
+    else:
+        (tmp_path / 'source' / present_file).write_text(
+            ''.join(json.dumps({'id': id, 'day': day}) + '\n' for id, day in rows))
+    processor.process_one(present_file)
+
+    bad = pd.read_csv(tmp_path / 'output' / 'events_20240101000000.bad.csv', dtype=str)
+    assert bad['id'].tolist() == ['3']
+    clean = pd.read_csv(tmp_path / 'output' / 'events_20240101000000.out.csv', dtype=str)
+    assert clean['day'].fillna('').tolist() == ['20240101', '']